@@ -0,0 +1,198 @@
+"""出力ファイルの作成・読み込みのベンチマーク
+
+create_excel・extract_info_from_xlsx・create_minutes（Excelの読み込みから議事録の保存まで）・write_transcript_docx・
+read_transcript_docx を、合成した会議データ（議題10〜500件、文字起こし10KB〜5MB）で実行し、
+処理時間（中央値）とピークメモリを測ります。
+
+使い方:
+    python benchmarks/benchmark_documents.py                    # 基準値と比べて、悪化していれば終了コード1
+    python benchmarks/benchmark_documents.py --update-baseline  # 今回の結果を基準値として保存
+    python benchmarks/benchmark_documents.py --quick            # 大きいケースを省いて素早く確認
+
+基準値（baselines.json）は測ったマシンに依存します。別のマシンで比べるときは、
+まずそのマシンで --update-baseline を実行してください。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import openpyxl
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import minutes_app  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+TOPIC_COUNTS = [10, 50, 100, 500]
+TRANSCRIPT_SIZES = [10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024]  # UTF-8でのバイト数
+QUICK_TOPIC_COUNTS = [10, 100]
+QUICK_TRANSCRIPT_SIZES = [10 * 1024, 1024 * 1024]
+
+# 合成する文章の材料（会議でよく出る言い回し）
+PHRASES = [
+    "来期の予算について確認します", "新製品の発売時期を検討しました", "営業部からの報告です",
+    "前回の議事録に修正はありません", "担当者を決めて来週までに対応します", "価格の見直しが必要です",
+    "お客様からの問い合わせが増えています", "スケジュールに遅れはありません", "リスクを洗い出しておきます",
+    "次回の会議は再来週の火曜日です", "資料は共有フォルダに置きました", "品質の基準を満たしています",
+    "えーと、その件については", "はい、承知しました", "少し補足させてください",
+]
+
+def topic_label(number):
+    """議題の番号を作る（⑳までは丸数字、それ以降は数字）"""
+    return f"議題{chr(0x2460 + number - 1)}" if number <= 20 else f"議題{number}"
+
+def make_japanese_text(rng, size_bytes):
+    """指定したバイト数ほどの日本語の文章を作る"""
+    sentences = []
+    total = 0
+    while total < size_bytes:
+        sentence = rng.choice(PHRASES) + "。"
+        sentences.append(sentence)
+        total += len(sentence.encode('utf-8'))
+    return "".join(sentences)
+
+def make_extracted_info(rng, num_topics):
+    """Geminiの抽出結果と同じ形式のテキストを作る"""
+    lines = []
+    for number in range(1, num_topics + 1):
+        label = topic_label(number)
+        lines.append(f"{label}: {rng.choice(PHRASES)}")
+        lines.append(f"{label}の要約: {make_japanese_text(rng, 600)}")
+        lines.append("")
+    return "\n".join(lines)
+
+def make_transcript_paragraphs(rng, size_bytes, num_chunks=10):
+    """チャンクごとの文字起こし結果（段落のリスト）を作る"""
+    return [make_japanese_text(rng, size_bytes // num_chunks) for _ in range(num_chunks)]
+
+def fill_meeting_details(xlsx_path):
+    """利用者が手で入力する会議名・日時などの欄を埋める"""
+    wb = openpyxl.load_workbook(xlsx_path)
+    sheet = wb.active
+    for row, value in enumerate(["定例会議", "2024-04-01", "第1会議室", "山田、佐藤、鈴木", "田中"], start=1):
+        sheet.cell(row=row, column=2, value=value)
+    wb.save(xlsx_path)
+
+def format_size(size_bytes):
+    return f"{size_bytes // (1024 * 1024)}MB" if size_bytes >= 1024 * 1024 else f"{size_bytes // 1024}KB"
+
+def build_cases(work_dir, topic_counts, transcript_sizes):
+    """（ケース名, 準備済みの関数）のリストを作る"""
+    rng = random.Random(0)  # 毎回同じデータにします
+    template_path = os.path.join(minutes_app.get_current_dir(), 'テンプレート.docx')
+    cases = []
+    for num_topics in topic_counts:
+        extracted_info = make_extracted_info(rng, num_topics)
+        xlsx_path = os.path.join(work_dir, f"topics_{num_topics}.xlsx")
+        minutes_app.create_excel(extracted_info, xlsx_path)
+        fill_meeting_details(xlsx_path)
+        output_path = os.path.join(work_dir, f"create_excel_{num_topics}.xlsx")
+        cases.append((f"create_excel/topics={num_topics}",
+                      lambda info=extracted_info, path=output_path: minutes_app.create_excel(info, path)))
+        cases.append((f"extract_info_from_xlsx/topics={num_topics}",
+                      lambda path=xlsx_path: minutes_app.extract_info_from_xlsx(path)))
+        if os.path.exists(template_path):
+            # テンプレートへの書き込みだけでなく、Excelの読み込みとWordファイルの保存まで測ります
+            minutes_path = os.path.join(work_dir, f"minutes_{num_topics}.docx")
+            cases.append((f"create_minutes/topics={num_topics}",
+                          lambda xlsx=xlsx_path, path=minutes_path: minutes_app.create_minutes(xlsx, template_path, path)))
+    for size_bytes in transcript_sizes:
+        paragraphs = make_transcript_paragraphs(rng, size_bytes)
+        docx_path = os.path.join(work_dir, f"transcript_{size_bytes}.docx")
+        minutes_app.write_transcript_docx(docx_path, paragraphs)
+        cases.append((f"write_transcript_docx/size={format_size(size_bytes)}",
+                      lambda paragraphs=paragraphs, path=docx_path: minutes_app.write_transcript_docx(path, paragraphs)))
+        cases.append((f"read_transcript_docx/size={format_size(size_bytes)}",
+                      lambda path=docx_path: minutes_app.read_transcript_docx(path)))
+    return cases
+
+def measure(function, repeat):
+    """処理時間の中央値（秒）とピークメモリ（MB）を測る"""
+    # ピークメモリはtracemallocで別に測ります（測っている間は遅くなるため、時間とは分けます）
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(timings), peak / (1024 * 1024)
+
+def compare_with_baseline(results, baseline, tolerance):
+    """基準値より悪化したケースの説明のリストを返す"""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get('cases', {}).get(name)
+        if not expected:
+            continue
+        for metric, unit in (('seconds', '秒'), ('peak_mb', 'MB')):
+            # ごく小さい値はぶれが大きいので、最低限の余裕を持たせます
+            allowed = max(expected[metric] * (1 + tolerance), expected[metric] + (0.01 if metric == 'seconds' else 1.0))
+            if result[metric] > allowed:
+                regressions.append(f"{name}: {metric} {result[metric]:.3f}{unit}（基準値 {expected[metric]:.3f}{unit}）")
+    return regressions
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="出力ファイルの作成・読み込みのベンチマーク")
+    arg_parser.add_argument('--update-baseline', action='store_true', help="今回の結果を基準値として保存します")
+    arg_parser.add_argument('--quick', action='store_true', help="大きいケースを省きます")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="時間を測る回数（中央値を使います）")
+    arg_parser.add_argument('--tolerance', type=float, default=0.25, help="基準値からの悪化の許容割合")
+    arg_parser.add_argument('--filter', default='', help="名前にこの文字列を含むケースだけを実行します")
+    args = arg_parser.parse_args(argv)
+
+    # アプリのログと確認用の表示は測定の邪魔になるので抑えます
+    logging.getLogger().setLevel(logging.WARNING)
+    topic_counts = QUICK_TOPIC_COUNTS if args.quick else TOPIC_COUNTS
+    transcript_sizes = QUICK_TRANSCRIPT_SIZES if args.quick else TRANSCRIPT_SIZES
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cases = build_cases(work_dir, topic_counts, transcript_sizes)
+        for name, function in cases:
+            if args.filter not in name:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, peak_mb = measure(function, args.repeat)
+            results[name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2)}
+            print(f"{name:50s} {seconds * 1000:10.1f}ms {peak_mb:10.1f}MB")
+
+    if args.update_baseline:
+        baseline = json.loads(BASELINE_PATH.read_text(encoding='utf-8')) if BASELINE_PATH.exists() else {}
+        baseline['machine'] = f"{platform.system()} {platform.machine()} / Python {platform.python_version()}"
+        baseline.setdefault('cases', {}).update(results)
+        BASELINE_PATH.write_text(json.dumps(baseline, ensure_ascii=False, indent=2, sort_keys=True) + "\n", encoding='utf-8')
+        print(f"基準値を保存しました: {BASELINE_PATH}")
+        return 0
+
+    if not BASELINE_PATH.exists():
+        print("基準値がありません。--update-baselineで作成してください。")
+        return 0
+    baseline = json.loads(BASELINE_PATH.read_text(encoding='utf-8'))
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"基準値（{baseline.get('machine', '')}）より悪化したケースがあります:")
+        for regression in regressions:
+            print(f"- {regression}")
+        return 1
+    print("基準値からの悪化はありません。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,5 @@
 import os
 import json
-import google.generativeai as genai
 import openpyxl
 import logging
 import argparse
@@ -10,17 +9,45 @@ from dotenv import load_dotenv
 import subprocess
 import concurrent.futures
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import threading
 import sys
 from pathlib import Path
 import time
 import google.api_core.exceptions
+import google.ai.generativelanguage as glm
 from docx import Document
 import datetime
 import xml.parsers.expat
 import webbrowser
 from dateutil import parser
+import mmap
+import struct
+from array import array
+import hashlib
+import ctypes
+import ctypes.util
+import select
+import itertools
+import contextlib
+import queue
+import random
+import sqlite3
+import shutil
+import tempfile
+import hmac
+import http.server
+import urllib.parse
+import urllib.request
+import urllib.error
+import socket
+import zoneinfo
+import math
+import re
+import zlib
+import functools
+import asyncio
+import difflib
 
 # ユーザーディレクトリのDocumentsフォルダのパスを取得
 documents_path = Path.home() / "Documents"
@@ -63,6 +90,8 @@ API_KEYS = [os.getenv(f'GEMINI_API_KEY_{i}') for i in range(1, 11)]  # 10個のA
 
 # 処理済みファイルのログファイル
 PROCESSED_FILES_LOG = os.path.join(current_dir, 'processed_files.json')
+# 処理済みファイルの中身のハッシュを記録するファイル（監視モードの重複チェックに使います）
+PROCESSED_HASHES_LOG = os.path.join(current_dir, 'processed_hashes.json')
 
 def load_processed_files():
     # この関数は、すでに処理したファイルのリストを読み込みます。
@@ -140,6 +169,208 @@ def create_extraction_prompt(text):
     {text}
     """
 
+def create_topic_extraction_prompt(label, text):
+    # この関数は、1つの議題に関する部分だけから議題と要約を作り直す指示を作ります。
+    return f"""
+    この文章はとある会議の内容のうち、1つの議題に関する部分です。
+    以下の文章から、議題とその要約を抽出してください。
+
+    必ず以下の形式の2行だけを出力してください：
+    {label}: [議題の内容]
+    {label}の要約: [要約内容]
+
+    注意事項:
+    - 要約は簡潔かつ具体的にしてください。
+    - 議題の番号は「{label}」のまま変えないでください。
+    - 議題や要約の前に「*」や「**」などの記号を付けないでください。
+
+    文章:
+    {text}
+    """
+
+# 処理時間のヒストグラムの区切り（秒）
+METRICS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+# 指標の説明（Prometheusの# HELPに使います）
+METRICS_HELP = {
+    'minutes_api_requests_total': "Gemini APIへのリクエスト数",
+    'minutes_api_rate_limited_total': "利用制限（429）で断られたリクエスト数",
+    'minutes_api_errors_total': "利用制限以外のエラーで失敗したリクエスト数",
+    'minutes_api_latency_seconds': "Gemini APIのリクエストにかかった時間",
+    'minutes_upload_bytes_total': "送信した音声のバイト数",
+    'minutes_retries_total': "使ったリトライの回数",
+    'minutes_cache_lookups_total': "キャッシュを調べた回数",
+    'minutes_stage_duration_seconds': "処理の段階ごとにかかった時間",
+    'minutes_chunks_waiting': "APIキーの空きを待っているチャンクの数",
+    'minutes_jobs': "状態ごとのジョブの数",
+}
+
+class MetricsRegistry:
+    """カウンター・ゲージ・ヒストグラムを覚えておく係"""
+    # ログを読まなくても、キーごとのリクエスト数や429の数、処理時間の分布がわかるようにします。
+    # 値はラベル（キーの指紋、段階など）の組ごとに持ちます。
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}  # (名前, ラベル) -> 値
+        self.gauges = {}  # (名前, ラベル) -> 値
+        self.histograms = {}  # (名前, ラベル) -> {'buckets': [...], 'sum': 合計, 'count': 件数}
+        self.gauge_callbacks = {}  # 名前 -> 書き出すときに{ラベル: 値}を返す関数
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """カウンターを増やす"""
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """ゲージの値を設定する"""
+        with self.lock:
+            self.gauges[(name, self._labels(labels))] = value
+
+    def add_gauge(self, name, amount, **labels):
+        """ゲージの値を増減する"""
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    def register_gauge(self, name, callback):
+        """書き出すときに値を計算するゲージを登録する（ジョブの数など）"""
+        with self.lock:
+            self.gauge_callbacks[name] = callback
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに1件の値を加える"""
+        key = (name, self._labels(labels))
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """with文の中にかかった時間をヒストグラムに加える"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def _gauge_items(self):
+        items = dict(self.gauges)
+        for name, callback in self.gauge_callbacks.items():
+            try:
+                values = callback()
+            except Exception as e:
+                logging.warning(f"指標{name}を計算できませんでした: {str(e)}")
+                continue
+            for labels, value in values.items():
+                items[(name, self._labels(dict(labels)))] = value
+        return items
+
+    def snapshot(self):
+        """すべての指標をJSONにできる形で返す"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+            callbacks_gauges = self._gauge_items()
+        snapshot = {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'counters': [], 'gauges': [], 'histograms': []}
+        for kind, items in (('counters', counters), ('gauges', callbacks_gauges)):
+            for (name, labels), value in sorted(items.items()):
+                snapshot[kind].append({'name': name, 'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            snapshot['histograms'].append({
+                'name': name, 'labels': dict(labels), 'count': histogram['count'], 'sum': round(histogram['sum'], 6),
+                'buckets': dict(zip([str(bound) for bound in self.buckets], histogram['buckets'])),
+            })
+        return snapshot
+
+    def to_prometheus(self):
+        """Prometheusのテキスト形式で書き出す"""
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+            gauges = self._gauge_items()
+        lines = []
+        for kind, items in (('counter', counters), ('gauge', gauges)):
+            for name, group in itertools.groupby(sorted(items.items()), key=lambda item: item[0][0]):
+                lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (_, labels), value in group:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, group in itertools.groupby(sorted(histograms.items()), key=lambda item: item[0][0]):
+            lines.append(f"# HELP {name} {METRICS_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (_, labels), histogram in group:
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', str(bound))])} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+# アプリ全体で1つの指標の置き場
+metrics = MetricsRegistry()
+
+def timed_stage(stage):
+    """関数の処理時間を段階ごとの指標に加えるデコレーター"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.timer('minutes_stage_duration_seconds', stage=stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_metrics_snapshot_path():
+    """指標のスナップショットを書き出すファイルのパスを返す関数"""
+    return get_settings_path().parent / "metrics.json"
+
+def write_metrics_snapshot():
+    """今の指標をJSONファイルに書き出す関数"""
+    snapshot_path = get_metrics_snapshot_path()
+    try:
+        with open(f"{snapshot_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(metrics.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(f"{snapshot_path}.tmp", snapshot_path)
+    except OSError as e:
+        logging.warning(f"指標のスナップショットを書き出せませんでした: {str(e)}")
+
+def start_metrics_snapshots(stop_event=None):
+    """metrics_snapshot_secondsごとに指標をJSONファイルに書き出すスレッドを始める関数"""
+    # 0（既定）なら書き出しません。ジョブサーバーでは/metricsでも同じ指標を取れます。
+    interval = float(load_settings().get('metrics_snapshot_seconds', 0))
+    if interval <= 0:
+        return None
+    stop_event = stop_event or threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            write_metrics_snapshot()
+        write_metrics_snapshot()
+
+    thread = threading.Thread(target=run, name="metrics-snapshot", daemon=True)
+    thread.start()
+    logging.info(f"指標を{interval:g}秒ごとに{get_metrics_snapshot_path()}へ書き出します。")
+    return thread
+
 def get_ffmpeg_path():
     """ffmpegのパスを取得する関数"""
     # この関数は、ffmpegというプログラムがどこにあるかを教えてくれます
@@ -158,73 +389,471 @@ def get_ffprobe_path():
     else:
         return Path(__file__).resolve().parent / "ffprobe"  # 開発環境でのffprobeのパス
 
-def split_audio_file(audio_file_path, num_parts):
-    """音声ファイルを指定された数の部分に重なりを持たせて分割する関数"""
-    # この関数は、長い音声ファイルを小さな部分に分けます。
-    # 分けた部分は少し重なりを持つので、途切れないようになっています。
+# MP3フレームヘッダーを読むための表です
+# ビットレート（kbps）: (MPEG1かどうか, レイヤー) ごとのインデックス表
+MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# サンプリングレート: バージョンビット（3=MPEG1, 2=MPEG2, 0=MPEG2.5）ごとの表
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+# 一度作ったフレーム索引を覚えておく場所（パス・サイズ・更新時刻が同じなら使い回します）
+_mp3_index_cache = {}
+
+def parse_mp3_frame_header(header):
+    """4バイトのMP3フレームヘッダーを解析する関数"""
+    # この関数は、フレームの長さやサンプル数などを調べます。
+    # フレームとして正しくない場合はNoneを返します。
+    b0, b1, b2, b3 = header
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None  # 同期ビットがありません
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        # 予約値や自由フォーマット（ビットレート0）は扱いません
+        return None
+
+    is_mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(is_mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+
+    # フレームの長さ（バイト数）と1フレームあたりのサンプル数を計算します
+    if layer == 1:
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+        samples = 384
+    elif layer == 3 and not is_mpeg1:
+        frame_length = 72 * bitrate // sample_rate + padding
+        samples = 576
+    else:
+        frame_length = 144 * bitrate // sample_rate + padding
+        samples = 1152
+
+    return {
+        'version_bits': version_bits,
+        'layer': layer,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'length': frame_length,
+        'mono': (b3 >> 6) == 3,
+        'is_mpeg1': is_mpeg1,
+    }
 
-    file_size = os.path.getsize(audio_file_path)  # ファイルの大きさを調べます
-    duration = get_audio_duration(audio_file_path)  # 音声ファイルの長さを取得します
+def _skip_id3v2_tags(data):
+    """ファイル先頭のID3v2タグを読み飛ばして、音声データの開始位置を返す関数"""
+    pos = 0
+    # ID3v2タグは複数続くことがあるので、なくなるまで読み飛ばします
+    while data[pos:pos + 3] == b'ID3' and pos + 10 <= len(data):
+        flags = data[pos + 5]
+        size_bytes = data[pos + 6:pos + 10]
+        # サイズは「7ビットずつ」の特別な形式で書かれています
+        size = 0
+        for b in size_bytes:
+            size = (size << 7) | (b & 0x7F)
+        pos += 10 + size + (10 if flags & 0x10 else 0)
+    return pos
+
+def _read_info_frame(data, pos, frame):
+    """先頭フレームがXing/Info/VBRIの情報フレームかどうかを調べる関数"""
+    # この関数は、情報フレームの場合にフレーム数とエンコーダーの遅延・パディングを返します。
+    # 情報フレームでなければNoneを返します。
+    if frame['layer'] != 3:
+        return None
+
+    # Xing/Infoタグの位置はサイド情報の長さで決まります
+    if frame['is_mpeg1']:
+        side_info = 17 if frame['mono'] else 32
+    else:
+        side_info = 9 if frame['mono'] else 17
+    xing_pos = pos + 4 + side_info
+    tag = data[xing_pos:xing_pos + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing_pos + 4:xing_pos + 8])[0]
+        cursor = xing_pos + 8
+        frames = None
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[cursor:cursor + 4])[0]
+            cursor += 4
+        if flags & 0x02:
+            cursor += 4  # バイト数
+        if flags & 0x04:
+            cursor += 100  # シーク用の目次
+        if flags & 0x08:
+            cursor += 4  # 品質
+        delay = padding = 0
+        # LAMEタグがあれば、先頭の無音（遅延）と末尾のパディングを読み取ります
+        if data[cursor:cursor + 4] in (b'LAME', b'Lavf', b'Lavc'):
+            delay_bytes = data[cursor + 21:cursor + 24]
+            if len(delay_bytes) == 3:
+                delay = (delay_bytes[0] << 4) | (delay_bytes[1] >> 4)
+                padding = ((delay_bytes[1] & 0x0F) << 8) | delay_bytes[2]
+        return {'frames': frames, 'delay': delay, 'padding': padding}
+
+    # VBRIタグはヘッダーから32バイト後ろの固定位置にあります
+    vbri_pos = pos + 4 + 32
+    if data[vbri_pos:vbri_pos + 4] == b'VBRI':
+        frames = struct.unpack('>I', data[vbri_pos + 14:vbri_pos + 18])[0]
+        return {'frames': frames, 'delay': 0, 'padding': 0}
+    return None
+
+def build_mp3_frame_index(audio_file_path):
+    """MP3ファイルのフレーム位置の索引を作る関数"""
+    # この関数は、ffprobeを使わずにMP3ファイルの中のフレームを一つずつ数えます。
+    # 索引があれば、正確な長さがわかり、フレームの区切りでそのまま切り出せます。
+    # MP3として読めない場合はNoneを返します（そのときはffmpegを使います）。
+    with open(audio_file_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None  # 空のファイルはmmapできません
+    try:
+        size = len(data)
+        # 末尾のID3v1タグ（128バイト）は音声データではありません
+        end = size - 128 if size >= 128 and data[size - 128:size - 125] == b'TAG' else size
+
+        pos = _skip_id3v2_tags(data)
+        first = None
+        # 最初のフレームを探します（次のフレームも正しく続くことを確認します）
+        while pos + 4 <= end:
+            pos = data.find(b'\xff', pos, end)
+            if pos < 0 or pos + 4 > end:
+                return None
+            frame = parse_mp3_frame_header(data[pos:pos + 4])
+            if frame:
+                next_pos = pos + frame['length']
+                next_frame = parse_mp3_frame_header(data[next_pos:next_pos + 4]) if next_pos + 4 <= end else None
+                if next_pos == end or (next_frame and next_frame['sample_rate'] == frame['sample_rate']
+                                       and next_frame['layer'] == frame['layer']):
+                    first = frame
+                    break
+            pos += 1
+        if not first:
+            return None
+
+        # 先頭がXing/Info/VBRIの情報フレームなら、音声としては数えません
+        info = _read_info_frame(data, pos, first)
+        if info:
+            pos += first['length']
+
+        offsets = array('Q')
+        while pos + 4 <= end:
+            frame = parse_mp3_frame_header(data[pos:pos + 4])
+            if (frame and frame['version_bits'] == first['version_bits'] and frame['layer'] == first['layer']
+                    and frame['sample_rate'] == first['sample_rate'] and pos + frame['length'] <= end):
+                offsets.append(pos)
+                pos += frame['length']
+                continue
+            # 途中にゴミがある場合は、次の同期ビットまで読み飛ばします
+            next_sync = data.find(b'\xff', pos + 1, end)
+            if next_sync < 0:
+                break
+            pos = next_sync
+
+        if not offsets:
+            return None
+        # 最後のフレームの終わりも入れておくと、切り出しが簡単になります
+        last = offsets[-1]
+        offsets.append(last + parse_mp3_frame_header(data[last:last + 4])['length'])
+    finally:
+        data.close()
+
+    num_frames = len(offsets) - 1
+    if info and info['frames'] and info['frames'] != num_frames:
+        logging.debug(f"{audio_file_path}: 情報フレームのフレーム数({info['frames']})と実際のフレーム数({num_frames})が違います。")
+
+    # エンコーダーが足した先頭の遅延と末尾のパディングを除いて、正確な長さを計算します
+    total_samples = num_frames * first['samples']
+    if info:
+        total_samples = max(0, total_samples - info['delay'] - info['padding'])
+
+    return {
+        'offsets': offsets,
+        'num_frames': num_frames,
+        'sample_rate': first['sample_rate'],
+        'frame_duration': first['samples'] / first['sample_rate'],
+        'duration': total_samples / first['sample_rate'],
+    }
+
+def get_mp3_frame_index(audio_file_path):
+    """MP3フレーム索引をキャッシュから取得する関数（なければ作ります）"""
+    if not str(audio_file_path).lower().endswith('.mp3'):
+        return None
+    try:
+        stat = os.stat(audio_file_path)
+    except OSError:
+        return None
+    cache_key = (str(audio_file_path), stat.st_size, stat.st_mtime_ns)
+    metrics.inc('minutes_cache_lookups_total', cache='mp3_index', result='hit' if cache_key in _mp3_index_cache else 'miss')
+    if cache_key not in _mp3_index_cache:
+        try:
+            index = build_mp3_frame_index(audio_file_path)
+        except Exception as e:
+            logging.warning(f"MP3フレーム索引の作成に失敗しました: {audio_file_path} - {str(e)}")
+            index = None
+        # 古い索引は捨てて、最新のものだけを覚えておきます
+        for key in [k for k in _mp3_index_cache if k[0] == cache_key[0]]:
+            del _mp3_index_cache[key]
+        _mp3_index_cache[cache_key] = index
+    return _mp3_index_cache[cache_key]
+
+def read_mp3_frames(audio_file_path, index, start_time, duration):
+    """MP3ファイルの指定した時間範囲を、フレームの区切りでバイト列として切り出す関数"""
+    # 再エンコードはせず、元のフレームをそのままコピーします
+    offsets = index['offsets']
+    first_frame = max(0, min(index['num_frames'] - 1, int(start_time / index['frame_duration'])))
+    last_frame = min(index['num_frames'], int(-(-(start_time + duration) // index['frame_duration'])))
+    last_frame = max(first_frame + 1, last_frame)
+    start_byte = offsets[first_frame]
+    end_byte = offsets[last_frame]
+    with open(audio_file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[start_byte:end_byte]
+
+# 音声の種類ごとに、Geminiへ送るときのMIMEタイプとffmpegの出力形式を決めておきます
+# 無音を縮めるときはコピーできないので、vad_ffmpeg_argsで再エンコードします
+AUDIO_CHUNK_FORMATS = {
+    '.mp3': {'mime_type': 'audio/mp3', 'ffmpeg_args': ['-c', 'copy', '-f', 'mp3'],
+             'vad_ffmpeg_args': ['-c:a', 'libmp3lame', '-q:a', '4', '-f', 'mp3']},
+    '.m4a': {'mime_type': 'audio/aac', 'ffmpeg_args': ['-c', 'copy', '-f', 'adts'],  # パイプに出せるようADTS形式にします
+             'vad_ffmpeg_args': ['-c:a', 'aac', '-b:a', '96k', '-f', 'adts']},
+    '.wav': {'mime_type': 'audio/wav', 'ffmpeg_args': ['-c', 'pcm_s16le', '-f', 'wav'],
+             'vad_ffmpeg_args': ['-c:a', 'pcm_s16le', '-f', 'wav']},
+}
+
+def plan_audio_chunks(duration, num_parts):
+    """音声を重なり付きで分割するときの時間範囲を計算する関数"""
+    # この関数は、各部分の（開始時間, 長さ）のリストを返します。
     part_duration = duration / num_parts  # 各部分の長さを計算します
     overlap_duration = part_duration * 0.1  # 10%の重なりを持たせます
-
-    parts = []  # 分割した音声ファイルのリストを作ります
+    ranges = []
     for i in range(num_parts):
-        # 各部分の開始時間を計算します
         start_time = max(0, i * part_duration - (overlap_duration if i > 0 else 0))
-        # 新しい音声ファイルの名前を決めます
-        part_file = f"{audio_file_path}_part{i+1}.mp3"  # 拡張子をmp3のままにします
-
-        # 音声ファイルの種類に応じて、分割の方法を変えます
-        if audio_file_path.endswith('.mp3'):
-            # MP3ファイルの場合の分割方法
-            command = [
-                str(get_ffmpeg_path()),  # ffmpegというソフトウェアのパスを取得します
-                '-y',  # 同じ名前のファイルがあれば上書きします
-                '-i', audio_file_path,  # 元の音声ファイルを指定します
-                '-ss', str(start_time),  # 開始時間を指定します
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),  # 部分の長さを指定します
-                '-c', 'copy',  # 音声をそのままコピーします（音質を変えません）
-                part_file  # 新しい音声ファイルの名前を指定します
-            ]
-        elif audio_file_path.endswith('.m4a'):
-            # M4Aファイルの場合の分割方法
-            part_file = f"{audio_file_path}_part{i+1}.m4a"  # 拡張子をm4aのままにします
-            command = [
-                str(get_ffmpeg_path()),
-                '-y',
-                '-i', audio_file_path,
-                '-ss', str(start_time),
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
-                '-c', 'copy',
-                part_file
-            ]
-        elif audio_file_path.endswith('.wav'):
-            # WAVファイルの場合の分割方法
-            part_file = f"{audio_file_path}_part{i+1}.wav"  # 拡張子をwavのままにします
-            command = [
-                str(get_ffmpeg_path()),
-                '-y',
-                '-i', audio_file_path,
-                '-ss', str(start_time),
-                '-t', str(part_duration + (overlap_duration if i < num_parts - 1 else 0)),
-                '-c', 'pcm_s16le',  # WAV用の音声形式を指定します
-                part_file
-            ]
-
-        # 音声ファイルを実際に分割します
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode != 0:
-            # エラーが起きた場合は記録します
-            logging.error(f"FFmpegエラー: {result.stderr}")
-        parts.append(part_file)  # 分割したファイルをリストに追加します
-
-    return parts  # 分割したファイルのリストを返します
+        length = part_duration + (overlap_duration if i < num_parts - 1 else 0)
+        ranges.append((start_time, length))
+    return ranges
+
+def load_vad_settings():
+    """無音の削除（VAD）の設定を読み込む関数"""
+    settings = load_settings()
+    return {
+        'enabled': bool(settings.get('vad_enabled', False)),
+        'noise_db': float(settings.get('vad_noise_db', -35)),  # これより小さい音は無音とみなします
+        'min_silence': float(settings.get('vad_min_silence_seconds', 2.0)),  # これより長い無音だけ縮めます
+        'keep_silence': float(settings.get('vad_keep_silence_seconds', 0.5)),  # 縮めた無音に残す長さ
+    }
+
+def detect_silences(audio_file_path, start_time, length, noise_db, min_silence):
+    """ffmpegのsilencedetectで、指定した範囲の無音区間を探す関数"""
+    # 戻り値は範囲の先頭からの（開始, 終了）秒のリストです。調べられなかったときはNoneを返します。
+    command = [
+        str(get_ffmpeg_path()),
+        '-hide_banner', '-nostats',
+        '-ss', str(start_time),
+        '-i', audio_file_path,
+        '-t', str(length),
+        '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+        '-f', 'null', '-'
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        # ffmpegがない場合などは、無音を縮めずに送ります
+        logging.warning(f"無音の検出に失敗しました: {str(e)}")
+        return None
+    if result.returncode != 0:
+        logging.error(f"無音の検出に失敗しました: {result.stderr.decode('utf-8', errors='replace')}")
+        return None
+    silences = []
+    silence_start = None
+    for line in result.stderr.decode('utf-8', errors='replace').splitlines():
+        if 'silence_start:' in line:
+            silence_start = max(0.0, float(line.split('silence_start:')[1].split()[0]))
+        elif 'silence_end:' in line and silence_start is not None:
+            silences.append((silence_start, min(length, float(line.split('silence_end:')[1].split()[0]))))
+            silence_start = None
+    if silence_start is not None:
+        silences.append((silence_start, length))  # 最後まで無音のまま終わった場合です
+    return silences
+
+def speech_segments_from_silences(start_time, length, silences, keep_silence):
+    """無音区間を縮めたあとに残す区間（元の録音での開始, 終了）のリストを作る関数"""
+    # 無音の前後にkeep_silenceの半分ずつを残すので、話し始めと話し終わりが切れません
+    segments = []
+    position = 0.0
+    for silence_start, silence_end in silences:
+        cut_start = silence_start + keep_silence / 2
+        cut_end = silence_end - keep_silence / 2
+        if cut_end <= cut_start:
+            continue
+        if cut_start > position:
+            segments.append((start_time + position, start_time + cut_start))
+        position = max(position, cut_end)
+    if position < length:
+        segments.append((start_time + position, start_time + length))
+    return segments
+
+def read_speech_segments(audio_file_path, chunk_format, mp3_index, start_time, segments):
+    """残す区間だけをつないだ音声のバイト列を作る関数"""
+    if mp3_index:
+        # MP3はフレームをそのままつなぎます（つなぎ目でビットリザーバーの参照が切れても、数ミリ秒の雑音で済みます）
+        return b''.join(read_mp3_frames(audio_file_path, mp3_index, segment_start, segment_end - segment_start)
+                        for segment_start, segment_end in segments)
+
+    # それ以外はffmpegのaselectで残す区間だけを選び、タイムスタンプを詰め直して再エンコードします
+    length = segments[-1][1] - start_time
+    selection = '+'.join(f'between(t,{segment_start - start_time:.3f},{segment_end - start_time:.3f})'
+                         for segment_start, segment_end in segments)
+    command = [
+        str(get_ffmpeg_path()),
+        '-v', 'error',
+        '-ss', str(start_time),
+        '-i', audio_file_path,
+        '-t', str(length),
+        '-af', f"aselect='{selection}',asetpts=N/SR/TB",
+        *chunk_format['vad_ffmpeg_args'],
+        'pipe:1'
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        logging.warning(f"無音を縮めた音声を作れませんでした: {str(e)}")
+        return None
+    if result.returncode != 0:
+        logging.error(f"FFmpegエラー: {result.stderr.decode('utf-8', errors='replace')}")
+        return None
+    return result.stdout
+
+def trim_silences(audio_chunk, audio_file_path, chunk_format, mp3_index, vad_settings):
+    """チャンクの長い無音を縮める関数（縮められなければチャンクはそのままです）"""
+    start_time, length = audio_chunk['start_time'], audio_chunk['duration']
+    silences = detect_silences(audio_file_path, start_time, length, vad_settings['noise_db'], vad_settings['min_silence'])
+    if not silences:
+        return False
+    segments = speech_segments_from_silences(start_time, length, silences, vad_settings['keep_silence'])
+    kept = sum(segment_end - segment_start for segment_start, segment_end in segments)
+    if not segments or length - kept < 1.0:
+        return False  # ほとんど縮まらないなら、元のまま送ります
+    data = read_speech_segments(audio_file_path, chunk_format, mp3_index, start_time, segments)
+    if not data:
+        return False
+    audio_chunk.update(data=data, duration=kept, segments=segments)
+    logging.info(f"{audio_chunk['name']}の無音を{length - kept:.0f}秒縮めました（{(length - kept) / length:.0%}削減）。")
+    return True
+
+@timed_stage('split')
+def extract_audio_chunk(audio_file_path, start_time, length, name, vad_settings=None):
+    """音声ファイルの一部分をメモリ上に切り出す関数（切り出せなければNone）"""
+    # この関数は、切り出した音声をファイルに書かず、バイト列として返します。
+    # 元のファイルの隣に一時ファイルを作らないので、読み取り専用のフォルダでも動きます。
+    # vad_settings（load_vad_settingsの戻り値）で有効になっていれば長い無音を縮めます。
+    # segmentsに元の録音で残した区間が入ります。設定はジョブごとに1回読んで渡してください。
+    extension = os.path.splitext(audio_file_path)[1].lower()
+    chunk_format = AUDIO_CHUNK_FORMATS.get(extension, AUDIO_CHUNK_FORMATS['.mp3'])
+    chunk = {
+        'name': name,
+        'mime_type': chunk_format['mime_type'],
+        'start_time': start_time,
+        'duration': length,  # 送る音声の長さ（無音を縮めたら元の範囲より短くなります）
+        'segments': [(start_time, start_time + length)],
+        'data': b'',
+    }
+
+    # MP3ファイルならフレーム索引を使って、ffmpegを起動せずに切り出します
+    mp3_index = get_mp3_frame_index(audio_file_path)
+    if vad_settings and vad_settings['enabled'] and trim_silences(chunk, audio_file_path, chunk_format, mp3_index, vad_settings):
+        return chunk
+    if mp3_index:
+        chunk['data'] = read_mp3_frames(audio_file_path, mp3_index, start_time, length)
+        return chunk
+
+    # それ以外はffmpegの出力を標準出力（パイプ）で受け取ります
+    # 切り出しに失敗したらNoneを返します（空や途中までの音声を送ってリクエストを無駄にしません）
+    command = ffmpeg_chunk_command(audio_file_path, start_time, length, chunk_format)
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        logging.error(f"FFmpegを実行できませんでした: {name} - {str(e)}")
+        return None
+    if result.returncode != 0 or not result.stdout:
+        # エラーが起きた場合は記録します
+        logging.error(f"FFmpegエラー: {name} - {result.stderr.decode('utf-8', errors='replace')}")
+        return None
+    chunk['data'] = result.stdout
+    return chunk
+
+def ffmpeg_chunk_command(audio_file_path, start_time, length, chunk_format):
+    """音声の一部分を標準出力に書き出すffmpegのコマンドを作る関数"""
+    return [
+        str(get_ffmpeg_path()),
+        '-v', 'error',
+        '-ss', str(start_time),  # 開始時間を指定します
+        '-i', audio_file_path,  # 元の音声ファイルを指定します
+        '-t', str(length),  # 部分の長さを指定します
+        *chunk_format['ffmpeg_args'],
+        'pipe:1'  # ファイルではなく標準出力に書き出します
+    ]
+
+async def extract_audio_chunk_async(audio_file_path, start_time, length, name, vad_settings=None):
+    """extract_audio_chunkのasyncio版（ffmpegを非同期のサブプロセスで動かします）"""
+    # MP3の切り出しと無音の圧縮は元の関数をスレッドで動かします
+    extension = os.path.splitext(audio_file_path)[1].lower()
+    chunk_format = AUDIO_CHUNK_FORMATS.get(extension, AUDIO_CHUNK_FORMATS['.mp3'])
+    if extension == '.mp3' or (vad_settings and vad_settings['enabled']):
+        return await asyncio.to_thread(extract_audio_chunk, audio_file_path, start_time, length, name, vad_settings)
+
+    with metrics.timer('minutes_stage_duration_seconds', stage='split'):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_chunk_command(audio_file_path, start_time, length, chunk_format),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            logging.error(f"FFmpegを実行できませんでした: {name} - {str(e)}")
+            return None
+        data, stderr = await process.communicate()
+    if process.returncode != 0 or not data:
+        logging.error(f"FFmpegエラー: {name} - {stderr.decode('utf-8', errors='replace')}")
+        return None
+    return {
+        'name': name,
+        'mime_type': chunk_format['mime_type'],
+        'start_time': start_time,
+        'duration': length,
+        'segments': [(start_time, start_time + length)],
+        'data': data,
+    }
+
+async def split_audio_file_async(audio_file_path, num_parts, vad_settings=None):
+    """音声ファイルを指定された数の部分に重なりを持たせて分割するコルーチン"""
+    # 分けた部分は少し重なりを持つので、途切れないようになっています。
+    # 部分ごとの切り出しは同時に進めます。切り出せなかった部分はNoneになります。
+    duration = await asyncio.to_thread(get_audio_duration, audio_file_path)
+    audio_file_name = os.path.basename(audio_file_path)
+    return await asyncio.gather(*[
+        extract_audio_chunk_async(audio_file_path, start_time, length, f"{audio_file_name}_part{i+1}", vad_settings)
+        for i, (start_time, length) in enumerate(plan_audio_chunks(duration, num_parts))
+    ])
 
 def get_audio_duration(audio_file_path):
     """音声ファイルの長さを取得する関数"""
     # この関数は、音声ファイルの再生時間（長さ）を秒単位で取得します
 
+    # MP3ファイルならフレーム索引から正確な長さがわかるので、ffprobeは使いません
+    mp3_index = get_mp3_frame_index(audio_file_path)
+    if mp3_index:
+        return mp3_index['duration']
+
     # ffprobeというツールを使うためのコマンドを準備します
     command = [
         str(get_ffprobe_path()),  # ffprobeのパスを取得します
@@ -260,66 +889,263 @@ def load_prompt_from_settings():
         logging.error("settings.jsonが見つかりません。")  # 追加: ファイルが見つからない場合
     return ''
 
-def transcribe_audio_with_key(audio_file, api_key, retries=3):
-    """指定されたAPIキーを使用して音声ファイルを文字起こしする関数"""
-    # この関数は、音声ファイルをテキストに変換します
+# モデルの初期設定です（settings.jsonで上書きできます）
+DEFAULT_MODEL_SETTINGS = {
+    # ルールに当てはまらなかったときに使うモデル
+    'transcription_model': 'gemini-1.5-pro',
+    'extraction_model': 'gemini-1.5-pro',
+    # 上から順に調べて、最初に当てはまったルールのモデルを使います
+    'model_routing': {
+        'transcription': [
+            {'max_duration_seconds': 900, 'model': 'gemini-1.5-flash'},
+        ],
+        'extraction': [
+            {'max_tokens': 32000, 'model': 'gemini-1.5-flash'},
+        ],
+    },
+    # 利用制限（429）に達したときに切り替えるモデル
+    'model_fallbacks': {
+        'gemini-1.5-pro': ['gemini-1.5-flash'],
+        'gemini-1.5-flash': ['gemini-1.5-pro'],
+    },
+}
+
+def load_model_settings():
+    """settings.jsonからモデルの設定を読み込む関数（ない項目は初期設定を使います）"""
+    settings = load_settings()
+    return {key: settings.get(key, default) for key, default in DEFAULT_MODEL_SETTINGS.items()}
+
+def select_model(stage, duration=None, tokens=None, model_settings=None):
+    """処理の段階（transcription/extraction）と大きさからモデルを選ぶ関数"""
+    # 音声は長さ（秒）、文章はトークン数でルールを調べます
+    model_settings = model_settings or load_model_settings()
+    for rule in model_settings['model_routing'].get(stage, []):
+        if 'max_duration_seconds' in rule and (duration is None or duration > rule['max_duration_seconds']):
+            continue
+        if 'max_tokens' in rule and (tokens is None or tokens > rule['max_tokens']):
+            continue
+        return rule['model']
+    return model_settings[f'{stage}_model']
+
+def model_candidates(stage, duration=None, tokens=None, model_settings=None):
+    """使う順番に並べたモデルの候補（選んだモデルと、その切り替え先）を返す関数"""
+    model_settings = model_settings or load_model_settings()
+    primary = select_model(stage, duration, tokens, model_settings)
+    candidates = [primary]
+    for model_name in model_settings['model_fallbacks'].get(primary, []):
+        if model_name not in candidates:
+            candidates.append(model_name)
+    return candidates
+
+async def count_prompt_tokens_async(prompt, api_key, model_name, budget=None):
+    """count_tokensで指示文のトークン数を数えるコルーチン"""
+    request = glm.CountTokensRequest(model=model_resource_name(model_name), contents=build_request_contents(prompt))
+    counting = get_async_client(api_key).count_tokens(
+        request=request, retry=None, timeout=budget.request_timeout() if budget else 60)
+    response = await (budget.run_cancellable(counting) if budget else counting)
+    return response.total_tokens
+
+def count_prompt_tokens(prompt, api_key, model_name, budget=None):
+    """count_tokensで指示文のトークン数を数える関数（失敗したら文字数で見積もります）"""
+    try:
+        return get_transcription_engine().run(count_prompt_tokens_async(prompt, api_key, model_name, budget))
+    except (JobCancelled, BudgetExhausted):
+        raise
+    except Exception as e:
+        # 日本語はおおよそ1文字1トークンなので、文字数で代用します
+        logging.warning(f"トークン数の取得に失敗したため、文字数で見積もります: {str(e)}")
+        return len(prompt)
 
-    # プロンプトをログに出力（1回だけ）
-    if transcription_prompt:
-        # もし文字起こしの指示（プロンプト）があれば、それをログに記録します
-        logging.info(f"今回は以下のプロンプトで文字起こしをします:\n{transcription_prompt}")
-    else:
-        # プロンプトがない場合はエラーを記録して、関数を終了します
+# APIキーごと・モデルごとの今日の利用状況を記録するファイルを、複数のスレッドから同時に書き換えないためのロック
+usage_lock = threading.Lock()
+
+def get_usage_path():
+    """APIの利用状況を記録するファイルのパス"""
+    return get_settings_path().parent / "usage.json"
+
+def key_fingerprint(api_key):
+    """APIキーを記録に残すときの目印（キーそのものは保存しません）"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+DEFAULT_QUOTA_TIMEZONE = 'America/Los_Angeles'
+
+def load_quota_timezone():
+    """利用上限の日付を区切るタイムゾーンを読み込む関数（正しくなければ太平洋時間）"""
+    name = load_settings().get('quota_timezone', DEFAULT_QUOTA_TIMEZONE)
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError, TypeError):
+        logging.warning(f"quota_timezoneの値（{name}）が正しくないため、{DEFAULT_QUOTA_TIMEZONE}を使います。")
+        return zoneinfo.ZoneInfo(DEFAULT_QUOTA_TIMEZONE)
+
+def quota_day():
+    """利用上限の「今日」の日付（Geminiの1日の上限は太平洋時間の0時にリセットされます）"""
+    return datetime.datetime.now(load_quota_timezone()).date().isoformat()
+
+def load_usage():
+    """今日のAPIの利用状況を読み込む関数（日付が変わっていたら空の記録を返します）"""
+    today = quota_day()
+    try:
+        with open(get_usage_path(), 'r', encoding='utf-8') as f:
+            usage = json.load(f)
+    except (OSError, ValueError):
+        usage = {}
+    if usage.get('day') != today:
+        usage = {'day': today, 'keys': {}}
+    return usage
+
+def record_api_usage(api_key, model_name, tokens=0, rate_limited=False):
+    """APIへのリクエストを1回分、今日の利用状況に記録する関数"""
+    # 利用制限に達したリクエストも、上限の残りを見積もるために数えておきます
+    # 記録に失敗しても、届いた応答を失敗扱いにしないよう例外は外に出しません
+    try:
+        with usage_lock:
+            usage = load_usage()
+            counts = usage['keys'].setdefault(key_fingerprint(api_key), {}).setdefault(
+                model_name, {'requests': 0, 'tokens': 0, 'rate_limited': 0})
+            counts['requests'] += 1
+            counts['tokens'] += tokens
+            counts['rate_limited'] += int(rate_limited)
+            usage_path = get_usage_path()
+            with open(f"{usage_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(usage, f, ensure_ascii=False, indent=2)
+            os.replace(f"{usage_path}.tmp", usage_path)
+    except Exception as e:
+        logging.warning(f"APIの利用状況を記録できませんでした: {str(e)}")
+
+def generate_with_fallback(models, contents, api_key, budget, on_first_response=None, stage='transcription'):
+    """generate_with_fallback_asyncをスレッドから使うための関数（エンジンのイベントループで動かして待ちます）"""
+    return get_transcription_engine().run(
+        generate_with_fallback_async(models, contents, api_key, budget, on_first_response, stage))
+
+# APIキーごとの非同期クライアント（エンジンのイベントループの中で作り、使い回します）
+_async_clients = {}
+_async_clients_lock = threading.Lock()
+
+def get_async_client(api_key):
+    """APIキー用の非同期クライアントを返す関数"""
+    # アプリ全体の設定（genai.configure）は使わず、キーごとにクライアントを作ります
+    # 同時に多くのキーを使っても、ほかのリクエストのキーを書き換えることはありません
+    with _async_clients_lock:
+        if api_key not in _async_clients:
+            _async_clients[api_key] = glm.GenerativeServiceAsyncClient(client_options={'api_key': api_key})
+        return _async_clients[api_key]
+
+def model_resource_name(model_name):
+    """APIに渡すモデルの名前（models/〜）を返す関数"""
+    return model_name if model_name.startswith('models/') else f"models/{model_name}"
+
+def build_request_contents(contents):
+    """指示文の文字列と音声（mime_typeとdataの辞書）のリストを、リクエストの内容に組み立てる関数"""
+    parts = []
+    for item in [contents] if isinstance(contents, str) else contents:
+        if isinstance(item, str):
+            parts.append(glm.Part(text=item))
+        else:
+            parts.append(glm.Part(inline_data=glm.Blob(mime_type=item['mime_type'], data=item['data'])))
+    return [glm.Content(role='user', parts=parts)]
+
+class GeneratedResponse:
+    """ストリーミングで受け取った生成結果をつなげたもの"""
+
+    def __init__(self, text, finish_reason=None, total_tokens=0):
+        self.text = text
+        self.finish_reason = finish_reason  # STOP・MAX_TOKENSなどの名前
+        self.total_tokens = total_tokens
+
+async def receive_stream(api_key, model_name, contents, timeout, on_first_response=None):
+    """ストリーミングでリクエストを送り、最後まで受け取った結果をGeneratedResponseで返すコルーチン"""
+    # テキストがまったく返ってこなかったとき（安全フィルタなど）はValueErrorを出します
+    request = glm.GenerateContentRequest(model=model_resource_name(model_name), contents=build_request_contents(contents))
+    stream = await get_async_client(api_key).stream_generate_content(request=request, retry=None, timeout=timeout)
+    texts = []
+    finish_reason = None
+    total_tokens = 0
+    n = 0
+    async for piece in stream:
+        if n == 0 and on_first_response:
+            on_first_response()
+        n += 1
+        if piece.candidates:
+            candidate = piece.candidates[0]
+            texts.extend(part.text for part in candidate.content.parts if part.text)
+            if candidate.finish_reason:
+                finish_reason = glm.Candidate.FinishReason(candidate.finish_reason).name
+        if piece.usage_metadata and piece.usage_metadata.total_token_count:
+            total_tokens = piece.usage_metadata.total_token_count
+    if not texts:
+        raise ValueError(f"レスポンスにテキストが含まれていません（{finish_reason or '理由不明'}）")
+    return GeneratedResponse("".join(texts), finish_reason, total_tokens)
+
+async def generate_with_fallback_async(models, contents, api_key, budget, on_first_response=None, stage='transcription'):
+    """候補のモデルで順に生成を試し、利用制限に達したら次のモデルに切り替えるコルーチン"""
+    # 戻り値は（GeneratedResponse, 使ったモデル名）です。最後のモデルも制限に達したら例外を出します。
+    # リクエストの数・429の数・かかった時間は、キーの指紋とstageごとに指標に記録します。
+    # 利用状況のファイルへの記録はスレッドで行い、イベントループを止めません。
+    # 応答を待っている間にキャンセルされたら、締め切りを待たずにリクエストを打ち切ります。
+    key_labels = {'key': key_fingerprint(api_key), 'stage': stage}
+    for i, model_name in enumerate(models):
+        started = time.perf_counter()
+        metrics.inc('minutes_api_requests_total', model=model_name, **key_labels)
+        try:
+            response = await budget.run_cancellable(
+                receive_stream(api_key, model_name, contents, budget.request_timeout(), on_first_response))
+            metrics.observe('minutes_api_latency_seconds', time.perf_counter() - started, **key_labels)
+            await asyncio.to_thread(record_api_usage, api_key, model_name, response.total_tokens)
+            return response, model_name
+        except google.api_core.exceptions.ResourceExhausted:
+            metrics.inc('minutes_api_rate_limited_total', model=model_name, **key_labels)
+            await asyncio.to_thread(record_api_usage, api_key, model_name, rate_limited=True)
+            if i == len(models) - 1:
+                raise
+            logging.warning(f"{model_name}の利用制限に達したため、{models[i + 1]}に切り替えます。")
+        except (JobCancelled, BudgetExhausted):
+            raise
+        except Exception:
+            metrics.inc('minutes_api_errors_total', model=model_name, **key_labels)
+            raise
+
+async def transcribe_audio_async(audio_chunk, api_key, models, job=None, chunk_index=None, budget=None):
+    """指定されたAPIキーで音声のチャンクを1回文字起こしするコルーチン（失敗したらNone）"""
+    # リトライとキーの貸し借りはtranscribe_chunk_asyncが行います
+    # modelsのモデルを順に使います（制限に達したら次のモデルに切り替えます）
+    # jobを渡すと、送信・文字起こしの進捗をpublish_progressで知らせます
+    # 生成が終わった理由（MAX_TOKENSなど）はaudio_chunk['finish_reason']に残します
+    audio_file = audio_chunk['name']  # ログに出す名前です
+    if not transcription_prompt:
         logging.error("プロンプトが取得できませんでした。")
         return None
 
-    # 指定された回数（デフォルトは3回）まで文字起こしを試みます
-    for attempt in range(retries):
+    with metrics.timer('minutes_stage_duration_seconds', stage='transcription'):
         try:
-            # 音声ファイルを開いてデータを読み込みます
-            with open(audio_file, 'rb') as audio:
-                audio_data = audio.read()
-
-            # Geminiモデルを設定します
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            genai.configure(api_key=api_key)
-
-            # モデルを使って音声データを文字に起こします
-            response = model.generate_content(
+            publish_progress(job, 'chunk_started', index=chunk_index)
+            metrics.inc('minutes_upload_bytes_total', len(audio_chunk['data']), key=key_fingerprint(api_key))
+            response, model_name = await generate_with_fallback_async(
+                models,
                 [
                     transcription_prompt,
-                    {"mime_type": "audio/mp3", "data": audio_data}
-                ]
+                    {"mime_type": audio_chunk['mime_type'], "data": audio_chunk['data']}
+                ],
+                api_key,
+                budget,
+                on_first_response=lambda: publish_progress(job, 'chunk_uploaded', index=chunk_index)
             )
-
-            # 文字起こしが成功したかチェックします
-            if hasattr(response, 'text'):
-                # 成功した場合、ログに記録して結果を返します
-                logging.info(f"{audio_file}の文字起こしが成功しました。")
-                return response.text
-            else:
-                # テキストが含まれていない場合はエラーを記録します
-                logging.error(f"文字起こし失敗: {audio_file} - レスポンスにテキストが含まれていません。")
+            audio_chunk['finish_reason'] = response.finish_reason
+            logging.info(f"{audio_file}の文字起こしが成功しました（{model_name}）。")
+            return response.text
+        except (JobCancelled, BudgetExhausted):
+            raise
         except google.api_core.exceptions.ResourceExhausted:
-            # APIの利用制限に達した場合のエラーを記録します
             logging.error(f"文字起こし失敗: {audio_file} - 429 Resource has been exhausted (e.g. check quota).")
         except Exception as e:
-            # その他のエラーが発生した場合、エラー内容を記録します
             logging.error(f"文字起こし失敗: {audio_file} - {str(e)}")
-        
-        # リトライが可能な場合は、次の試行を行います
-        if attempt < retries - 1:
-            logging.info(f"リトライを試みます ({attempt + 2}/{retries})")
-            time.sleep(60)  # 1分待ってから次の試行を行います
-        else:
-            # すべての試行が失敗した場合、最終的なエラーを記録します
-            logging.error(f"{audio_file}の文字起こしが{retries}回失敗しました。")
-    
-    # すべての試行が失敗した場合はNoneを返します
     return None
 
-def extract_information(text, api_key):
+@timed_stage('extraction')
+def extract_information(text, api_key, budget=None, prompt=None):
     # この関数は、テキストから重要な情報を抽出します
+    # promptを渡すと、create_extraction_promptの代わりにその指示文を使います
+    budget = budget or RetryBudget()
 
     # テキストの空白を整理します
     cleaned_text = " ".join(text.split())
@@ -329,55 +1155,87 @@ def extract_information(text, api_key):
         logging.error("情報抽出に使用するAPIキーが設定されていません。")
         return
 
-    # APIキーを設定して、AIモデルを準備します
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-pro')
-    
     # 情報抽出のための指示文を作ります
-    prompt = create_extraction_prompt(cleaned_text)
+    prompt = prompt or create_extraction_prompt(cleaned_text)
 
     try:
+        # 指示文のトークン数に合ったモデルを選びます（大きな指示文だけproを使います）
+        model_settings = load_model_settings()
+        tokens = None
+        if any('max_tokens' in rule for rule in model_settings['model_routing'].get('extraction', [])):
+            tokens = count_prompt_tokens(prompt, api_key, model_settings['extraction_model'], budget)
+        models = model_candidates('extraction', tokens=tokens)
+
         # 情報抽出を開始します
-        logging.info("情報抽出を開始します。")
+        logging.info(f"情報抽出を開始します（{models[0]}、{tokens}トークン）。")
         # AIモデルに指示を送り、結果を受け取ります
-        response = model.generate_content(prompt)
+        response, model_name = generate_with_fallback(models, prompt, api_key, budget, stage='extraction')
         # 結果のテキストから余分な空白を取り除きます
         extracted_text = response.text.strip()
         # 抽出結果を記録します
         logging.info(f"抽出結果全体: {extracted_text}")
         # 抽出したテキストを返します
         return extracted_text
+    except (JobCancelled, BudgetExhausted):
+        raise
     except Exception as e:
         # エラーが起きた場合、詳細を記録して再度エラーを発生させます
         logging.exception(f"情報抽出中にエラーが発生しました: {str(e)}")
         raise
 
-def create_excel(extracted_info, output_file):
-    # 新しいExcelワークブックを作成します
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "議事録"
-
-    # 列の幅を設定します
-    ws.column_dimensions['A'].width = 20  # A列（議題）の幅を20に設定
-    ws.column_dimensions['B'].width = 80  # B列（内容）の幅を80に設定
-
-    # 会議詳細情報を追加します
-    meeting_details = [
-        "会議名",
-        "日時",
-        "場所",
-        "参加者",
-        "欠席者"
-    ]
+# 処理中の文字起こしファイルの末尾に付ける目印
+TRANSCRIPT_IN_PROGRESS_MARKER = "（文字起こし処理中です。この後に続きが追加されます。）"
+
+@timed_stage('write_transcript')
+def write_transcript_docx(output_file, paragraphs, in_progress=False):
+    """文字起こし結果をWordファイルに書き出す関数"""
+    # この関数は、チャンクごとの文字起こし結果を、改行ごとに1段落ずつ書き込みます。
+    # 書きかけのファイルを開かれないように、一時ファイルに保存してから置き換えます。
+    doc = Document()
+    for paragraph in paragraphs:
+        for line in paragraph.split('\n'):
+            if line.strip():
+                doc.add_paragraph(" ".join(line.split()))  # 余分な空白を取り除く
+    if in_progress:
+        doc.add_paragraph(TRANSCRIPT_IN_PROGRESS_MARKER)
+    temp_file = f"{output_file}.tmp"
+    doc.save(temp_file)
+    os.replace(temp_file, output_file)
+
+class ProgressiveTranscript:
+    """文字起こしが終わった部分から順にWordファイルへ書き出す係"""
+    # 先頭から途切れずにそろったチャンクだけを書き出すので、
+    # 利用者は会議の最初の方から読み始められます。
+
+    def __init__(self, output_file, num_chunks):
+        self.output_file = output_file
+        self.texts = [None] * num_chunks
+        self.resolved = [False] * num_chunks  # 成功または失敗が確定したチャンク
+        self.written_prefix = 0  # 書き出し済みの先頭からのチャンク数
+
+    def add(self, index, text):
+        """チャンクの結果を受け取り、先頭からそろった部分が伸びたら書き出す"""
+        self.texts[index] = text
+        self.resolved[index] = True
+        prefix = 0
+        while prefix < len(self.resolved) and self.resolved[prefix]:
+            prefix += 1
+        if prefix > self.written_prefix and prefix < len(self.resolved):
+            try:
+                write_transcript_docx(self.output_file, filter(None, self.texts[:prefix]), in_progress=True)
+                self.written_prefix = prefix
+                logging.info(f"文字起こし結果の途中経過を保存しました（{prefix}/{len(self.texts)}）: {self.output_file}")
+            except Exception as e:
+                # 途中経過の保存に失敗しても処理は続けます（Wordで開いている場合など）
+                logging.warning(f"文字起こし結果の途中経過の保存に失敗しました: {str(e)}")
 
-    # 会議詳細情報をExcelに書き込みます
-    for i, detail in enumerate(meeting_details, start=1):
-        ws.cell(row=i, column=1, value=detail)  # A列に項目名を書き込み
-        ws.cell(row=i, column=1).font = openpyxl.styles.Font(bold=True)  # 太字に設定
-        ws.cell(row=i, column=1).fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")  # 背景色を設定
+    def finish(self):
+        """すべてのチャンクを目印なしで書き出す"""
+        write_transcript_docx(self.output_file, filter(None, self.texts))
 
-    row = 6  # 会議詳細情報の後から議題の書き込みを開始します
+def parse_extracted_topics(extracted_info):
+    """抽出結果のテキストから（議題, 要約）の組のリストを作る関数"""
+    topics = []
 
     # 抽出された情報を行ごとに分割します
     lines = extracted_info.split('\n')
@@ -389,11 +1247,7 @@ def create_excel(extracted_info, output_file):
         line = line.strip()
         if line.startswith("議題"):
             if current_topic and current_summary:
-                # 前の議題を書き込みます
-                ws.cell(row=row, column=1, value=current_topic)
-                cell = ws.cell(row=row, column=2, value=current_summary)
-                cell.alignment = Alignment(wrap_text=True)  # テキストを折り返して表示
-                row += 1
+                topics.append((current_topic, current_summary))  # 前の議題を記録します
             parts = line.split(':', 1)
             if len(parts) == 2:
                 current_topic = parts[0].strip()
@@ -407,11 +1261,241 @@ def create_excel(extracted_info, output_file):
         elif current_summary:
             current_summary += " " + line.strip()
 
-    # 最後の議題を書き込みます
+    # 最後の議題を記録します
     if current_topic and current_summary:
+        topics.append((current_topic, current_summary))
+    return topics
+
+def get_extraction_cache_dir():
+    """情報抽出結果のキャッシュを置くフォルダのパスを返す関数"""
+    return get_settings_path().parent / "extraction_cache"
+
+def normalize_transcript(text):
+    """キャッシュのキーにするため、文字起こしの空白をそろえる関数"""
+    return " ".join(text.split())
+
+def extraction_cache_key(text):
+    """（文字起こし, 抽出の指示文, モデルの設定）からキャッシュのキーを作る関数"""
+    # モデルは実際に選ばれたものではなく、選び方の設定をキーに含めます。
+    # こうするとキャッシュを調べるだけならAPI（count_tokens）を呼ばずに済みます。
+    model_settings = load_model_settings()
+    model_signature = {
+        'extraction_model': model_settings['extraction_model'],
+        'routing': model_settings['model_routing'].get('extraction', []),
+        'fallbacks': model_settings['model_fallbacks'],
+    }
+    payload = json.dumps([
+        normalize_transcript(text),
+        create_extraction_prompt(""),  # 指示文のテンプレート（文章の部分は空）
+        model_signature,
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_cached_extraction(text):
+    """キャッシュから情報抽出の結果を探す関数（なければNone）"""
+    cache_file = get_extraction_cache_dir() / f"{extraction_cache_key(text)}.json"
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        metrics.inc('minutes_cache_lookups_total', cache='extraction', result='miss')
+        return None
+    metrics.inc('minutes_cache_lookups_total', cache='extraction', result='hit')
+    # 最近使ったものほど消されにくいように、更新時刻を今にします
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+    logging.info(f"情報抽出の結果をキャッシュから読み込みました: {cache_file.name}")
+    return entry
+
+def save_cached_extraction(text, extracted_info):
+    """情報抽出の結果（テキストと議題の一覧）をキャッシュに保存する関数"""
+    cache_dir = get_extraction_cache_dir()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        key = extraction_cache_key(text)
+        entry = {
+            'key': key,
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'extracted_text': extracted_info,
+            'topics': parse_extracted_topics(extracted_info),
+        }
+        temp_file = cache_dir / f"{key}.json.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, cache_dir / f"{key}.json")
+        evict_extraction_cache()
+    except OSError as e:
+        logging.warning(f"情報抽出の結果をキャッシュに保存できませんでした: {str(e)}")
+
+def evict_extraction_cache():
+    """キャッシュが設定の大きさを超えたら、長く使っていないものから消す関数"""
+    max_bytes = float(load_settings().get('extraction_cache_max_mb', 50)) * 1024 * 1024
+    entries = []
+    for cache_file in get_extraction_cache_dir().glob("*.json"):
+        try:
+            stat = cache_file.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, cache_file))
+    total = sum(size for _, size, _ in entries)
+    for _, size, cache_file in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        try:
+            cache_file.unlink()
+            total -= size
+        except OSError:
+            pass
+
+def get_transcript_segments_dir():
+    """抽出に使った文字起こしの区切り（セグメント）を置くフォルダのパスを返す関数"""
+    return get_settings_path().parent / "transcript_segments"
+
+def transcript_segments_path(xlsx_path):
+    """抽出結果のExcelファイルに対応するセグメントのファイルのパスを返す関数"""
+    name = hashlib.sha256(os.path.abspath(xlsx_path).encode('utf-8')).hexdigest()
+    return get_transcript_segments_dir() / f"{name}.json"
+
+def split_transcript_segments(text):
+    """文字起こしを文ごとのセグメントに分ける関数"""
+    # 直した文だけが差分に出るように、段落（改行）と句点などで区切ります
+    # 句点の少ない文字起こしでも、段落ごとには分かれます
+    segments = []
+    for line in text.split('\n'):
+        segments.extend(" ".join(segment.split()) for segment in re.findall(r'[^。！？!?]+[。！？!?]*', line)
+                        if segment.strip())
+    return segments
+
+TOPIC_LINE_PATTERN = re.compile(r'(議題[^:：\s]*?)(?:の要約)?\s*[:：]')
+
+def split_extracted_blocks(extracted_info):
+    """抽出結果のテキストを議題ごとの（番号, 行のまとまり）のリストに分ける関数"""
+    blocks = []
+    for line in extracted_info.split('\n'):
+        match = TOPIC_LINE_PATTERN.match(line.strip())
+        if match and (not blocks or blocks[-1][0] != match.group(1)):
+            blocks.append((match.group(1), []))
+        if blocks and line.strip():
+            blocks[-1][1].append(line.strip())
+    return [(label, "\n".join(lines)) for label, lines in blocks]
+
+def relabel_topic_block(extracted_info, label):
+    """1つの議題の抽出結果の番号を、指定した番号にそろえる関数"""
+    # モデルが番号を変えてしまっても、前回の議題と同じ場所・番号に入るようにします
+    blocks = split_extracted_blocks(extracted_info)
+    if not blocks:
+        return extracted_info
+    return "\n".join(TOPIC_LINE_PATTERN.sub(lambda match: match.group(0).replace(match.group(1), label, 1), line, count=1)
+                     for line in blocks[0][1].split('\n'))
+
+def assign_segment_topics(segments, topics):
+    """セグメントごとに、どの議題の元になったかを推定する関数（議題の番号のリストを返します）"""
+    # topicsは（議題の番号, 議題と要約の文章）のリストです。
+    # 議題と要約の文章と2文字ずつの重なりが一番多い議題を選びます。
+    # どの議題ともほとんど重ならない文（相づちなど）は、直前の文と同じ議題とみなします。
+    topic_bigrams = [(label, set(to_bigrams(text).split())) for label, text in topics]
+    owners = []
+    for segment in segments:
+        bigrams = set(to_bigrams(segment).split())
+        best_label, best_score = None, 0.0
+        for label, summary_bigrams in topic_bigrams:
+            score = len(bigrams & summary_bigrams) / len(bigrams) if bigrams else 0.0
+            if score > best_score:
+                best_label, best_score = label, score
+        owners.append(best_label if best_score >= 0.2 else None)
+    # 先頭の推定できない文は、最初に推定できた議題に含めます
+    previous = next((owner for owner in owners if owner), topics[0][0] if topics else None)
+    for i, owner in enumerate(owners):
+        owners[i] = previous = owner or previous
+    return owners
+
+def save_transcript_segments(xlsx_path, text, extracted_info, owners=None):
+    """抽出に使った文字起こしのセグメントと、セグメントごとの議題を保存する関数"""
+    # 文字起こしを直したあとにreextract_transcriptで差分を取るために使います
+    segments = split_transcript_segments(text)
+    topics = split_extracted_blocks(extracted_info)
+    entry = {
+        'xlsx_path': os.path.abspath(xlsx_path),
+        'segments': segments,
+        'owners': owners or assign_segment_topics(segments, topics),
+        'extracted_text': extracted_info,
+    }
+    segments_path = transcript_segments_path(xlsx_path)
+    try:
+        segments_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{segments_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(f"{segments_path}.tmp", segments_path)
+    except OSError as e:
+        logging.warning(f"文字起こしのセグメントを保存できませんでした: {str(e)}")
+
+def load_transcript_segments(xlsx_path):
+    """保存したセグメントを読み込む関数（なければNone）"""
+    try:
+        with open(transcript_segments_path(xlsx_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def diff_transcript_segments(old_segments, old_owners, new_segments):
+    """直す前と後のセグメントを比べて（新しいセグメントごとの議題, 変わった議題, 変わった文字数）を返す関数"""
+    new_owners = [None] * len(new_segments)
+    changed_topics = set()
+    changed_chars = 0
+    matcher = difflib.SequenceMatcher(None, old_segments, new_segments, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            new_owners[j1:j2] = old_owners[i1:i2]
+            continue
+        changed_topics.update(owner for owner in old_owners[i1:i2] if owner)
+        changed_chars += sum(len(segment) for segment in old_segments[i1:i2] + new_segments[j1:j2])
+        for j in range(j1, j2):
+            if i2 > i1:
+                # 置き換えた文は、元の文の議題を引き継ぎます
+                new_owners[j] = old_owners[min(i1 + (j - j1), i2 - 1)]
+            else:
+                # 追加した文は、直前（先頭なら直後）の文と同じ議題とみなします
+                new_owners[j] = (new_owners[j - 1] if j > 0 else None) or (old_owners[i1] if i1 < len(old_owners) else None)
+            if new_owners[j]:
+                changed_topics.add(new_owners[j])
+    return new_owners, changed_topics, changed_chars
+
+@timed_stage('write_xlsx')
+def create_excel(extracted_info, output_file):
+    # 新しいExcelワークブックを作成します
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "議事録"
+
+    # 列の幅を設定します
+    ws.column_dimensions['A'].width = 20  # A列（議題）の幅を20に設定
+    ws.column_dimensions['B'].width = 80  # B列（内容）の幅を80に設定
+
+    # 会議詳細情報を追加します
+    meeting_details = [
+        "会議名",
+        "日時",
+        "場所",
+        "参加者",
+        "欠席者"
+    ]
+
+    # 会議詳細情報をExcelに書き込みます
+    for i, detail in enumerate(meeting_details, start=1):
+        ws.cell(row=i, column=1, value=detail)  # A列に項目名を書き込み
+        ws.cell(row=i, column=1).font = openpyxl.styles.Font(bold=True)  # 太字に設定
+        ws.cell(row=i, column=1).fill = openpyxl.styles.PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")  # 背景色を設定
+
+    row = 6  # 会議詳細情報の後から議題の書き込みを開始します
+
+    # 抽出された情報から議題と要約の組を取り出して書き込みます
+    for current_topic, current_summary in parse_extracted_topics(extracted_info):
         ws.cell(row=row, column=1, value=current_topic)
         cell = ws.cell(row=row, column=2, value=current_summary)
-        cell.alignment = Alignment(wrap_text=True)
+        cell.alignment = Alignment(wrap_text=True)  # テキストを折り返して表示
+        row += 1
 
     # セルのスタイルを設定します
     for row in ws['A1:B'+str(ws.max_row)]:
@@ -451,60 +1535,1073 @@ def load_output_directory():
             return settings.get('output_directory', os.path.join(Path.home(), 'Documents'))
     return os.path.join(Path.home(), 'Documents')
 
-def process_audio_file(audio_file_path, processed_files):
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことを知らせる例外"""
+
+class BudgetExhausted(Exception):
+    """ジョブの制限時間を使い切ったことを知らせる例外"""
+
+class RetryBudget:
+    """1つのジョブが使えるリトライ回数と時間の予算"""
+    # 失敗し続けるジョブがAPIキーやスレッドを何分も抱え込まないように、
+    # ジョブ全体でのリトライ回数と制限時間を決めておきます。
+    # 待ち時間は指数的に伸ばし、ばらつき（ジッター）を持たせます。
+
+    def __init__(self, cancel_event=None, max_retries=None, time_budget=None,
+                 request_timeout=None, base_backoff=None, max_backoff=None):
+        settings = load_settings()
+        self.cancel_event = cancel_event or threading.Event()
+        self.retries_left = int(max_retries if max_retries is not None else settings.get('job_retry_budget', 6))
+        self.deadline = time.time() + float(time_budget if time_budget is not None else settings.get('job_time_budget_seconds', 1800))
+        self.per_request_timeout = float(request_timeout if request_timeout is not None else settings.get('request_timeout_seconds', 300))
+        self.base_backoff = float(base_backoff if base_backoff is not None else settings.get('retry_backoff_seconds', 5))
+        self.max_backoff = float(max_backoff if max_backoff is not None else settings.get('retry_backoff_max_seconds', 60))
+        self.lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        """制限時間の残り（秒）"""
+        return self.deadline - time.time()
+
+    def check(self):
+        """キャンセルされたか、制限時間を過ぎていれば例外を出す"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        if self.remaining <= 0:
+            raise BudgetExhausted()
+
+    def request_timeout(self):
+        """次のリクエストに使う締め切り（秒）"""
+        self.check()
+        return max(1.0, min(self.per_request_timeout, self.remaining))
+
+    def take_retry(self):
+        """リトライを1回分使う（予算が残っていなければFalse）"""
+        with self.lock:
+            if self.retries_left <= 0 or self.remaining <= 0:
+                logging.error("リトライの予算を使い切りました。")
+                return False
+            self.retries_left -= 1
+            metrics.inc('minutes_retries_total')
+            return True
+
+    def sleep(self, seconds):
+        """キャンセルされるまで、または指定した秒数（残り時間まで）だけ待つ"""
+        if self.cancel_event.wait(max(0.0, min(seconds, self.remaining))):
+            raise JobCancelled()
+
+    async def sleep_async(self, seconds):
+        """sleepのasyncio版（イベントループを止めずに待ちます）"""
+        loop = asyncio.get_running_loop()
+        wake_at = loop.time() + max(0.0, min(seconds, self.remaining))
+        while loop.time() < wake_at:
+            if self.cancel_event.is_set():
+                raise JobCancelled()
+            await asyncio.sleep(min(0.5, wake_at - loop.time()))
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    async def run_cancellable(self, coroutine):
+        """コルーチンを動かし、キャンセルされるか制限時間を過ぎたら途中でも打ち切る"""
+        # 最初の応答を待っている間も0.5秒ごとに確かめるので、キャンセルしてから
+        # 0.5秒ほどでリクエストを手放します（タスクを取り消すとHTTPの接続も閉じます）
+        task = asyncio.ensure_future(coroutine)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=0.5)
+                if done:
+                    return task.result()
+                self.check()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.wait({task})
+
+    async def backoff_async(self, attempt):
+        """attempt回目の失敗のあと、指数的に伸びる時間だけ待つ（イベントループは止めません）"""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        await self.sleep_async(random.uniform(delay / 2, delay))
+
+class APIKeyPool:
+    """複数のジョブで共有するAPIキーの貸し出し係"""
+    # 同時に動くジョブがいくつあっても、1つのキーに同時に送るリクエストの数を
+    # max_requests_per_keyまでに抑えます。空いているキーがなければ返却を待ちます。
+
+    def __init__(self, max_requests_per_key=1):
+        self.max_requests_per_key = max_requests_per_key
+        self.in_use = {}  # APIキー -> 使用中のリクエスト数
+        self.condition = threading.Condition()
+
+    def update_keys(self, api_keys):
+        """設定に保存されているAPIキーの一覧に合わせる"""
+        with self.condition:
+            for key in api_keys:
+                self.in_use.setdefault(key, 0)
+            for key in [k for k in self.in_use if k not in api_keys and self.in_use[k] == 0]:
+                del self.in_use[key]
+            self.condition.notify_all()
+
+    def acquire(self, preferred=None, cancel_event=None, avoid=None):
+        """APIキーを1つ借りる（空くまで待ちます。キャンセルされたらJobCancelled）"""
+        # avoidに渡したキーは、ほかに空いているキーがあれば使いません
+        # 待っている間はminutes_chunks_waitingに数えます
+        waiting = False
+        with self.condition:
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise JobCancelled()
+                    key = self.try_acquire(preferred, avoid)
+                    if key is not None:
+                        return key
+                    if not waiting:
+                        waiting = True
+                        metrics.add_gauge('minutes_chunks_waiting', 1)
+                    self.condition.wait(timeout=0.5)
+            finally:
+                if waiting:
+                    metrics.add_gauge('minutes_chunks_waiting', -1)
+
+    def try_acquire(self, preferred=None, avoid=None):
+        """空いているAPIキーがあれば1つ借りる（なければ待たずにNone）"""
+        with self.condition:
+            if preferred in self.in_use and self.in_use[preferred] < self.max_requests_per_key:
+                key = preferred
+            else:
+                free_keys = [k for k, n in self.in_use.items() if n < self.max_requests_per_key]
+                free_keys = [k for k in free_keys if k != avoid] or free_keys
+                # 一番空いているキーを選びます
+                key = min(free_keys, key=lambda k: self.in_use[k]) if free_keys else None
+            if key is not None:
+                self.in_use[key] += 1
+            return key
+
+    def release(self, key):
+        """借りたAPIキーを返す"""
+        with self.condition:
+            if key in self.in_use:
+                self.in_use[key] = max(0, self.in_use[key] - 1)
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def lease(self, preferred=None, cancel_event=None, avoid=None):
+        """with文で使える貸し出し（ブロックを抜けると自動で返却します）"""
+        key = self.acquire(preferred, cancel_event, avoid)
+        try:
+            yield key
+        finally:
+            self.release(key)
+
+    @contextlib.asynccontextmanager
+    async def lease_async(self, preferred=None, cancel_event=None, avoid=None):
+        """leaseのasyncio版（空くのを待つ間もイベントループを止めません）"""
+        # スレッドで動く処理（情報抽出など）と同じ数え方でキーを共有します
+        key = self.try_acquire(preferred, avoid)
+        if key is None:
+            metrics.add_gauge('minutes_chunks_waiting', 1)
+            try:
+                while key is None:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise JobCancelled()
+                    await asyncio.sleep(0.2)
+                    key = self.try_acquire(preferred, avoid)
+            finally:
+                metrics.add_gauge('minutes_chunks_waiting', -1)
+        try:
+            yield key
+        finally:
+            self.release(key)
+
+    def available_count(self):
+        """今すぐ使えるAPIキーの数"""
+        with self.condition:
+            return sum(1 for n in self.in_use.values() if n < self.max_requests_per_key)
+
+    def free_slots(self):
+        """今すぐ送れるリクエストの数（キーごとの空きの合計）"""
+        with self.condition:
+            return sum(max(0, self.max_requests_per_key - n) for n in self.in_use.values())
+
+# すべてのジョブで共有するAPIキーの貸し出し係
+key_pool = APIKeyPool()
+metrics.set_gauge('minutes_chunks_waiting', 0)
+
+def configure_key_pool(api_keys):
+    """設定に合わせてAPIキーの貸し出し係を更新する関数"""
+    key_pool.max_requests_per_key = max(1, int(load_settings().get('max_requests_per_key', 1)))
+    key_pool.update_keys(api_keys)
+
+# ジョブの状態の表示名
+JOB_STATUS_LABELS = {
+    'queued': '待機中',
+    'running': '処理中',
+    'done': '完了',
+    'failed': '失敗',
+    'cancelled': 'キャンセル',
+}
+
+# チャンクの状態の表示名と、進捗バーに塗る色
+CHUNK_STATE_STYLES = {
+    'queued': ('待機中', '#D0D0D0'),
+    'uploading': ('送信中', '#F2C94C'),
+    'transcribing': ('文字起こし中', '#56CCF2'),
+    'retrying': ('リトライ待ち', '#F2994A'),
+    'done': ('完了', '#27AE60'),
+    'failed': ('失敗', '#EB5757'),
+}
+
+class Job:
+    """1つの音声ファイルの処理（ジョブ）の状態"""
+    # 状態はワーカースレッドがpublish_progressを通してだけ書き換えます。
+    # 読む側はsnapshot()でまとめて取り出します。
+
+    _ids = itertools.count(1)
+
+    def __init__(self, audio_file_path, file_hash=None, output_directory=None, on_finished=None, coalesce_group=None):
+        self.id = next(Job._ids)
+        self.audio_file_path = audio_file_path
+        self.name = os.path.basename(audio_file_path)
+        self.file_hash = file_hash  # 監視モードで見つけたファイルの中身のハッシュ
+        self.output_directory = output_directory  # 省略時は設定の出力先フォルダ
+        self.on_finished = on_finished  # ジョブが終わったときに呼ぶ関数（サーバーモードの後片付け用）
+        self.outputs = {}  # 書き出したファイル: 種類（transcript / xlsx） -> パス
+        self.coalesce_group = coalesce_group  # ほかの短いファイルとまとめて文字起こしするときのCoalescedTranscription
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()  # セットされたら処理を途中でやめます
+        self.status = 'queued'
+        self.stage = ''  # 分割中・文字起こし中などの細かい段階
+        self.chunk_states = []  # チャンクごとの状態（CHUNK_STATE_STYLESのキー）
+        self.chunk_sizes = []  # チャンクごとのバイト数
+        self.bytes_uploaded = 0
+        self.retries = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def apply_event(self, event, details):
+        """進捗イベントをジョブの状態に反映する"""
+        with self.lock:
+            index = details.get('index')
+            if event.startswith('chunk_') and not (index is not None and 0 <= index < len(self.chunk_states)):
+                return  # 分割の前に届いたイベントや、範囲外のチャンクのイベントは無視します
+            if event == 'job_started':
+                self.status = 'running'
+                self.started_at = time.time()
+            elif event == 'job_finished':
+                self.status = details['status']
+                self.stage = ''
+                self.finished_at = time.time()
+            elif event == 'stage':
+                self.stage = details['stage']
+            elif event == 'split_done':
+                self.chunk_sizes = list(details['chunk_sizes'])
+                self.chunk_states = ['queued'] * len(self.chunk_sizes)
+            elif event == 'chunk_started':
+                self.chunk_states[index] = 'uploading'
+            elif event == 'chunk_uploaded':
+                self.chunk_states[index] = 'transcribing'
+                self.bytes_uploaded += self.chunk_sizes[index]
+            elif event == 'chunk_transcribed':
+                self.chunk_states[index] = 'done'
+            elif event == 'chunk_retry':
+                self.chunk_states[index] = 'retrying'
+                self.retries += 1
+            elif event == 'chunk_failed':
+                self.chunk_states[index] = 'failed'
+            elif event == 'output_written':
+                self.outputs[details['kind']] = details['path']
+
+    def snapshot(self):
+        """表示用に今の状態をまとめて取り出す"""
+        with self.lock:
+            total_chunks = len(self.chunk_states)
+            completed_chunks = self.chunk_states.count('done')
+            if self.status == 'done':
+                progress = 1.0
+            elif total_chunks:
+                # 文字起こしが全体の8割、残りを情報抽出と書き出しとみなします
+                progress = 0.8 * completed_chunks / total_chunks
+            else:
+                progress = 0.0
+            elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+            return {
+                'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'stage': self.stage,
+                'chunk_states': list(self.chunk_states),
+                'total_chunks': total_chunks,
+                'completed_chunks': completed_chunks,
+                'progress': progress,
+                'elapsed': elapsed,
+                'bytes_uploaded': self.bytes_uploaded,
+                'retries': self.retries,
+                'outputs': dict(self.outputs),
+            }
+
+# ワーカーからGUIへ進捗を届けるスレッドセーフなキューです。
+# GUIが動いているときだけ使います（監視モードではたまり続けないようにします）。
+progress_events = queue.Queue()
+ui_events_enabled = False
+
+def publish_progress(job, event, **details):
+    """ワーカースレッドから進捗を知らせる関数"""
+    # ジョブの状態を更新し、GUIが動いていればイベントをキューに入れます。
+    # ワーカースレッドからTkのウィジェットを直接さわることはありません。
+    if job is None:
+        return
+    job.apply_event(event, details)
+    if ui_events_enabled:
+        progress_events.put((job.id, event))
+
+def post_to_ui(callback):
+    """Tkのメインスレッドで実行してほしい処理を頼む関数"""
+    if ui_events_enabled:
+        progress_events.put((None, callback))
+    else:
+        callback()
+
+class JobQueue:
+    """複数のジョブを受け付けて、同時に動く数を制限しながら処理する係"""
+
+    def __init__(self, max_concurrent_jobs=2, max_finished_jobs=500):
+        self.jobs = []  # 受け付けた順のジョブ一覧
+        self.max_finished_jobs = max_finished_jobs  # 一覧に残す終わったジョブの数（監視モードなどで増え続けないように）
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_concurrent_jobs))
+
+    def submit(self, audio_file_path, file_hash=None, output_directory=None, on_finished=None, coalesce_group=None):
+        """音声ファイルをジョブとして受け付ける"""
+        job = Job(audio_file_path, file_hash, output_directory, on_finished, coalesce_group)
+        if coalesce_group:
+            coalesce_group.add_member(job)
+        with self.lock:
+            self.jobs.append(job)
+        logging.info(f"{job.name}をジョブ#{job.id}として受け付けました。")
+        publish_progress(job, 'job_queued')
+        self.executor.submit(self._run, job)
+        return job
+
+    def submit_batch(self, audio_file_paths):
+        """まとめて選ばれた音声ファイルを受け付ける（短いファイルはまとめて文字起こしします）"""
+        # 音声の長さを調べるので、GUIからは別スレッドで呼んでください
+        # まとめ方を決められなくても、すべてのファイルを1件ずつ受け付けます
+        groups = {}
+        try:
+            for path, group in group_short_files(audio_file_paths).items():
+                groups[path] = groups.get(group[0]) or CoalescedTranscription(group)
+        except Exception as e:
+            logging.exception(f"短いファイルをまとめる準備に失敗しました。1件ずつ処理します: {str(e)}")
+            groups = {}
+        return [self.submit(path, coalesce_group=groups.get(path)) for path in audio_file_paths]
+
+    def get(self, job_id):
+        """IDからジョブを探す"""
+        with self.lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def is_active_hash(self, file_hash):
+        """同じ中身のファイルが待機中・処理中かどうか"""
+        with self.lock:
+            return any(job.file_hash == file_hash and job.status in ('queued', 'running') for job in self.jobs)
+
+    def forget(self, jobs):
+        """終わったジョブを一覧から外す"""
+        forgotten = {job.id for job in jobs if job.status not in ('queued', 'running')}
+        if not forgotten:
+            return
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job.id not in forgotten]
+
+    def prune_finished(self):
+        """終わったジョブのうち、新しいmax_finished_jobs件だけを一覧に残す"""
+        with self.lock:
+            finished = [job for job in self.jobs if job.status not in ('queued', 'running')]
+            if len(finished) <= self.max_finished_jobs:
+                return
+            finished.sort(key=lambda job: job.finished_at or 0)
+            dropped = {job.id for job in finished[:len(finished) - self.max_finished_jobs]}
+            self.jobs = [job for job in self.jobs if job.id not in dropped]
+
+    def counts(self):
+        """状態ごとのジョブ数"""
+        with self.lock:
+            counts = {status: 0 for status in JOB_STATUS_LABELS}
+            for job in self.jobs:
+                counts[job.status] += 1
+            return counts
+
+    def cancel(self, job_id):
+        """ジョブをキャンセルする（待機中ならすぐに、処理中なら数秒以内に止まります）"""
+        job = self.get(job_id)
+        if job is None or job.status not in ('queued', 'running'):
+            return False
+        logging.info(f"ジョブ#{job.id}（{job.name}）のキャンセルを受け付けました。")
+        job.cancel_event.set()
+        publish_progress(job, 'stage', stage='キャンセル中')
+        return True
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            publish_progress(job, 'job_finished', status='cancelled')
+            if job.on_finished:
+                job.on_finished(job)
+            self.prune_finished()
+            return
+        publish_progress(job, 'job_started')
+        status = 'failed'
+        try:
+            with processed_files_lock:
+                processed_files = load_processed_files()
+            success = process_audio_file(job.audio_file_path, processed_files, job=job)
+            if success:
+                record_processed_file(job, processed_files)
+                status = 'done'
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            logging.exception(f"ジョブ#{job.id}（{job.name}）の処理中にエラーが発生しました: {str(e)}")
+        finally:
+            publish_progress(job, 'job_finished', status=status)
+            logging.info(f"ジョブ#{job.id}（{job.name}）が{JOB_STATUS_LABELS[status]}しました。")
+            if job.on_finished:
+                job.on_finished(job)
+            self.prune_finished()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+# アプリ全体で1つのジョブキュー（最初に使うときに作ります）
+job_queue = None
+
+def load_max_concurrent_jobs(settings=None):
+    """同時に処理するジョブの数の設定を読み込む関数"""
+    # 以前の監視モードの設定名（watch_max_concurrency）も、max_concurrent_jobsがなければ使います
+    settings = settings or load_settings()
+    return max(1, int(settings.get('max_concurrent_jobs', settings.get('watch_max_concurrency', 2))))
+
+def get_job_queue():
+    """アプリ全体で共有するジョブキューを取得する関数"""
+    global job_queue
+    if job_queue is None:
+        settings = load_settings()
+        job_queue = JobQueue(max_concurrent_jobs=load_max_concurrent_jobs(settings),
+                             max_finished_jobs=max(1, int(settings.get('max_finished_jobs', 500))))
+    return job_queue
+
+def job_queue_metrics():
+    """状態ごとのジョブの数を指標の形で返す関数（ジョブキューを作る前は空）"""
+    if job_queue is None:
+        return {}
+    return {(('status', status),): count for status, count in job_queue.counts().items()}
+
+metrics.register_gauge('minutes_jobs', job_queue_metrics)
+
+def shutdown_job_queue(wait=True):
+    """ジョブキューを止める関数（処理中のジョブが終わるまで待ちます）"""
+    global job_queue
+    if job_queue is not None:
+        job_queue.shutdown(wait=wait)
+        job_queue = None
+
+def load_quality_settings():
+    """文字起こし結果の品質チェックの設定を読み込む関数"""
+    settings = load_settings()
+    return {
+        'enabled': bool(settings.get('quality_checks_enabled', True)),
+        # 1秒あたりの文字数（空白を除く）の想定範囲。日本語の会話はおおよそ4〜8文字/秒です
+        'min_chars_per_second': float(settings.get('quality_min_chars_per_second', 1.0)),
+        'max_chars_per_second': float(settings.get('quality_max_chars_per_second', 25.0)),
+        'min_duration': float(settings.get('quality_min_duration_seconds', 30)),  # これより短い音声は文字数を調べません
+        # zlibの圧縮率（圧縮後/圧縮前）がこれより小さければ、同じ言い回しの繰り返しとみなします
+        'min_compression_ratio': float(settings.get('quality_min_compression_ratio', 0.15)),
+        'max_reruns': int(settings.get('quality_max_reruns', 1)),  # 1チャンクあたりのやり直しの回数
+    }
+
+# 生成が途中で打ち切られたことを示す終了理由
+TRUNCATED_FINISH_REASONS = ('MAX_TOKENS', 'SAFETY', 'RECITATION', 'OTHER')
+
+def compression_ratio(text):
+    """文章をzlibで圧縮したときの圧縮率（繰り返しが多いほど小さくなります）"""
+    data = text.encode('utf-8')
+    return len(zlib.compress(data, 6)) / len(data) if data else 1.0
+
+def check_transcript_quality(text, duration, finish_reason=None, quality_settings=None):
+    """チャンクの文字起こし結果の疑わしい点のリストを返す関数（問題がなければ空のリスト）"""
+    quality_settings = quality_settings or load_quality_settings()
+    if not quality_settings['enabled']:
+        return []
+    problems = []
+    if finish_reason in TRUNCATED_FINISH_REASONS:
+        problems.append(f"途中で打ち切られています（{finish_reason}）")
+    chars = len("".join((text or "").split()))
+    if duration and duration >= quality_settings['min_duration']:
+        chars_per_second = chars / duration
+        if chars_per_second < quality_settings['min_chars_per_second']:
+            problems.append(f"音声の長さに対して文字数が少なすぎます（{chars_per_second:.1f}文字/秒）")
+        elif chars_per_second > quality_settings['max_chars_per_second']:
+            problems.append(f"音声の長さに対して文字数が多すぎます（{chars_per_second:.1f}文字/秒）")
+    if chars >= 300:
+        # 繰り返しは終わりの方で起きやすいので、全体と最後の3分の1の両方を調べます
+        ratio = min(compression_ratio(text), compression_ratio(text[-len(text) // 3:]))
+        if ratio < quality_settings['min_compression_ratio']:
+            problems.append(f"同じ言い回しが繰り返されています（圧縮率{ratio:.2f}）")
+    return problems
+
+def load_transcription_settings():
+    """1つのジョブの文字起こしで使う設定をまとめて読み込む関数"""
+    # イベントループの中でファイルを読まないように、ジョブのスレッドで1回だけ読んで渡します
+    settings = load_settings()
+    return {
+        'max_attempts': max(1, int(settings.get('max_attempts_per_chunk', 3))),
+        'max_requests_per_job': max(1, int(settings.get('max_requests_per_job', 8))),
+        'vad': load_vad_settings(),
+        'quality': load_quality_settings(),
+        'model_settings': load_model_settings(),
+    }
+
+async def transcribe_chunk_async(audio_chunk, preferred_key, job_settings, budget, job=None, chunk_index=None, job_slots=None):
+    """キーの貸し出し係からAPIキーを借りて、チャンクを文字起こしするコルーチン"""
+    # 戻り値は（文字起こし結果, 使ったAPIキー）です
+    # 1回試すごとにキーを返却するので、リトライを待っている間は他のジョブがキーを使えます
+    # job_settingsはload_transcription_settingsの戻り値、job_slotsはジョブごとの同時リクエスト数を抑えるセマフォです
+    max_attempts = job_settings['max_attempts']
+    models = model_candidates('transcription', duration=audio_chunk['duration'], model_settings=job_settings['model_settings'])
+    result = api_key = None
+    async with job_slots or contextlib.nullcontext():
+        for attempt in range(max_attempts):
+            async with key_pool.lease_async(preferred_key, budget.cancel_event) as api_key:
+                result = await transcribe_audio_async(audio_chunk, api_key, models, job, chunk_index, budget)
+            if result:
+                break
+            if attempt == max_attempts - 1 or not budget.take_retry():
+                break
+            logging.info(f"{audio_chunk['name']}のリトライを試みます ({attempt + 2}/{max_attempts})")
+            publish_progress(job, 'chunk_retry', index=chunk_index)
+            await budget.backoff_async(attempt)
+            preferred_key = None  # 次は空いているほかのキーでも構いません
+        if result:
+            result, api_key = await rerun_suspect_chunk_async(audio_chunk, result, api_key, models, job_settings,
+                                                              budget, job, chunk_index)
+    publish_progress(job, 'chunk_transcribed' if result else 'chunk_failed', index=chunk_index)
+    return result, api_key
+
+async def rerun_suspect_chunk_async(audio_chunk, result, api_key, candidates, job_settings, budget, job=None, chunk_index=None):
+    """品質チェックで疑わしいチャンクだけを、別のキーと別のモデルで文字起こしし直すコルーチン"""
+    # 戻り値は（採用した文字起こし結果, 使ったAPIキー）です。
+    # やり直しても良くならなければ、疑わしい点の少ない方を採用します。
+    quality_settings = job_settings['quality']
+    problems = check_transcript_quality(result, audio_chunk['duration'], audio_chunk.get('finish_reason'), quality_settings)
+    models = candidates[1:] + candidates[:1]  # 切り替え先のモデルを先に試します
+    for rerun in range(quality_settings['max_reruns']):
+        if not problems or not budget.take_retry():
+            break
+        logging.warning(f"{audio_chunk['name']}の文字起こし結果が疑わしいため、やり直します: {'、'.join(problems)}")
+        publish_progress(job, 'chunk_retry', index=chunk_index)
+        async with key_pool.lease_async(None, budget.cancel_event, avoid=api_key) as rerun_key:
+            rerun_result = await transcribe_audio_async(audio_chunk, rerun_key, models, job, chunk_index, budget)
+        if not rerun_result:
+            continue
+        rerun_problems = check_transcript_quality(rerun_result, audio_chunk['duration'],
+                                                  audio_chunk.get('finish_reason'), quality_settings)
+        if len(rerun_problems) < len(problems):
+            result, api_key, problems = rerun_result, rerun_key, rerun_problems
+    if problems:
+        logging.warning(f"{audio_chunk['name']}の文字起こし結果に疑わしい点が残っています: {'、'.join(problems)}")
+    return result, api_key
+
+def load_split_settings():
+    """音声の分け方（分割数とまとめ送り）の設定を読み込む関数"""
+    settings = load_settings()
+    single_request_max_seconds = float(settings.get('single_request_max_seconds', 600))
+    return {
+        'single_request_max_seconds': single_request_max_seconds,  # これより短い音声は分割しません
+        'min_chunk_seconds': float(settings.get('min_chunk_seconds', 300)),  # チャンクをこれより短くしません
+        'max_chunk_seconds': float(settings.get('max_chunk_seconds', 900)),  # チャンクをこれより長くしません
+        'coalesce': bool(settings.get('coalesce_short_files', True)),
+        'coalesce_max_file_seconds': float(settings.get('coalesce_max_file_seconds', single_request_max_seconds)),
+        # まとめて送る音声の合計の長さ（初期値はflashモデルに振り分けられる長さです）
+        'coalesce_max_seconds': float(settings.get('coalesce_max_seconds', 900)),
+        'coalesce_max_files': int(settings.get('coalesce_max_files', 5)),
+        # 1回のリクエストに直接載せる音声の大きさの上限（Geminiはリクエスト全体で約20MBまでです）
+        'inline_max_bytes': float(settings.get('inline_request_max_mb', 18)) * 1024 * 1024,
+    }
+
+def inline_parts_needed(file_size, split_settings):
+    """チャンクを1回のリクエストに載せられる大きさにするのに必要な分割数を返す関数"""
+    # チャンクの大きさは元のファイルの長さあたりの大きさに比例するとみなします（WAVはそのまま、MP3・M4Aはコピーです）
+    if not file_size or file_size <= split_settings['inline_max_bytes']:
+        return 1
+    # 前後の10%の重なりを含めても上限に収まるようにします
+    return math.ceil(file_size * 1.1 / split_settings['inline_max_bytes'])
+
+def num_parts_bounds(duration, split_settings, file_size=0):
+    """分割数の（最小, 最大）を返す関数"""
+    # 短く小さい音声は1回のリクエストで送ります（分割するとリクエストごとの待ち時間と重なりの分が無駄になります）。
+    # 長い音声は、チャンクがmax_chunk_seconds以下・min_chunk_seconds以上になる範囲で分けます。
+    # どちらの場合も、チャンクがinline_max_bytesを超えないだけの数には分けます。
+    size_parts = inline_parts_needed(file_size, split_settings)
+    if not duration or (duration <= split_settings['single_request_max_seconds'] and size_parts == 1):
+        return 1, 1
+    # 前後の10%の重なりを含めてもmax_chunk_secondsに収まるようにします
+    min_parts = max(1, math.ceil(duration * 1.1 / split_settings['max_chunk_seconds']), size_parts)
+    max_parts = max(min_parts, int(duration // split_settings['min_chunk_seconds']))
+    return min_parts, max_parts
+
+def choose_num_parts(duration, free_slots, split_settings=None, file_size=0):
+    """音声の長さと大きさ、空いているAPIキーの数から分割数を決める関数"""
+    # 範囲の中で、今空いているキーの数（すぐに送れるリクエストの数）に近い数に分けます
+    min_parts, max_parts = num_parts_bounds(duration, split_settings or load_split_settings(), file_size)
+    return min(max_parts, max(min_parts, free_slots))
+
+def group_short_files(audio_file_paths, split_settings=None):
+    """まとめて1回のリクエストで送る短い音声ファイルの組を作る関数"""
+    # 戻り値は、組になったファイルのパス -> 同じ組のパスのリスト です（1件だけの組は含めません）
+    split_settings = split_settings or load_split_settings()
+    if not split_settings['coalesce']:
+        return {}
+    # 組の合計の大きさも、1回のリクエストに載せられる上限（inline_max_bytes）までにします
+    groups = []
+    current, current_seconds, current_bytes = [], 0.0, 0
+    for path in audio_file_paths:
+        try:
+            duration = get_audio_duration(path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            # 長さを調べられないファイルはまとめず、1件ずつの処理に任せます
+            logging.warning(f"{os.path.basename(path)}の長さを調べられなかったため、まとめずに処理します: {str(e)}")
+            continue
+        if (not duration or duration > split_settings['coalesce_max_file_seconds']
+                or size > split_settings['inline_max_bytes']):
+            continue
+        if current and (current_seconds + duration > split_settings['coalesce_max_seconds']
+                        or current_bytes + size > split_settings['inline_max_bytes']
+                        or len(current) >= split_settings['coalesce_max_files']):
+            groups.append(current)
+            current, current_seconds, current_bytes = [], 0.0, 0
+        current.append(path)
+        current_seconds += duration
+        current_bytes += size
+    groups.append(current)
+    return {path: group for group in groups if len(group) > 1 for path in group}
+
+def split_coalesced_text(text, count):
+    """まとめて文字起こしした結果を、見出しで音声ごとに分ける関数（分けられなければNone）"""
+    pieces = re.split(r'【音声(\d+)】', text)
+    texts = {}
+    for number, body in zip(pieces[1::2], pieces[2::2]):
+        if number in texts or not body.strip():
+            return None
+        texts[number] = body.strip()
+    if sorted(texts, key=int) != [str(i) for i in range(1, count + 1)]:
+        return None
+    return [texts[str(i)] for i in range(1, count + 1)]
+
+def transcribe_coalesced(audio_file_paths, durations, budget):
+    """複数の短い音声を1回のリクエストで文字起こしする関数"""
+    # 戻り値は（パス -> 文字起こし結果, 使ったAPIキー）です。失敗したら（None, None）を返します。
+    # durationsはパス -> 音声の長さです
+    vad_settings = load_vad_settings()
+    chunks = [extract_audio_chunk(path, 0, durations[path], os.path.basename(path), vad_settings) for path in audio_file_paths]
+    if not all(chunks):
+        logging.warning("切り出せない音声があるため、まとめずに1件ずつ文字起こしします。")
+        return None, None
+    if sum(len(chunk['data']) for chunk in chunks) > load_split_settings()['inline_max_bytes']:
+        logging.warning("まとめると1回のリクエストに載せられない大きさになるため、1件ずつ文字起こしします。")
+        return None, None
+    prompt = (f"{transcription_prompt}\n\nこれから{len(chunks)}件の別々の音声を送ります。"
+              "それぞれの音声の直前にある「【音声1】」のような見出しを、その音声の文字起こしの先頭にそのまま書いてください。"
+              "音声どうしの内容を混ぜないでください。")
+    contents = [prompt]
+    for i, chunk in enumerate(chunks, start=1):
+        contents += [f"【音声{i}】", {"mime_type": chunk['mime_type'], "data": chunk['data']}]
+    models = model_candidates('transcription', duration=sum(chunk['duration'] for chunk in chunks))
+    names = "、".join(chunk['name'] for chunk in chunks)
+    try:
+        with key_pool.lease(None, budget.cancel_event) as api_key:
+            response, model_name = generate_with_fallback(models, contents, api_key, budget)
+        texts = split_coalesced_text(response.text, len(chunks))
+    except (JobCancelled, BudgetExhausted):
+        raise
+    except Exception as e:
+        logging.error(f"まとめての文字起こしに失敗しました（{names}）: {str(e)}")
+        return None, None
+    if texts is None:
+        logging.warning(f"まとめての文字起こし結果を音声ごとに分けられませんでした。1件ずつ文字起こしします（{names}）。")
+        return None, None
+    logging.info(f"{len(chunks)}件の音声をまとめて文字起こししました（{model_name}）: {names}")
+    return dict(zip(audio_file_paths, texts)), api_key
+
+class GroupCancelEvent:
+    """複数のジョブのキャンセルの目印をまとめたもの（全員がキャンセルしたときだけセットされたとみなします）"""
+    # RetryBudgetやAPIKeyPoolが使うis_setとwaitだけを持っています
+    # size人がそろうまでは、キャンセルされていないジョブが残っているとみなします
+
+    def __init__(self, size):
+        self.size = size
+        self.events = []
+
+    def add(self, event):
+        """ジョブのキャンセルの目印を加える"""
+        self.events.append(event)
+
+    def is_set(self):
+        """全員がキャンセルしたか"""
+        events = list(self.events)
+        return len(events) >= self.size and all(event.is_set() for event in events)
+
+    def wait(self, timeout=None):
+        """全員がキャンセルするまで、または指定した秒数だけ待つ"""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_set():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.2 if deadline is None else max(0.0, min(0.2, deadline - time.time())))
+        return True
+
+class CoalescedTranscription:
+    """同じバッチの短い音声ファイルをまとめて1回のリクエストで文字起こしする係"""
+    # 最初にここへ来たジョブがまとめて送り、ほかのジョブは結果を待って自分の分を受け取ります。
+    # 結果を音声ごとに分けられなかったときは、それぞれのジョブが1件ずつ文字起こしし直します。
+    # まとめたリクエストは組の全員のためのものなので、組の予算で送り、全員がキャンセルしたときだけ止めます。
+
+    def __init__(self, audio_file_paths):
+        self.audio_file_paths = list(audio_file_paths)
+        self.lock = threading.Lock()
+        self.attempted = False
+        self.texts = None  # パス -> 文字起こし結果
+        self.durations = {}  # パス -> 音声の長さ
+        self.api_key = None
+        self.cancel_event = GroupCancelEvent(len(self.audio_file_paths))
+
+    def add_member(self, job):
+        """組に入るジョブを登録する（そのジョブのキャンセルも組のキャンセルの判断に使います）"""
+        self.cancel_event.add(job.cancel_event)
+
+    def transcribe_group(self):
+        """組の音声をまとめて文字起こしする（最初に来たジョブのスレッドで呼ばれます）"""
+        try:
+            self.durations = {path: get_audio_duration(path) for path in self.audio_file_paths}
+        except Exception as e:
+            logging.warning(f"音声の長さを調べられなかったため、まとめずに1件ずつ文字起こしします: {str(e)}")
+            return
+        if not all(self.durations.values()):
+            logging.warning("音声の長さを取得できないファイルがあるため、まとめずに1件ずつ文字起こしします。")
+            return
+        try:
+            self.texts, self.api_key = transcribe_coalesced(self.audio_file_paths, self.durations,
+                                                            RetryBudget(cancel_event=self.cancel_event))
+        except (JobCancelled, BudgetExhausted):
+            logging.info("組のすべてのジョブがキャンセルされたため、まとめての文字起こしを止めました。")
+
+    def transcribe(self, job, budget):
+        """このジョブの分の（文字起こし結果, 使ったAPIキー）を返す（なければNone）"""
+        publish_progress(job, 'split_done', chunk_sizes=[os.path.getsize(job.audio_file_path)])
+        publish_progress(job, 'stage', stage='文字起こし中（まとめて送信）')
+        publish_progress(job, 'chunk_started', index=0)
+        while not self.lock.acquire(timeout=0.5):
+            budget.check()  # 待っている間もキャンセルを受け付けます
+        try:
+            if not self.attempted:
+                self.attempted = True
+                self.transcribe_group()
+        finally:
+            self.lock.release()
+        budget.check()  # まとめて送っている間にこのジョブがキャンセルされていれば止めます
+        text = self.texts.get(job.audio_file_path) if self.texts else None
+        if not text:
+            return None
+        # 疑わしい結果なら、このファイルだけ1件ずつの文字起こしでやり直します
+        problems = check_transcript_quality(text, self.durations[job.audio_file_path])
+        if problems:
+            logging.warning(f"{job.name}のまとめての文字起こし結果が疑わしいため、1件ずつやり直します: {'、'.join(problems)}")
+            return None
+        publish_progress(job, 'chunk_transcribed', index=0)
+        return text, self.api_key
+
+class TranscriptionEngine:
+    """すべてのジョブのGeminiへのリクエストを1つのasyncioイベントループで行う係"""
+    # チャンクごとにスレッドを作らないので、バッチやジョブサーバーで数百のリクエストを
+    # 同時に待っていてもスレッドは増えません。ループは専用のスレッドで動き続け、
+    # ジョブのスレッド（情報抽出・まとめ送り・共有キューのワーカーも）はrunでコルーチンを渡して結果を待ちます。
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="transcription-engine", daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine):
+        """コルーチンをエンジンのループで動かし、終わるまで待つ"""
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError("エンジンのループの中からrunは呼べません。awaitしてください。")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+# アプリ全体で1つの文字起こしエンジン（最初に使うときに作ります）
+transcription_engine = None
+transcription_engine_lock = threading.Lock()
+
+def get_transcription_engine():
+    """アプリ全体で共有する文字起こしエンジンを取得する関数"""
+    global transcription_engine
+    with transcription_engine_lock:
+        if transcription_engine is None:
+            transcription_engine = TranscriptionEngine()
+        return transcription_engine
+
+async def transcribe_in_parts_async(audio_file_path, num_parts, api_keys, word_output_file, job_settings, budget, job=None):
+    """音声ファイルを分割して、APIキーを並行して使って文字起こしするコルーチン"""
+    # 戻り値は（チャンクごとの文字起こし結果, 成功したAPIキー, ProgressiveTranscript）です
+    transcribed_texts = [None] * num_parts  # インデックスに基づいて配置するリスト
+
+    publish_progress(job, 'stage', stage='分割中')
+    audio_parts = await split_audio_file_async(audio_file_path, num_parts, job_settings['vad'])
+    transcript = ProgressiveTranscript(word_output_file, len(audio_parts))
+    publish_progress(job, 'split_done', chunk_sizes=[len(part['data']) if part else 0 for part in audio_parts])
+    publish_progress(job, 'stage', stage='文字起こし中')
+
+    # キーごとの同時リクエスト数は貸し出し係が、ジョブごとの数はこのセマフォが抑えます
+    job_slots = asyncio.Semaphore(job_settings['max_requests_per_job'])
+
+    async def transcribe_part(index, part):
+        if part is None:
+            # 切り出せなかったチャンクはAPIに送らずに失敗とします
+            publish_progress(job, 'chunk_failed', index=index)
+            return index, None, None
+        result, used_key = await transcribe_chunk_async(part, api_keys[index % len(api_keys)], job_settings, budget,
+                                                        job, index, job_slots)
+        return index, result, used_key
+
+    tasks = [asyncio.ensure_future(transcribe_part(i, part)) for i, part in enumerate(audio_parts)]
+    successful_api_keys = []  # 成功したAPIキーを記録するリスト
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result, used_key = await next_done
+            part = audio_parts[index]['name'] if audio_parts[index] else f"{os.path.basename(audio_file_path)}_part{index + 1}"
+            # Wordファイルへの書き出しはループを止めないようにスレッドで行います
+            await asyncio.to_thread(transcript.add, index, result)
+            if result:
+                transcribed_texts[index] = result
+                logging.info(f"{part}の処理が成功しました。")
+                if used_key not in successful_api_keys:
+                    successful_api_keys.append(used_key)  # 成功したAPIキーを記録
+            else:
+                # リトライはtranscribe_chunk_asyncの中で予算の範囲内で済ませています
+                logging.error(f"{part}の処理が失敗しました。")
+    finally:
+        # キャンセルや制限時間切れで抜けるときは、残りのチャンクも止めます
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return transcribed_texts, successful_api_keys, transcript
+
+def transcribe_in_parts(audio_file_path, num_parts, api_keys, word_output_file, job=None, budget=None):
+    """音声ファイルを分割して、APIキーを並行して使って文字起こしする関数"""
+    # 処理は文字起こしエンジンのイベントループで行い、このスレッドは終わるのを待つだけです
+    budget = budget or RetryBudget()
+    return get_transcription_engine().run(transcribe_in_parts_async(
+        audio_file_path, num_parts, api_keys, word_output_file, load_transcription_settings(), budget, job))
+
+def save_extraction_results(audio_file_name, meeting_name, cleaned_text, output_directory, processed_files,
+                            api_keys, job=None, budget=None, transcript_text=None):
+    """文字起こし結果から情報を抽出してExcelファイルに保存する関数"""
+    # 戻り値は保存したExcelファイルのパスです（抽出に失敗したらNone）
+    # transcript_textは改行を残した文字起こしで、再抽出用のセグメントを段落ごとに分けるのに使います
+    budget = budget or RetryBudget()
+    transcript_text = transcript_text or cleaned_text
+    output_file = os.path.join(output_directory, f"{meeting_name}_抽出結果.xlsx")
+
+    # 同じ文字起こし・指示文・モデル設定で抽出済みなら、APIを呼ばずにキャッシュを使います
+    cached = load_cached_extraction(cleaned_text)
+    if cached:
+        create_excel(cached['extracted_text'], output_file)
+        save_transcript_segments(output_file, transcript_text, cached['extracted_text'])
+        processed_files[audio_file_name] = output_file
+        publish_progress(job, 'output_written', kind='xlsx', path=output_file)
+        index_job_outputs(meeting_name, xlsx_file=output_file, extracted_info=cached['extracted_text'])
+        return output_file
+
+    # 70秒のバッファを持たせる
+    publish_progress(job, 'stage', stage='情報抽出待ち')
+    budget.sleep(70)  # キャンセルされたらすぐに抜けます
+
+    # 渡されたAPIキーを順に使って情報抽出を試みる
+    for api_key in api_keys:
+        try:
+            publish_progress(job, 'stage', stage='情報抽出中')
+            with key_pool.lease(api_key, budget.cancel_event) as leased_key:
+                extracted_info = extract_information(cleaned_text, leased_key, budget=budget)
+            if extracted_info:
+                save_cached_extraction(cleaned_text, extracted_info)
+                create_excel(extracted_info, output_file)
+                save_transcript_segments(output_file, transcript_text, extracted_info)
+                processed_files[audio_file_name] = output_file
+                publish_progress(job, 'output_written', kind='xlsx', path=output_file)
+                index_job_outputs(meeting_name, xlsx_file=output_file, extracted_info=extracted_info)
+                return output_file
+        except (google.api_core.exceptions.ResourceExhausted, google.api_core.exceptions.DeadlineExceeded):
+            logging.error(f"{api_key}での情報抽出が失敗しました。次のAPIキーを試します。")
+    logging.error(f"{audio_file_name}の情報抽出に失敗しました。")
+    return None
+
+
+# Excelファイルのうち、利用者が手で入力する会議の詳細（会議名・日時・場所・参加者・欠席者）のセル
+MEETING_DETAIL_CELLS = ['B1', 'B2', 'B3', 'B4', 'B5']
+
+def rewrite_excel_keeping_details(extracted_info, xlsx_path):
+    """抽出結果のExcelファイルを作り直す関数（手で入力した会議の詳細は残します）"""
+    details = []
+    if os.path.exists(xlsx_path):
+        sheet = openpyxl.load_workbook(xlsx_path).active
+        details = [sheet[cell].value for cell in MEETING_DETAIL_CELLS]
+    create_excel(extracted_info, xlsx_path)
+    if any(value is not None for value in details):
+        wb = openpyxl.load_workbook(xlsx_path)
+        for cell, value in zip(MEETING_DETAIL_CELLS, details):
+            wb.active[cell] = value
+        wb.save(xlsx_path)
+
+def reextract_topics(topic_texts, api_keys, budget):
+    """議題ごとの文章から、議題と要約を並行して作り直す関数（{番号: 抽出結果のテキスト}を返します）"""
+    def extract_topic(label, text):
+        for api_key in api_keys:
+            try:
+                with key_pool.lease(api_key, budget.cancel_event) as leased_key:
+                    extracted = extract_information(text, leased_key, budget=budget,
+                                                    prompt=create_topic_extraction_prompt(label, text))
+                if extracted and parse_extracted_topics(extracted):
+                    return extracted
+            except (google.api_core.exceptions.ResourceExhausted, google.api_core.exceptions.DeadlineExceeded):
+                logging.error(f"{label}の抽出が失敗しました。次のAPIキーを試します。")
+            except Exception as e:
+                # 1つの議題の失敗で、ほかの議題の抽出は止めません
+                logging.error(f"{label}の抽出中にエラーが発生しました: {str(e)}")
+                return None
+        return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(topic_texts), len(api_keys)))) as executor:
+        futures = {label: executor.submit(extract_topic, label, text) for label, text in topic_texts.items()}
+        return {label: future.result() for label, future in futures.items()}
+
+@timed_stage('reextraction')
+def reextract_transcript(transcript_path, output_directory=None):
+    """修正した文字起こしから、変わった議題だけを抽出し直してExcelと議事録を作り直す関数"""
+    # 前回の抽出に使った文字起こしと文ごとに比べ、直した文を含む議題だけをAPIに送ります。
+    # 前回の記録がないときや、変わった部分が多すぎるとき（reextract_max_changed_ratio）は全体を抽出し直します。
+    # 戻り値は作り直したExcelファイルのパスです（失敗したらNone）
+    try:
+        meeting_name = os.path.splitext(os.path.basename(transcript_path))[0]
+        if meeting_name.endswith('_文字起こし'):
+            meeting_name = meeting_name[:-len('_文字起こし')]
+        output_directory = output_directory or os.path.dirname(os.path.abspath(transcript_path))
+        xlsx_path = os.path.join(output_directory, f"{meeting_name}_抽出結果.xlsx")
+
+        api_keys = [key for key in load_api_keys() if key]
+        if not api_keys:
+            logging.error("APIキーがロードされていません。処理を中止します。")
+            return None
+        configure_key_pool(api_keys)
+        budget = RetryBudget()
+
+        transcript_text = read_transcript_docx(transcript_path)
+        cleaned_text = normalize_transcript(transcript_text)
+        new_segments = split_transcript_segments(transcript_text)
+        previous = load_transcript_segments(xlsx_path)
+        new_owners = None
+
+        cached = load_cached_extraction(cleaned_text)
+        if cached:
+            extracted_info = cached['extracted_text']
+        elif previous is None:
+            logging.info(f"{meeting_name}の前回の抽出の記録がないため、全体を抽出し直します。")
+            extracted_info = None
+        else:
+            new_owners, changed_topics, changed_chars = diff_transcript_segments(
+                previous['segments'], previous['owners'], new_segments)
+            max_ratio = float(load_settings().get('reextract_max_changed_ratio', 0.5))
+            if changed_chars > max_ratio * max(1, len(cleaned_text)) or (new_segments and not any(new_owners)):
+                logging.info(f"{meeting_name}の文字起こしが大きく変わっているため、全体を抽出し直します。")
+                extracted_info = new_owners = None
+            else:
+                logging.info(f"{meeting_name}の文字起こしの変更: {changed_chars}文字、抽出し直す議題: {'、'.join(sorted(changed_topics)) or 'なし'}")
+                topic_texts = {label: "\n".join(segment for segment, owner in zip(new_segments, new_owners) if owner == label)
+                               for label in changed_topics}
+                results = reextract_topics({label: text for label, text in topic_texts.items() if text}, api_keys, budget)
+                if any(result is None for result in results.values()):
+                    logging.error(f"{meeting_name}の議題の抽出に失敗しました。")
+                    return None
+                # 変わらなかった議題は前回の行をそのまま使い、文章がなくなった議題は消します
+                blocks = []
+                for label, block in split_extracted_blocks(previous['extracted_text']):
+                    if label not in changed_topics:
+                        blocks.append(block)
+                    elif results.get(label):
+                        blocks.append(relabel_topic_block(results[label], label))
+                extracted_info = "\n\n".join(blocks)
+
+        if extracted_info is None:
+            for api_key in api_keys:
+                try:
+                    with key_pool.lease(api_key, budget.cancel_event) as leased_key:
+                        extracted_info = extract_information(cleaned_text, leased_key, budget=budget)
+                    if extracted_info:
+                        break
+                except (google.api_core.exceptions.ResourceExhausted, google.api_core.exceptions.DeadlineExceeded):
+                    logging.error(f"{api_key}での情報抽出が失敗しました。次のAPIキーを試します。")
+            if not extracted_info:
+                logging.error(f"{meeting_name}の情報抽出に失敗しました。")
+                return None
+
+        save_cached_extraction(cleaned_text, extracted_info)
+        rewrite_excel_keeping_details(extracted_info, xlsx_path)
+        save_transcript_segments(xlsx_path, transcript_text, extracted_info, new_owners)
+        index_job_outputs(meeting_name, transcript_file=transcript_path, transcript_text=transcript_text,
+                          xlsx_file=xlsx_path, extracted_info=extracted_info)
+
+        template_path = os.path.join(get_current_dir(), 'テンプレート.docx')
+        if os.path.exists(template_path):
+            create_minutes(xlsx_path, template_path, xlsx_path.replace('_抽出結果.xlsx', '_議事録.docx'))
+        logging.info(f"{meeting_name}の抽出結果を作り直しました: {xlsx_path}")
+        return xlsx_path
+    except Exception as e:
+        # ファイルが開けない、Excelで開かれている、APIが失敗したなどの場合です
+        logging.exception(f"{transcript_path}の抽出結果の作り直し中にエラーが発生しました: {str(e)}")
+        return None
+
+def process_audio_file(audio_file_path, processed_files, job=None):
     try:
         audio_file_name = os.path.basename(audio_file_path)
         file_size = os.path.getsize(audio_file_path)
         logging.info(f"{audio_file_name}の処理を開始します。ファイルサイズ: {file_size / (1024 * 1024):.2f}MB")
 
-        # APIキーをロード
-        api_keys = load_api_keys()
+        # APIキーをロード（空欄のキーは使いません）
+        api_keys = [key for key in load_api_keys() if key]
         if not api_keys:
             logging.error("APIキーがロードされていません。処理を中止します。")
             return False
-
-        # 音声ファイルを分割する数を決定
-        num_parts = len(api_keys)  # APIキーの数に応じて分割数を決定
-
-        transcribed_texts = [None] * num_parts  # インデックスに基づいて配置するリスト
-
-        audio_parts = split_audio_file(audio_file_path, num_parts)
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_index = {executor.submit(transcribe_audio_with_key, part, api_keys[i]): i for i, part in enumerate(audio_parts)}
-            failed_parts = []
-            successful_api_keys = []  # 成功したAPIキーを記録するリスト
-            for future in concurrent.futures.as_completed(future_to_index):
-                index = future_to_index[future]
-                part = audio_parts[index]
-                result = future.result()
-                if result:
-                    transcribed_texts[index] = result
-                    logging.info(f"{part}の処理が成功しました。")
-                    if api_keys[index] not in successful_api_keys:
-                        successful_api_keys.append(api_keys[index])  # 成功したAPIキーを記録
-                else:
-                    logging.error(f"{part}の処理が失敗しました。")
-                    failed_parts.append((index, part))
-
-        # 失敗したパートのリトライ
-        if failed_parts:
-            logging.info("失敗したファイルのリトライを1分後に開始します。")
-            time.sleep(60)
-            for index, part in failed_parts:
-                result = transcribe_audio_with_key(part, api_keys[0])
-                if result:
-                    transcribed_texts[index] = result
-                    logging.info(f"{part}のリトライが成功しました。")
-                    if api_keys[0] not in successful_api_keys:
-                        successful_api_keys.append(api_keys[0])  # リトライで成功したAPIキーを記録
-                else:
-                    logging.error(f"{part}のリトライが失敗しました。")
-
-        # 分割されたファイルを削除
-        for part in audio_parts:
-            os.remove(part)
-        logging.info(f"{audio_file_name}の分割されたファイルを削除しました。")
+        configure_key_pool(api_keys)
+
+        # キャンセル・制限時間・リトライ回数はジョブ全体で1つの予算を使います
+        budget = RetryBudget(cancel_event=job.cancel_event if job else None)
+
+        # 文字起こし結果は、終わった部分から順にWordファイルへ書き出します
+        output_directory = (job.output_directory if job else None) or load_output_directory()
+        meeting_name = os.path.splitext(audio_file_name)[0]  # 出力ファイルと検索で使う会議名
+        word_output_file = os.path.join(output_directory, f"{meeting_name}_文字起こし.docx")
+
+        # 同じバッチの短いファイルとまとめて文字起こしできた場合は、その結果を使います
+        coalesced = job.coalesce_group.transcribe(job, budget) if job and job.coalesce_group else None
+        if coalesced:
+            text, used_key = coalesced
+            transcript = ProgressiveTranscript(word_output_file, 1)
+            transcript.add(0, text)
+            transcribed_texts, successful_api_keys = [text], [used_key]
+        else:
+            # 音声の長さと、今空いているAPIキーの数から分割数を決めます
+            duration = get_audio_duration(audio_file_path)
+            num_parts = choose_num_parts(duration, key_pool.free_slots(), file_size=file_size)
+            transcribed_texts, successful_api_keys, transcript = transcribe_in_parts(
+                audio_file_path, num_parts, api_keys, word_output_file, job, budget)
 
         # 文字起こし結果を結合（Noneを除外）
         combined_text = "\n".join(filter(None, transcribed_texts))
@@ -512,39 +2609,1229 @@ def process_audio_file(audio_file_path, processed_files):
         cleaned_combined_text = " ".join(combined_text.split())
         logging.info(f"{audio_file_name}の文字起こしが完了しました。情報を抽出します。")
 
-        # 文字起こし結果をWordファイルに保存
+        # 文字起こし結果をWordファイルに保存（処理中の目印を外した完成版）
         try:
-            output_directory = load_output_directory()
-            word_output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_文字起こし.docx")
-            doc = Document()
-            doc.add_paragraph(cleaned_combined_text)
-            doc.save(word_output_file)
+            transcript.finish()
             logging.info(f"文字起こし結果がWordファイルに保存されました: {word_output_file}")
+            publish_progress(job, 'output_written', kind='transcript', path=word_output_file)
+            index_job_outputs(meeting_name, transcript_file=word_output_file, transcript_text=combined_text)
         except Exception as e:
             logging.error(f"文字起こし結果のWordファイル保存中にエラーが発生しました: {str(e)}")
             return False
 
-        # 70秒のバッファを持たせる
-        time.sleep(70)
+        save_extraction_results(audio_file_name, meeting_name, cleaned_combined_text, output_directory,
+                                processed_files, successful_api_keys, job=job, budget=budget,
+                                transcript_text=combined_text)
+        return True
+    except JobCancelled:
+        logging.info(f"{audio_file_path}の処理はキャンセルされました。")
+        raise
+    except BudgetExhausted:
+        logging.error(f"{audio_file_path}の処理が制限時間を超えたため中止しました。")
+        return False
+    except Exception as e:
+        logging.exception(f"{audio_file_path}の処理中にエラーが発生しました: {str(e)}")
+        return False
+
+# モデルごとの1キーあたりの利用上限の初期値（無料枠。settings.jsonのrate_limitsで上書きできます）
+DEFAULT_RATE_LIMITS = {
+    'gemini-1.5-pro': {'rpm': 2, 'tpm': 32000, 'rpd': 50},
+    'gemini-1.5-flash': {'rpm': 15, 'tpm': 1000000, 'rpd': 1500},
+}
+
+# Geminiは音声1秒を32トークンとして数えます
+AUDIO_TOKENS_PER_SECOND = 32
+
+def load_plan_settings():
+    """見積もり（ドライラン）に使う設定を読み込む関数"""
+    settings = load_settings()
+    rate_limits = {model_name: dict(limits) for model_name, limits in DEFAULT_RATE_LIMITS.items()}
+    for model_name, limits in settings.get('rate_limits', {}).items():
+        rate_limits.setdefault(model_name, {}).update(limits)
+    return {
+        'rate_limits': rate_limits,
+        'output_tokens_per_second': float(settings.get('estimate_output_tokens_per_second', 6)),  # 文字起こし結果のトークン数
+        'extraction_output_tokens': int(settings.get('estimate_extraction_output_tokens', 2000)),
+        'request_overhead': float(settings.get('estimate_request_overhead_seconds', 10)),
+        'seconds_per_audio_second': float(settings.get('estimate_seconds_per_audio_second', 0.15)),
+        'extraction_seconds': float(settings.get('estimate_extraction_seconds', 30)),
+        'max_concurrent_jobs': load_max_concurrent_jobs(settings),
+        'max_requests_per_key': max(1, int(settings.get('max_requests_per_key', 1))),
+    }
+
+def estimate_chunk_seconds(length, num_keys, num_parts, plan_settings):
+    """num_parts個に分けたときの文字起こしにかかる時間（秒）を見積もる関数"""
+    # キーの数×キーごとの同時リクエスト数を超えるチャンクは、前のチャンクが終わるのを待ちます
+    waves = -(-num_parts // (num_keys * plan_settings['max_requests_per_key']))
+    return waves * (plan_settings['request_overhead'] + length * plan_settings['seconds_per_audio_second'])
+
+def best_chunk_plan(duration, num_keys, remaining_requests, prompt_tokens, plan_settings, split_settings, file_size=0):
+    """文字起こしが最も早く終わる分割数を探す関数"""
+    # 分割数の範囲（num_parts_bounds）のうち、1回のリクエストがモデルのTPMに収まり、
+    # 今日の残りリクエスト数を超えない中で、見積もり時間が最も短いものを選びます（同じならリクエストの少ない方）。
+    # 範囲の中に収まるものがなければ、TPMに収まる最小の分割数まで広げて探します。
+    min_parts, max_parts = num_parts_bounds(duration, split_settings, file_size)
+    best = None
+    for num_parts in itertools.chain(range(min_parts, max_parts + 1), range(max_parts + 1, max_parts + num_keys * 4 + 1)):
+        if best is not None and num_parts > max_parts:
+            break
+        ranges = plan_audio_chunks(duration, num_parts)
+        longest = max(length for _, length in ranges)
+        model_name = select_model('transcription', duration=longest)
+        limits = plan_settings['rate_limits'].get(model_name, {})
+        request_tokens = longest * (AUDIO_TOKENS_PER_SECOND + plan_settings['output_tokens_per_second']) + prompt_tokens
+        if request_tokens > limits.get('tpm', float('inf')) or num_parts > remaining_requests.get(model_name, float('inf')):
+            continue
+        seconds = estimate_chunk_seconds(longest, num_keys, num_parts, plan_settings)
+        if best is None or seconds < best['seconds']:
+            best = {'num_parts': num_parts, 'model': model_name, 'chunk_seconds': longest, 'seconds': seconds}
+    return best
+
+def plan_batch(audio_file_paths):
+    """音声ファイルをまとめて処理したときのリクエスト数・トークン数・時間を見積もる関数"""
+    # この関数はAPIを呼びません。音声の長さはフレーム索引かffprobeで調べます。
+    plan_settings = load_plan_settings()
+    api_keys = [key for key in load_api_keys() if key]
+    if not api_keys:
+        return None
+    usage = load_usage()
+    split_settings = load_split_settings()
+    groups = group_short_files(audio_file_paths, split_settings)  # まとめて送る短いファイルの組
+    free_slots = len(api_keys) * plan_settings['max_requests_per_key']  # キーがすべて空いているとみなします
+    prompt_tokens = len(load_prompt_from_settings())  # 日本語はおおよそ1文字1トークンです
+    extraction_prompt_tokens = len(create_extraction_prompt(""))
+
+    per_key = {}  # (キーの番号, モデル) -> {'requests', 'tokens', 'largest'}
+
+    def add_request(key_index, model_name, tokens):
+        counts = per_key.setdefault((key_index, model_name), {'requests': 0, 'tokens': 0, 'largest': 0})
+        counts['requests'] += 1
+        counts['tokens'] += tokens
+        counts['largest'] = max(counts['largest'], tokens)
+
+    # 今日すでに使った分を差し引いた、モデルごとの残りリクエスト数（全キーの合計）
+    remaining_requests = {}
+    for model_name, limits in plan_settings['rate_limits'].items():
+        used = sum(usage['keys'].get(key_fingerprint(key), {}).get(model_name, {}).get('requests', 0) for key in api_keys)
+        remaining_requests[model_name] = limits.get('rpd', float('inf')) * len(api_keys) - used
+
+    files = []
+    durations = {}  # 調べた音声の長さ（まとめて送る組の合計に使います）
+    for path in audio_file_paths:
+        try:
+            duration = durations[path] = get_audio_duration(path)
+            file_size = os.path.getsize(path)
+        except Exception as e:
+            # 1件調べられなくても、ほかのファイルの見積もりは続けます
+            files.append({'name': os.path.basename(path), 'error': f'音声の長さを取得できませんでした（{str(e)}）'})
+            continue
+        if not duration:
+            files.append({'name': os.path.basename(path), 'error': '音声の長さを取得できませんでした'})
+            continue
+        num_parts = choose_num_parts(duration, free_slots, split_settings, file_size)  # process_audio_fileと同じ分け方です
+        ranges = plan_audio_chunks(duration, num_parts)
+        transcript_tokens = 0
+        group = groups.get(path)
+        if group:
+            # まとめて送る組は、組の先頭のファイルで1回分のリクエストとして数えます
+            output_tokens = int(duration * plan_settings['output_tokens_per_second'])
+            transcript_tokens += output_tokens
+            if path == group[0]:
+                group_seconds = 0.0
+                for member in group:
+                    try:
+                        group_seconds += durations[member] if member in durations else get_audio_duration(member)
+                    except Exception:
+                        pass  # 調べられなかったファイルは、そのファイルの行でエラーとして表示します
+                add_request(len(files) % len(api_keys), select_model('transcription', duration=group_seconds),
+                            int(group_seconds * (AUDIO_TOKENS_PER_SECOND + plan_settings['output_tokens_per_second'])) + prompt_tokens)
+        for i, (_, length) in enumerate([] if group else ranges):
+            model_name = select_model('transcription', duration=length)
+            output_tokens = int(length * plan_settings['output_tokens_per_second'])
+            add_request(i % len(api_keys), model_name, int(length * AUDIO_TOKENS_PER_SECOND) + prompt_tokens + output_tokens)
+            transcript_tokens += output_tokens
+        extraction_tokens = transcript_tokens + extraction_prompt_tokens
+        add_request(0, select_model('extraction', tokens=extraction_tokens),
+                    extraction_tokens + plan_settings['extraction_output_tokens'])
+        longest = max(length for _, length in ranges)
+        files.append({
+            'name': os.path.basename(path),
+            'duration': duration,
+            'num_parts': num_parts,
+            'coalesced': len(group) if group else 0,
+            'audio_seconds': sum(length for _, length in ranges),  # 重なりの分も含めた送信する音声の長さ
+            'seconds': estimate_chunk_seconds(longest, len(api_keys), num_parts, plan_settings)
+                       + 70 + plan_settings['extraction_seconds'],  # 70秒は情報抽出前の待ち時間です
+            'best': None if group else best_chunk_plan(duration, len(api_keys), remaining_requests, prompt_tokens,
+                                                       plan_settings, split_settings, file_size),
+        })
+
+    # キーとモデルごとに、今日の残りと1分あたりの上限に収まるかを調べます
+    keys = []
+    problems = []
+    rate_limited_seconds = 0
+    for (key_index, model_name), counts in sorted(per_key.items()):
+        limits = plan_settings['rate_limits'].get(model_name, {})
+        used = usage['keys'].get(key_fingerprint(api_keys[key_index]), {}).get(model_name, {})
+        remaining = limits.get('rpd', float('inf')) - used.get('requests', 0)
+        label = f"キー{key_index + 1}/{model_name}"
+        if counts['requests'] > remaining:
+            problems.append(f"{label}: 今日の残り{max(0, remaining)}回に対して{counts['requests']}回のリクエストが必要です")
+        if counts['largest'] > limits.get('tpm', float('inf')):
+            problems.append(f"{label}: 1回のリクエスト（約{counts['largest']:,}トークン）が1分あたりの上限{limits['tpm']:,}を超えます")
+        if used.get('rate_limited'):
+            problems.append(f"{label}: 今日すでに{used['rate_limited']}回、利用制限（429）に達しています")
+        # 1分あたりの回数とトークン数の上限から、このキーで最低限かかる時間（秒）
+        rate_limited_seconds = max(rate_limited_seconds,
+                                   60 * counts['requests'] / limits.get('rpm', float('inf')),
+                                   60 * counts['tokens'] / limits.get('tpm', float('inf')))
+        keys.append({'label': label, 'requests': counts['requests'], 'tokens': counts['tokens'],
+                     'used': used.get('requests', 0), 'remaining': remaining})
+
+    # 同時に処理するジョブの数で割り、上限から見た最短時間より短くはならないとみなします
+    planned = [f for f in files if 'error' not in f]
+    concurrency = min(plan_settings['max_concurrent_jobs'], max(1, len(planned)))
+    total_seconds = max(sum(f['seconds'] for f in planned) / concurrency, rate_limited_seconds)
+    return {
+        'files': files,
+        'keys': keys,
+        'problems': problems,
+        'fits': not problems and all('error' not in f for f in files),
+        'total_seconds': total_seconds,
+        'finish_at': datetime.datetime.now() + datetime.timedelta(seconds=total_seconds),
+    }
+
+def print_batch_plan(audio_file_paths):
+    """ドライランの結果をコンソールに表示する関数"""
+    report = plan_batch(audio_file_paths)
+    if report is None:
+        print("APIキーが設定されていません。")
+        return False
+    print("ファイルごとの見積もり:")
+    for f in report['files']:
+        if 'error' in f:
+            print(f"- {f['name']}: {f['error']}")
+            continue
+        if f['coalesced']:
+            print(f"- {f['name']}: {format_elapsed(f['duration'])}、ほかの{f['coalesced'] - 1}件とまとめて1回で送信")
+            continue
+        print(f"- {f['name']}: {format_elapsed(f['duration'])}、{f['num_parts']}分割（送信する音声 {format_elapsed(f['audio_seconds'])}）"
+              f"、約{format_elapsed(f['seconds'])}")
+        best = f['best']
+        if best is None:
+            print("    どの分割数でも今日の上限に収まりません")
+        elif best['num_parts'] != f['num_parts']:
+            print(f"    おすすめ: {best['num_parts']}分割（{best['model']}、1チャンク{format_elapsed(best['chunk_seconds'])}）"
+                  f"なら文字起こしが約{format_elapsed(best['seconds'])}")
+    print("APIキーごとのリクエスト:")
+    for key in report['keys']:
+        print(f"- {key['label']}: {key['requests']}回・約{key['tokens']:,}トークン（今日の使用 {key['used']}回、残り {key['remaining']}回）")
+    if report['problems']:
+        print("上限に収まらない可能性があります:")
+        for problem in report['problems']:
+            print(f"- {problem}")
+    print(f"{'今日の上限に収まります。' if report['fits'] else '今日の上限に収まりません。'}"
+          f"完了予定: {report['finish_at']:%H:%M}（約{format_elapsed(report['total_seconds'])}）")
+    return report['fits']
+
+# 監視モードで使うinotifyの定数（Linuxのみ）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+# 処理済みファイルの記録を複数のスレッドから同時に書き換えないためのロック
+processed_files_lock = threading.Lock()
+
+def load_processed_hashes():
+    """処理済みファイルのハッシュの記録を読み込む関数"""
+    if os.path.exists(PROCESSED_HASHES_LOG):
+        with open(PROCESSED_HASHES_LOG, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
 
-        # 成功したAPIキーを使って情報抽出を試みる
-        for api_key in successful_api_keys:
+def save_processed_hashes(processed_hashes):
+    """処理済みファイルのハッシュの記録を保存する関数"""
+    with open(PROCESSED_HASHES_LOG, 'w', encoding='utf-8') as f:
+        json.dump(processed_hashes, f, ensure_ascii=False, indent=2)
+
+def compute_file_hash(file_path):
+    """ファイルの中身のSHA-256ハッシュを計算する関数"""
+    # 名前が同じでも中身が違えば別のファイル、名前が違っても中身が同じなら同じファイルとして扱えます
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def load_watch_settings():
+    """settings.jsonから監視モードの設定を読み込む関数"""
+    settings = load_settings()
+    return {
+        'directory': settings.get('watch_directory', ''),
+        'poll_interval': float(settings.get('watch_poll_interval_seconds', 10)),  # フォルダを見直す間隔（秒）
+        'stable_seconds': float(settings.get('watch_stable_seconds', 30)),  # この秒数サイズが変わらなければ書き込み完了とみなします
+    }
+
+def open_inotify(directory):
+    """フォルダの変更を通知してもらうinotifyを準備する関数（使えない場合はNone）"""
+    # この関数は、Linuxでだけinotifyを使います。それ以外のOSでは一定間隔でフォルダを見直します。
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError) as e:
+        logging.info(f"inotifyが使えないため、ポーリングで監視します: {str(e)}")
+        return None
+
+def wait_for_folder_change(inotify_fd, timeout):
+    """フォルダに変更があるか、timeout秒たつまで待つ関数"""
+    if inotify_fd is None:
+        time.sleep(timeout)
+        return
+    readable, _, _ = select.select([inotify_fd], [], [], timeout)
+    if readable:
+        # たまった通知は読み捨てます（どのファイルかはフォルダを見直して調べます）
+        try:
+            while os.read(inotify_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+def scan_audio_files(directory):
+    """フォルダ内の音声ファイルの大きさと更新時刻を調べる関数"""
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in AUDIO_CHUNK_FORMATS:
+                stat = entry.stat()
+                found[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+def record_processed_file(job, processed_files):
+    """処理が終わったファイルを、処理済みファイルとハッシュの記録に書き込む関数"""
+    with processed_files_lock:
+        # ほかのスレッドの結果を消さないように、読み直してから書き込みます
+        latest = load_processed_files()
+        if job.name in processed_files:
+            latest[job.name] = processed_files[job.name]
+        save_processed_files(latest)
+        if job.file_hash:
+            processed_hashes = load_processed_hashes()
+            processed_hashes[job.file_hash] = {
+                'file': job.name,
+                'output': processed_files.get(job.name, ''),
+                'processed_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+            save_processed_hashes(processed_hashes)
+
+def watch_folder(directory=None, stop_event=None):
+    """フォルダを監視して、届いた音声ファイルを自動で処理する関数"""
+    # この関数は、録音機が共有フォルダに置いたファイルを見つけてジョブキューに入れます。
+    # 書き込み中のファイルは、サイズが変わらなくなるまで待ってから処理します。
+    # 同時に処理する数は、ジョブキューの上限（max_concurrent_jobs）で決まります。
+    watch_settings = load_watch_settings()
+    directory = directory or watch_settings['directory']
+    if not directory or not os.path.isdir(directory):
+        logging.error(f"監視フォルダが見つかりません: {directory}")
+        return False
+    stop_event = stop_event or threading.Event()
+    jobs = get_job_queue()
+
+    inotify_fd = open_inotify(directory)
+    logging.info(f"{directory}の監視を開始します（{'inotify' if inotify_fd is not None else 'ポーリング'}）。")
+
+    pending = {}  # パス -> (サイズ, 更新時刻, 変化がなくなった時刻)
+    checked = {}  # すでに確認したファイル: パス -> (サイズ, 更新時刻)
+
+    try:
+        while not stop_event.is_set():
+            now = time.time()
+            try:
+                found = scan_audio_files(directory)
+            except OSError as e:
+                logging.error(f"監視フォルダの読み込みに失敗しました: {str(e)}")
+                found = {}
+
+            for path, (size, mtime) in found.items():
+                if checked.get(path) == (size, mtime):
+                    continue  # 変わっていないファイルは見直しません
+                previous = pending.get(path)
+                if not previous or previous[:2] != (size, mtime):
+                    pending[path] = (size, mtime, now)  # まだ書き込み中かもしれません
+                    continue
+                if size == 0 or now - previous[2] < watch_settings['stable_seconds']:
+                    continue
+
+                # サイズが変わらなくなったので、中身のハッシュで重複を調べます
+                del pending[path]
+                checked[path] = (size, mtime)
+                try:
+                    file_hash = compute_file_hash(path)
+                except OSError as e:
+                    logging.error(f"{path}のハッシュ計算に失敗しました: {str(e)}")
+                    continue
+                with processed_files_lock:
+                    already_processed = file_hash in load_processed_hashes()
+                if already_processed or jobs.is_active_hash(file_hash):
+                    logging.info(f"{os.path.basename(path)}は処理済み（または処理中）のためスキップします。")
+                    continue
+                jobs.submit(path, file_hash=file_hash)
+
+            # 消えたファイルの記録は捨てます
+            for path in list(pending):
+                if path not in found:
+                    del pending[path]
+            for path in list(checked):
+                if path not in found:
+                    del checked[path]
+
+            # 書き込み中のファイルがあるときは、こまめに確認します
+            timeout = 1.0 if pending else watch_settings['poll_interval']
+            wait_for_folder_change(inotify_fd, timeout)
+    except KeyboardInterrupt:
+        logging.info("監視を終了します。処理中のファイルが終わるまで待ちます。")
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+        shutdown_job_queue(wait=True)
+    return True
+
+def load_server_settings():
+    """サーバーモードの設定を読み込む関数"""
+    settings = load_settings()
+    return {
+        'host': settings.get('server_host', '127.0.0.1'),
+        'port': int(settings.get('server_port', 8765)),
+        'token': settings.get('server_token', ''),
+        'max_upload_mb': float(settings.get('server_max_upload_mb', 1024)),
+        'retention_hours': float(settings.get('server_retention_hours', 72)),
+    }
+
+def get_server_spool_dir():
+    """サーバーモードで受け取った音声と出力を置くフォルダ"""
+    return get_settings_path().parent / "server_jobs"
+
+def cleanup_server_spool(retention_hours):
+    """保存期間を過ぎたサーバーモードのジョブフォルダを消す関数"""
+    # フォルダを消したジョブはジョブキューからも外します。待機中・処理中のジョブのフォルダは消しません
+    spool_dir = get_server_spool_dir()
+    if not spool_dir.exists():
+        return
+    cutoff = time.time() - retention_hours * 3600
+    jobs = get_job_queue()
+    with jobs.lock:
+        jobs_by_dir = {os.path.normpath(job.output_directory): job for job in jobs.jobs if job.output_directory}
+    expired = []
+    for job_dir in spool_dir.iterdir():
+        job = jobs_by_dir.get(os.path.normpath(str(job_dir)))
+        if job is not None and job.status in ('queued', 'running'):
+            continue
+        try:
+            if job_dir.is_dir() and job_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(job_dir)
+                if job is not None:
+                    expired.append(job)
+        except OSError as e:
+            logging.error(f"{job_dir}の削除に失敗しました: {str(e)}")
+    jobs.forget(expired)
+
+def remove_spooled_audio(job):
+    """サーバーモードのジョブが終わったら、受け取った音声ファイルを消す関数"""
+    # 出力ファイルはダウンロードできるよう保存期間まで残します
+    try:
+        os.remove(job.audio_file_path)
+    except OSError:
+        pass
+
+class JobRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ジョブサーバーのHTTPリクエストを処理する係"""
+    # POST /jobs                 音声ファイルを送ってジョブを登録（本文がファイルの中身、X-Filenameにファイル名）
+    # GET  /jobs                 ジョブ一覧
+    # GET  /jobs/<id>            ジョブの状態
+    # GET  /jobs/<id>/transcript 文字起こしのWordファイル
+    # GET  /jobs/<id>/xlsx       抽出結果のExcelファイル
+    # GET  /jobs/<id>/docx       議事録のWordファイル（抽出結果とテンプレートから作ります）
+    # POST /jobs/<id>/cancel     ジョブのキャンセル
+    # GET  /metrics              指標（Prometheusのテキスト形式）
+
+    server_version = "MinutesJobServer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.info(f"サーバー: {self.address_string()} {format % args}")
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message):
+        # 読み残した本文が次のリクエストに混ざらないよう、接続は閉じます
+        self.close_connection = True
+        self.send_json(status, {'error': message})
+
+    def send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, path, content_type):
+        file_name = urllib.parse.quote(os.path.basename(path))
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{file_name}")
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def is_authorized(self):
+        token = self.server.settings['token']
+        if not token:
+            return True
+        supplied = self.headers.get('Authorization', '')
+        return hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8'))
+
+    def route(self):
+        """パスを（ジョブ, 操作）に分ける。ジョブが見つからなければエラーを返してNone"""
+        parts = [part for part in urllib.parse.urlparse(self.path).path.split('/') if part]
+        if not parts or parts[0] != 'jobs' or len(parts) > 3:
+            self.send_error_json(404, "not found")
+            return None
+        if len(parts) == 1:
+            return None, None
+        job = get_job_queue().get(int(parts[1])) if parts[1].isdigit() else None
+        if job is None:
+            self.send_error_json(404, "job not found")
+            return None
+        return job, parts[2] if len(parts) == 3 else None
+
+    def do_GET(self):
+        if not self.is_authorized():
+            self.send_error_json(401, "unauthorized")
+            return
+        if urllib.parse.urlparse(self.path).path == '/metrics':
+            self.send_text(200, metrics.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        routed = self.route()
+        if routed is None:
+            return
+        job, action = routed
+        if job is None:
+            jobs = get_job_queue()
+            with jobs.lock:
+                snapshot_jobs = list(jobs.jobs)
+            self.send_json(200, {'jobs': [describe_job_for_api(job) for job in snapshot_jobs]})
+        elif action is None:
+            self.send_json(200, describe_job_for_api(job))
+        elif action in ('transcript', 'xlsx', 'docx'):
+            # 保存期間を過ぎて消した出力は410で知らせます（議事録は抽出結果から作るので、抽出結果を確かめます）
+            source = job.snapshot()['outputs'].get('xlsx' if action == 'docx' else action)
+            if source and not os.path.exists(source):
+                self.send_error_json(410, f"{action} has expired")
+                return
+            path = job_output_path(job, action)
+            if path is None:
+                self.send_error_json(409, f"{action} is not ready")
+                return
             try:
-                extracted_info = extract_information(cleaned_combined_text, api_key)
-                if extracted_info:
-                    output_file = os.path.join(output_directory, f"{os.path.splitext(audio_file_name)[0]}_抽出結果.xlsx")
-                    create_excel(extracted_info, output_file)
-                    processed_files[audio_file_name] = output_file
-                    break  # 成功したらループを抜ける
-            except google.api_core.exceptions.ResourceExhausted:
-                logging.error(f"{api_key}での情報抽出が失敗しました。次のAPIキーを試します。")
+                self.send_file(path, SERVER_OUTPUT_TYPES[action])
+            except FileNotFoundError:
+                self.send_error_json(410, f"{action} has expired")
         else:
-            logging.error(f"{audio_file_name}の情報抽出に失敗しました。")
+            self.send_error_json(404, "not found")
+
+    def do_POST(self):
+        if not self.is_authorized():
+            self.send_error_json(401, "unauthorized")
+            return
+        routed = self.route()
+        if routed is None:
+            return
+        job, action = routed
+        if job is None:
+            self.receive_audio()
+        elif action == 'cancel':
+            cancelled = get_job_queue().cancel(job.id)
+            self.send_json(200 if cancelled else 409, describe_job_for_api(job))
+        else:
+            self.send_error_json(404, "not found")
+
+    def receive_audio(self):
+        """送られてきた音声ファイルを保存してジョブキューに入れる"""
+        file_name = os.path.basename(urllib.parse.unquote(self.headers.get('X-Filename', '')))
+        if os.path.splitext(file_name)[1].lower() not in AUDIO_CHUNK_FORMATS:
+            self.send_error_json(400, "X-Filename must be a .mp3, .m4a or .wav file name")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error_json(411, "Content-Length is required")
+            return
+        if length <= 0 or length > self.server.settings['max_upload_mb'] * 1024 * 1024:
+            self.send_error_json(413, "file is empty or too large")
+            return
+
+        cleanup_server_spool(self.server.settings['retention_hours'])
+        spool_dir = get_server_spool_dir()
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        job_dir = tempfile.mkdtemp(dir=spool_dir)
+        audio_path = os.path.join(job_dir, file_name)
+        file_hash = hashlib.sha256()
+        remaining = length
+        try:
+            with open(audio_path, 'wb') as f:
+                while remaining:
+                    data = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not data:
+                        raise ConnectionError("upload was interrupted")
+                    f.write(data)
+                    file_hash.update(data)
+                    remaining -= len(data)
+        except (OSError, ConnectionError) as e:
+            logging.error(f"{file_name}の受信に失敗しました: {str(e)}")
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self.close_connection = True
+            return
+
+        job = get_job_queue().submit(audio_path, file_hash=file_hash.hexdigest(),
+                                     output_directory=job_dir, on_finished=remove_spooled_audio)
+        self.send_json(201, describe_job_for_api(job))
+
+# ダウンロードできる出力の種類とContent-Type
+SERVER_OUTPUT_TYPES = {
+    'transcript': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+def describe_job_for_api(job):
+    """ジョブの状態をAPIで返す形にまとめる関数（サーバー内のパスは返しません）"""
+    snapshot = job.snapshot()
+    outputs = snapshot.pop('outputs')
+    snapshot['outputs'] = sorted(outputs) + (['docx'] if 'xlsx' in outputs else [])
+    return snapshot
+
+def job_output_path(job, kind):
+    """ジョブの出力ファイルのパスを返す関数（まだなければNone）"""
+    # 文字起こしと抽出結果は完成版ができた時点で登録されます。議事録は初めて求められたときに作ります
+    outputs = job.snapshot()['outputs']
+    if kind != 'docx':
+        return outputs.get(kind)
+    if 'xlsx' not in outputs:
+        return None
+    xlsx_path = outputs['xlsx']
+    docx_path = xlsx_path.replace('_抽出結果.xlsx', '_議事録.docx')
+    with job.lock:
+        if not os.path.exists(docx_path):
+            template_path = os.path.join(get_current_dir(), 'テンプレート.docx')
+            if not create_minutes(xlsx_path, template_path, docx_path):
+                return None
+    return docx_path
+
+def serve_jobs(address=None):
+    """チームで共有するジョブサーバーを起動する関数"""
+    # この関数は、全員の音声ファイルを1つのジョブキューとAPIキーの貸し出し係で処理します。
+    # 同時に処理する数はmax_concurrent_jobs、キーごとの同時リクエスト数はmax_requests_per_keyで決まります。
+    settings = load_server_settings()
+    if address:
+        host, _, port = address.rpartition(':')
+        settings['host'] = host or settings['host']
+        settings['port'] = int(port)
+    if not settings['token'] and settings['host'] not in ('127.0.0.1', 'localhost', '::1'):
+        logging.warning("server_tokenが設定されていません。同じネットワークの誰でもジョブを登録できます。")
+
+    server = http.server.ThreadingHTTPServer((settings['host'], settings['port']), JobRequestHandler)
+    server.daemon_threads = True
+    server.settings = settings
+    logging.info(f"ジョブサーバーを http://{settings['host']}:{settings['port']} で起動しました。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("ジョブサーバーを終了します。処理中のファイルが終わるまで待ちます。")
+    finally:
+        server.server_close()
+        shutdown_job_queue(wait=True)
+
+class RemoteJob:
+    """ジョブサーバーに送ったジョブ（GUIの表示ではJobと同じように扱います）"""
+
+    def __init__(self, audio_file_path):
+        self.id = next(Job._ids)  # 画面で使う番号（サーバーのジョブ番号とは別です）
+        self.remote_id = None
+        self.audio_file_path = audio_file_path
+        self.name = os.path.basename(audio_file_path)
+        self.file_hash = None
+        self.lock = threading.Lock()
+        self.cancel_requested = False
+        self.downloaded = False
+        self.state = {
+            'id': self.id, 'name': self.name, 'status': 'queued', 'stage': 'アップロード待ち',
+            'chunk_states': [], 'total_chunks': 0, 'completed_chunks': 0, 'progress': 0.0,
+            'elapsed': 0, 'bytes_uploaded': 0, 'retries': 0, 'outputs': {},
+        }
 
+    @property
+    def status(self):
+        with self.lock:
+            return self.state['status']
+
+    def update(self, **values):
+        with self.lock:
+            self.state.update(values)
+            self.state['id'] = self.id  # 画面の番号はそのままにします
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.state, chunk_states=list(self.state['chunk_states']))
+
+class RemoteJobQueue:
+    """ジョブサーバーにジョブを送り、状態を問い合わせる係（GUIをサーバーの窓口として使います）"""
+    # JobQueueと同じ呼び方ができるので、GUIはどちらを使っているか気にせずに済みます。
+
+    def __init__(self, server_url, token=''):
+        self.server_url = server_url.rstrip('/')
+        self.token = token
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.uploads = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.stop_event = threading.Event()
+        threading.Thread(target=self._poll, daemon=True).start()
+
+    def request(self, method, path, data=None, headers=None, timeout=30):
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.server_url + path, data=data, headers=headers, method=method)
+        return urllib.request.urlopen(request, timeout=timeout)
+
+    def submit(self, audio_file_path, file_hash=None):
+        job = RemoteJob(audio_file_path)
+        with self.lock:
+            self.jobs.append(job)
+        publish_progress_remote(job)
+        self.uploads.submit(self._upload, job)
+        return job
+
+    def submit_batch(self, audio_file_paths):
+        # まとめ送りはジョブサーバー側では行いません
+        return [self.submit(path) for path in audio_file_paths]
+
+    def _upload(self, job):
+        if job.cancel_requested:
+            job.update(status='cancelled', stage='')
+            publish_progress_remote(job)
+            return
+        job.update(stage='アップロード中')
+        publish_progress_remote(job)
+        try:
+            with open(job.audio_file_path, 'rb') as f:
+                headers = {
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Length': str(os.fstat(f.fileno()).st_size),
+                    'X-Filename': urllib.parse.quote(job.name),
+                }
+                with self.request('POST', '/jobs', data=f, headers=headers, timeout=600) as response:
+                    state = json.load(response)
+        except (OSError, ValueError) as e:
+            logging.error(f"{job.name}をジョブサーバーに送れませんでした: {str(e)}")
+            job.update(status='failed', stage='')
+            publish_progress_remote(job)
+            return
+        job.remote_id = state['id']
+        job.update(**state)
+        publish_progress_remote(job)
+        logging.info(f"{job.name}をジョブサーバーのジョブ#{job.remote_id}として登録しました。")
+        if job.cancel_requested:
+            self._send_cancel(job)
+
+    def _poll(self):
+        # 終わっていないジョブの状態を1秒ごとに問い合わせます
+        while not self.stop_event.wait(1.0):
+            with self.lock:
+                active = [job for job in self.jobs if job.remote_id is not None
+                          and (job.status in ('queued', 'running') or not job.downloaded)]
+            for job in active:
+                try:
+                    with self.request('GET', f"/jobs/{job.remote_id}") as response:
+                        state = json.load(response)
+                except (OSError, ValueError) as e:
+                    logging.error(f"ジョブサーバーへの問い合わせに失敗しました: {str(e)}")
+                    break
+                job.update(**state)
+                if state['status'] in ('done', 'failed', 'cancelled'):
+                    self._download_outputs(job, state['outputs'])
+                publish_progress_remote(job)
+
+    def _download_outputs(self, job, outputs):
+        """終わったジョブの文字起こしと抽出結果を出力先フォルダに保存する"""
+        job.downloaded = True
+        output_directory = load_output_directory()
+        for kind in ('transcript', 'xlsx'):
+            if kind not in outputs:
+                continue
+            try:
+                with self.request('GET', f"/jobs/{job.remote_id}/{kind}", timeout=120) as response:
+                    disposition = response.headers.get('Content-Disposition', '')
+                    file_name = os.path.basename(urllib.parse.unquote(disposition.partition("''")[2]))
+                    output_path = os.path.join(output_directory, file_name)
+                    with open(output_path + '.tmp', 'wb') as f:
+                        shutil.copyfileobj(response, f)
+                os.replace(output_path + '.tmp', output_path)
+                logging.info(f"ジョブサーバーから{output_path}を受け取りました。")
+            except (OSError, ValueError) as e:
+                logging.error(f"ジョブ#{job.remote_id}の{kind}を受け取れませんでした: {str(e)}")
+
+    def get(self, job_id):
+        with self.lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def is_active_hash(self, file_hash):
+        return False
+
+    def counts(self):
+        with self.lock:
+            counts = {status: 0 for status in JOB_STATUS_LABELS}
+            for job in self.jobs:
+                counts[job.status] += 1
+            return counts
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status not in ('queued', 'running'):
+            return False
+        job.cancel_requested = True
+        if job.remote_id is None:
+            return True  # アップロードが終わったところでキャンセルします
+        # GUIを待たせないよう、サーバーへの連絡は別スレッドで行います
+        threading.Thread(target=self._send_cancel, args=(job,), daemon=True).start()
         return True
-    except Exception as e:
-        logging.exception(f"{audio_file_path}の処理中にエラーが発生しました: {str(e)}")
+
+    def _send_cancel(self, job):
+        try:
+            with self.request('POST', f"/jobs/{job.remote_id}/cancel", data=b'') as response:
+                job.update(**json.load(response))
+        except urllib.error.HTTPError as e:
+            if e.code != 409:  # 409はもう終わっていたジョブです
+                logging.error(f"ジョブ#{job.remote_id}のキャンセルに失敗しました: {str(e)}")
+        except (OSError, ValueError) as e:
+            logging.error(f"ジョブ#{job.remote_id}のキャンセルに失敗しました: {str(e)}")
+        publish_progress_remote(job)
+
+    def shutdown(self, wait=True):
+        self.stop_event.set()
+        self.uploads.shutdown(wait=wait)
+
+def publish_progress_remote(job):
+    """サーバーのジョブの状態が変わったことをGUIに知らせる関数"""
+    if ui_events_enabled:
+        progress_events.put((job.id, 'remote_update'))
+
+# 共有キューの状態の表示名
+SHARED_JOB_STATUS_LABELS = {
+    'pending': '待機中',
+    'planning': '分割計画中',
+    'transcribing': '文字起こし中',
+    'finalizing': '情報抽出中',
+    'done': '完了',
+    'failed': '失敗',
+}
+
+class SharedJobQueue:
+    """共有フォルダ上のSQLiteファイルを使って、複数のマシンでジョブとチャンクを分け合う係"""
+    # ジョブは「分割計画 → チャンクごとの文字起こし → まとめて情報抽出」の3段階で進みます。
+    # 各段階はワーカーが期限付きで借り（リース）、生きている間はハートビートで期限を延ばします。
+    # 期限が切れたもの（ワーカーが止まったもの）は、ほかのワーカーが引き継ぎます。
+    # 期限の判定に各マシンの時計を使うので、マシンの時刻は合わせておいてください。
+
+    def __init__(self, path, lease_seconds=120, max_attempts=3):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts  # チャンクや段階をやり直せる回数
+        # executescriptは途中でコミットしてしまうので、1文ずつ実行します
+        with self.transaction() as conn:
+            for statement in """
+                CREATE TABLE IF NOT EXISTS shared_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    audio_path TEXT NOT NULL,
+                    output_directory TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    num_chunks INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS shared_chunks (
+                    job_id INTEGER NOT NULL,
+                    idx INTEGER NOT NULL,
+                    start_time REAL NOT NULL,
+                    duration REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    text TEXT,
+                    PRIMARY KEY (job_id, idx)
+                );
+                CREATE INDEX IF NOT EXISTS shared_chunks_status ON shared_chunks (status, job_id, idx);
+                CREATE TABLE IF NOT EXISTS shared_workers (
+                    id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL,
+                    chunks_done INTEGER NOT NULL DEFAULT 0
+                )
+            """.split(';'):
+                conn.execute(statement)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """書き込みロックを取ってからまとめて読み書きする"""
+        # ネットワーク越しのファイルシステムではWALが使えないので、標準のジャーナルのまま使います
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def enqueue(self, audio_path, output_directory):
+        """音声ファイルをジョブとして登録する（パスはすべてのワーカーから見える場所にしてください）"""
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO shared_jobs (audio_path, output_directory, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (os.path.abspath(audio_path), os.path.abspath(output_directory), now, now))
+            return cursor.lastrowid
+
+    def reclaim_expired(self, conn, now):
+        """リースの期限が切れたチャンクと段階を、ほかのワーカーが取れる状態に戻す"""
+        reclaimed = conn.execute("""
+            UPDATE shared_chunks
+            SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                attempts = attempts + 1, owner = NULL, lease_until = NULL
+            WHERE status = 'leased' AND lease_until < ?""", (self.max_attempts, now)).rowcount
+        for leased_status, previous_status in (('planning', 'pending'), ('finalizing', 'transcribing')):
+            reclaimed += conn.execute("""
+                UPDATE shared_jobs
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE ? END,
+                    error = CASE WHEN attempts + 1 >= ? THEN 'ワーカーが応答しなくなりました' ELSE error END,
+                    attempts = attempts + 1, owner = NULL, lease_until = NULL, updated_at = ?
+                WHERE status = ? AND lease_until < ?""",
+                (self.max_attempts, previous_status, self.max_attempts, now, leased_status, now)).rowcount
+        if reclaimed:
+            logging.warning(f"期限切れのリースを{reclaimed}件回収しました。")
+
+    def claim(self, worker_id):
+        """次の仕事を1つ借りる。戻り値は（種類, 行）で、仕事がなければNone"""
+        # 分割計画は軽いので先に済ませ、チャンクがほかのワーカーにも早く行き渡るようにします。
+        # 情報抽出は、すべてのチャンクが完了または失敗したジョブだけが対象です。
+        now = time.time()
+        lease_until = now + self.lease_seconds
+        with self.transaction() as conn:
+            self.reclaim_expired(conn, now)
+            job = conn.execute("SELECT * FROM shared_jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if job:
+                conn.execute("UPDATE shared_jobs SET status = 'planning', owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                             (worker_id, lease_until, now, job['id']))
+                return 'plan', job
+            chunk = conn.execute("""
+                SELECT c.*, j.audio_path FROM shared_chunks c JOIN shared_jobs j ON j.id = c.job_id
+                WHERE c.status = 'pending' AND j.status = 'transcribing'
+                ORDER BY c.job_id, c.idx LIMIT 1""").fetchone()
+            if chunk:
+                conn.execute("UPDATE shared_chunks SET status = 'leased', owner = ?, lease_until = ? WHERE job_id = ? AND idx = ?",
+                             (worker_id, lease_until, chunk['job_id'], chunk['idx']))
+                return 'chunk', chunk
+            job = conn.execute("""
+                SELECT * FROM shared_jobs j WHERE status = 'transcribing' AND NOT EXISTS (
+                    SELECT 1 FROM shared_chunks c WHERE c.job_id = j.id AND c.status IN ('pending', 'leased'))
+                ORDER BY id LIMIT 1""").fetchone()
+            if job:
+                conn.execute("UPDATE shared_jobs SET status = 'finalizing', owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                             (worker_id, lease_until, now, job['id']))
+                return 'finalize', job
+        return None
+
+    def heartbeat(self, worker_id):
+        """このワーカーが借りているものすべての期限を延ばす"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE shared_chunks SET lease_until = ? WHERE owner = ? AND status = 'leased'",
+                         (now + self.lease_seconds, worker_id))
+            conn.execute("UPDATE shared_jobs SET lease_until = ? WHERE owner = ? AND status IN ('planning', 'finalizing')",
+                         (now + self.lease_seconds, worker_id))
+            conn.execute("""
+                INSERT INTO shared_workers (id, heartbeat_at) VALUES (?, ?)
+                ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at""", (worker_id, now))
+
+    def set_plan(self, job_id, worker_id, ranges):
+        """分割計画を登録して、チャンクをほかのワーカーも取れるようにする"""
+        with self.transaction() as conn:
+            updated = conn.execute("""
+                UPDATE shared_jobs SET status = 'transcribing', num_chunks = ?, owner = NULL, lease_until = NULL,
+                    attempts = 0, updated_at = ?
+                WHERE id = ? AND owner = ? AND status = 'planning'""",
+                (len(ranges), time.time(), job_id, worker_id)).rowcount
+            if not updated:
+                return False  # リースを失っていたので、引き継いだワーカーに任せます
+            conn.execute("DELETE FROM shared_chunks WHERE job_id = ?", (job_id,))
+            conn.executemany("INSERT INTO shared_chunks (job_id, idx, start_time, duration) VALUES (?, ?, ?, ?)",
+                             [(job_id, i, start_time, length) for i, (start_time, length) in enumerate(ranges)])
+            return True
+
+    def complete_chunk(self, job_id, idx, worker_id, text):
+        """チャンクの文字起こし結果を保存する（リースを失っていたら捨てます）"""
+        with self.transaction() as conn:
+            updated = conn.execute("""
+                UPDATE shared_chunks SET status = 'done', text = ?, owner = ?, lease_until = NULL
+                WHERE job_id = ? AND idx = ? AND owner = ? AND status = 'leased'""",
+                (text, worker_id, job_id, idx, worker_id)).rowcount
+            conn.execute("UPDATE shared_workers SET chunks_done = chunks_done + ? WHERE id = ?", (updated, worker_id))
+            return bool(updated)
+
+    def fail_chunk(self, job_id, idx, worker_id):
+        """チャンクの文字起こしに失敗したので、やり直せる回数が残っていれば戻す"""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE shared_chunks
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    attempts = attempts + 1, owner = NULL, lease_until = NULL
+                WHERE job_id = ? AND idx = ? AND owner = ? AND status = 'leased'""",
+                (self.max_attempts, job_id, idx, worker_id))
+
+    def release(self, kind, row, worker_id):
+        """ワーカーを止めるときに、借りていたものをやり直し回数を減らさずに返す"""
+        with self.transaction() as conn:
+            if kind == 'chunk':
+                conn.execute("""
+                    UPDATE shared_chunks SET status = 'pending', owner = NULL, lease_until = NULL
+                    WHERE job_id = ? AND idx = ? AND owner = ? AND status = 'leased'""",
+                    (row['job_id'], row['idx'], worker_id))
+            else:
+                conn.execute("""
+                    UPDATE shared_jobs SET status = ?, owner = NULL, lease_until = NULL
+                    WHERE id = ? AND owner = ? AND status = ?""",
+                    ('pending' if kind == 'plan' else 'transcribing', row['id'], worker_id,
+                     'planning' if kind == 'plan' else 'finalizing'))
+
+    def chunk_texts(self, job_id):
+        """チャンクの文字起こし結果を順番に並べて返す（失敗したチャンクはNone）"""
+        with self.transaction() as conn:
+            rows = conn.execute("SELECT text FROM shared_chunks WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+        return [row['text'] for row in rows]
+
+    def finish_job(self, job_id, worker_id, status, error=None):
+        """ジョブを完了または失敗にする"""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE shared_jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ?
+                WHERE id = ? AND owner = ?""", (status, error, time.time(), job_id, worker_id))
+
+    def status(self):
+        """ジョブごとの進み具合と、生きているワーカーの一覧を返す"""
+        now = time.time()
+        with self.transaction() as conn:
+            jobs = conn.execute("""
+                SELECT j.id, j.audio_path, j.status, j.num_chunks, j.created_at, j.updated_at, j.error,
+                    COALESCE(SUM(c.status = 'done'), 0) AS chunks_done,
+                    COALESCE(SUM(c.status = 'failed'), 0) AS chunks_failed,
+                    COALESCE(SUM(c.status = 'leased'), 0) AS chunks_leased,
+                    COALESCE(SUM(c.attempts), 0) AS retries,
+                    GROUP_CONCAT(DISTINCT CASE WHEN c.status = 'leased' THEN c.owner END) AS workers
+                FROM shared_jobs j LEFT JOIN shared_chunks c ON c.job_id = j.id
+                GROUP BY j.id ORDER BY j.id""").fetchall()
+            workers = conn.execute("SELECT * FROM shared_workers WHERE heartbeat_at >= ? ORDER BY id",
+                                   (now - self.lease_seconds,)).fetchall()
+        return [dict(job) for job in jobs], [dict(worker) for worker in workers]
+
+def load_shared_queue_settings():
+    """共有キューの設定を読み込む関数"""
+    settings = load_settings()
+    return {
+        'path': settings.get('shared_queue_path', ''),
+        'lease_seconds': float(settings.get('shared_lease_seconds', 120)),
+        'max_attempts': int(settings.get('shared_max_attempts', 3)),
+        'chunk_seconds': float(settings.get('shared_chunk_seconds', 600)),
+        'worker_threads': int(settings.get('shared_worker_threads', 0)),  # 0ならAPIキーの数
+        'poll_interval': float(settings.get('shared_poll_seconds', 5)),
+    }
+
+def open_shared_queue(shared_settings=None):
+    """設定された共有キューを開く関数（設定がなければNone）"""
+    shared_settings = shared_settings or load_shared_queue_settings()
+    if not shared_settings['path']:
+        logging.error("settings.jsonにshared_queue_pathが設定されていません。")
+        return None
+    return SharedJobQueue(shared_settings['path'], shared_settings['lease_seconds'], shared_settings['max_attempts'])
+
+def run_shared_task(shared_queue, worker_id, kind, row, api_keys, chunk_seconds, stop_event):
+    """共有キューから借りた仕事を1つ実行する関数"""
+    budget = RetryBudget(cancel_event=stop_event)
+    if kind == 'plan':
+        # 分割はしません。時間範囲だけ決めて、切り出しは各ワーカーがチャンクごとに行います
+        duration = get_audio_duration(row['audio_path'])
+        if not duration:
+            shared_queue.finish_job(row['id'], worker_id, 'failed', error='音声の長さを取得できませんでした')
+            return
+        num_parts = max(1, int(-(-duration // chunk_seconds)),
+                        inline_parts_needed(os.path.getsize(row['audio_path']), load_split_settings()))
+        if shared_queue.set_plan(row['id'], worker_id, plan_audio_chunks(duration, num_parts)):
+            logging.info(f"共有ジョブ#{row['id']}を{num_parts}個のチャンクに分けました。")
+    elif kind == 'chunk':
+        # リトライは共有キュー（shared_max_attempts回まで別のワーカーが借り直します）に任せ、ここでは1回だけ試します。
+        # 1つのチャンクに使うリクエストは、最大でshared_max_attempts ×（1回＋品質チェックのやり直し1回）です
+        job_settings = dict(load_transcription_settings(), max_attempts=1)
+        audio_name = os.path.basename(row['audio_path'])
+        audio_chunk = extract_audio_chunk(row['audio_path'], row['start_time'], row['duration'],
+                                          f"{audio_name}_part{row['idx'] + 1}", job_settings['vad'])
+        if audio_chunk is None:
+            shared_queue.fail_chunk(row['job_id'], row['idx'], worker_id)
+            return
+        result, _ = get_transcription_engine().run(transcribe_chunk_async(audio_chunk, None, job_settings, budget))
+        if result:
+            if not shared_queue.complete_chunk(row['job_id'], row['idx'], worker_id, result):
+                logging.warning(f"{audio_chunk['name']}のリースが切れていたため、結果を破棄しました。")
+        else:
+            shared_queue.fail_chunk(row['job_id'], row['idx'], worker_id)
+    else:
+        texts = shared_queue.chunk_texts(row['id'])
+        audio_file_name = os.path.basename(row['audio_path'])
+        if not any(texts):
+            shared_queue.finish_job(row['id'], worker_id, 'failed', error='すべてのチャンクの文字起こしに失敗しました')
+            return
+        meeting_name = os.path.splitext(audio_file_name)[0]
+        combined_text = "\n".join(filter(None, texts))
+        word_output_file = os.path.join(row['output_directory'], f"{meeting_name}_文字起こし.docx")
+        write_transcript_docx(word_output_file, filter(None, texts))
+        logging.info(f"文字起こし結果がWordファイルに保存されました: {word_output_file}")
+        index_job_outputs(meeting_name, transcript_file=word_output_file, transcript_text=combined_text)
+
+        processed_files = {}
+        xlsx_path = save_extraction_results(audio_file_name, meeting_name, " ".join(combined_text.split()),
+                                            row['output_directory'], processed_files, api_keys, budget=budget,
+                                            transcript_text=combined_text)
+        if not xlsx_path:
+            shared_queue.finish_job(row['id'], worker_id, 'failed', error='情報抽出に失敗しました')
+            logging.error(f"共有ジョブ#{row['id']}（{audio_file_name}）の情報抽出に失敗しました。")
+            return
+        with processed_files_lock:
+            latest = load_processed_files()
+            latest.update(processed_files)
+            save_processed_files(latest)
+        shared_queue.finish_job(row['id'], worker_id, 'done')
+        logging.info(f"共有ジョブ#{row['id']}（{audio_file_name}）が完了しました。")
+
+def run_shared_worker(stop_event=None):
+    """共有キューからジョブとチャンクを取り出して処理するワーカーを動かす関数"""
+    # この関数は、同じ共有キューを見ている複数のマシンで同時に動かせます。
+    # 音声ファイルと出力先フォルダは、すべてのマシンから同じパスで見える場所に置いてください。
+    shared_settings = load_shared_queue_settings()
+    shared_queue = open_shared_queue(shared_settings)
+    if shared_queue is None:
+        return False
+    api_keys = [key for key in load_api_keys() if key]
+    if not api_keys:
+        logging.error("APIキーがロードされていません。ワーカーを開始できません。")
         return False
+    configure_key_pool(api_keys)
+
+    stop_event = stop_event or threading.Event()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    num_threads = shared_settings['worker_threads'] or len(api_keys)
+
+    def heartbeat_loop():
+        while True:
+            try:
+                shared_queue.heartbeat(worker_id)
+            except sqlite3.Error as e:
+                logging.error(f"共有キューのハートビートに失敗しました: {str(e)}")
+            if stop_event.wait(shared_queue.lease_seconds / 4):
+                break
+
+    def work_loop():
+        while not stop_event.is_set():
+            try:
+                task = shared_queue.claim(worker_id)
+            except sqlite3.Error as e:
+                logging.error(f"共有キューから仕事を取り出せませんでした: {str(e)}")
+                task = None
+            if task is None:
+                stop_event.wait(shared_settings['poll_interval'])
+                continue
+            kind, row = task
+            try:
+                run_shared_task(shared_queue, worker_id, kind, row, api_keys, shared_settings['chunk_seconds'], stop_event)
+            except JobCancelled:
+                shared_queue.release(kind, row, worker_id)
+            except Exception as e:
+                # 借りたままにせず、チャンクはやり直し回数を減らして返し、ほかの段階はジョブを失敗にします
+                logging.exception(f"共有キューの仕事（{kind}）の処理中にエラーが発生しました: {str(e)}")
+                try:
+                    if kind == 'chunk':
+                        shared_queue.fail_chunk(row['job_id'], row['idx'], worker_id)
+                    else:
+                        shared_queue.finish_job(row['id'], worker_id, 'failed', error=str(e))
+                except sqlite3.Error as e:
+                    # 返せなかった分は、リースの期限が切れたときに回収されます
+                    logging.error(f"共有キューの更新に失敗しました: {str(e)}")
+
+    threads = [threading.Thread(target=heartbeat_loop, daemon=True)]
+    threads += [threading.Thread(target=work_loop, daemon=True) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    logging.info(f"ワーカー{worker_id}を{num_threads}スレッドで開始しました（共有キュー: {shared_queue.path}）。")
+    try:
+        while not stop_event.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        logging.info("ワーカーを終了します。処理中のチャンクは共有キューに戻します。")
+        stop_event.set()
+    for thread in threads:
+        thread.join()
+    return True
+
+def print_shared_queue_status():
+    """共有キューのジョブごとの進み具合をコンソールに表示する関数"""
+    shared_queue = open_shared_queue()
+    if shared_queue is None:
+        return
+    jobs, workers = shared_queue.status()
+    print(f"ワーカー: {len(workers)}台")
+    for worker in workers:
+        print(f"- {worker['id']}（完了チャンク{worker['chunks_done']}件）")
+    for job in jobs:
+        progress = f"{job['chunks_done']}/{job['num_chunks']}" if job['num_chunks'] else "-"
+        line = f"#{job['id']} {os.path.basename(job['audio_path'])}: {SHARED_JOB_STATUS_LABELS[job['status']]} チャンク {progress}"
+        if job['chunks_failed']:
+            line += f" 失敗{job['chunks_failed']}件"
+        if job['chunks_leased']:
+            line += f" 処理中{job['chunks_leased']}件（{job['workers']}）"
+        if job['error']:
+            line += f" エラー: {job['error']}"
+        print(line)
 
 def extract_info_from_xlsx(file_path):
     wb = openpyxl.load_workbook(file_path)
@@ -631,22 +3918,199 @@ def create_minutes(xlsx_path, template_path, output_path):
         return False
     
 
+def get_search_index_path():
+    """過去の会議の全文検索インデックス（SQLite）のパスを返す関数"""
+    return get_settings_path().parent / "search_index.sqlite3"
+
+def open_search_index():
+    """全文検索インデックスを開く関数（なければ作ります）"""
+    # 日本語は単語の区切りがないので、3文字ずつに区切るtrigramトークナイザーを使います
+    index_path = get_search_index_path()
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS meeting_fts USING fts5("
+        "meeting UNINDEXED, kind UNINDEXED, source_path UNINDEXED, title, body, tokenize='trigram')"
+    )
+    # trigramでは探せない2文字の語のために、2文字ずつ区切った索引も持ちます（本文は保存しません）
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS meeting_bigram USING fts5(grams, content='', tokenize='unicode61')")
+    # 一括登録で、変わっていないファイルを読み直さないための記録
+    conn.execute("CREATE TABLE IF NOT EXISTS indexed_files (path TEXT PRIMARY KEY, mtime_ns INTEGER)")
+    return conn
+
+def group_topic_summaries(topic_rows):
+    """（議題, 内容）の行を、（議題の内容, 要約）の組にまとめる関数"""
+    # parse_extracted_topicsやExcelの行は「議題①」「議題①の要約」が別の行になっています
+    grouped = []
+    for label, content in topic_rows:
+        if label.endswith("の要約") and grouped and not grouped[-1][1]:
+            grouped[-1] = (grouped[-1][0], content or '')
+        else:
+            grouped.append((content or '', ''))
+    return [(topic, summary) for topic, summary in grouped if topic or summary]
+
+def to_bigrams(text):
+    """文章を2文字ずつ重ねて区切り、空白でつないだ文字列にする関数"""
+    text = " ".join(text.split())
+    return " ".join(text[i:i + 2] for i in range(len(text) - 1))
+
+def index_meeting(meeting, kind, source_path, entries):
+    """会議の文字起こしや議題を全文検索インデックスに登録する関数"""
+    # kindは 'transcript'（文字起こし）か 'topic'（議題と要約）です。
+    # entriesは（見出し, 本文）のリストで、同じ会議・種類の古い登録は置き換えます。
+    conn = open_search_index()
+    try:
+        with conn:
+            old_rows = conn.execute("SELECT rowid, title, body FROM meeting_fts WHERE meeting = ? AND kind = ?",
+                                    (meeting, kind)).fetchall()
+            for rowid, title, body in old_rows:
+                # 本文を持たない索引は、登録したときと同じ内容を渡して消します
+                conn.execute("INSERT INTO meeting_bigram (meeting_bigram, rowid, grams) VALUES ('delete', ?, ?)",
+                             (rowid, to_bigrams(f"{title}\n{body}")))
+            conn.execute("DELETE FROM meeting_fts WHERE meeting = ? AND kind = ?", (meeting, kind))
+            for title, body in entries:
+                cursor = conn.execute(
+                    "INSERT INTO meeting_fts (meeting, kind, source_path, title, body) VALUES (?, ?, ?, ?, ?)",
+                    (meeting, kind, str(source_path), title, body)
+                )
+                conn.execute("INSERT INTO meeting_bigram (rowid, grams) VALUES (?, ?)",
+                             (cursor.lastrowid, to_bigrams(f"{title}\n{body}")))
+            try:
+                conn.execute("INSERT OR REPLACE INTO indexed_files (path, mtime_ns) VALUES (?, ?)",
+                             (str(source_path), os.stat(source_path).st_mtime_ns))
+            except OSError:
+                pass
+    finally:
+        conn.close()
+
+def index_job_outputs(meeting, transcript_file=None, transcript_text=None, xlsx_file=None, extracted_info=None):
+    """ジョブの出力を全文検索インデックスに登録する関数（失敗しても処理は止めません）"""
+    try:
+        if transcript_file and transcript_text:
+            index_meeting(meeting, 'transcript', transcript_file, [(meeting, transcript_text)])
+        if xlsx_file and extracted_info:
+            index_meeting(meeting, 'topic', xlsx_file, group_topic_summaries(parse_extracted_topics(extracted_info)))
+    except Exception as e:
+        # フォルダを作れない・データベースを開けないなども含め、出力済みのジョブを失敗にはしません
+        logging.warning(f"全文検索インデックスへの登録に失敗しました: {str(e)}")
+
+def read_transcript_docx(file_path):
+    """文字起こしのWordファイルから本文を読み込む関数"""
+    doc = Document(file_path)
+    return "\n".join(p.text for p in doc.paragraphs if p.text and p.text != TRANSCRIPT_IN_PROGRESS_MARKER)
+
+def read_topic_rows_from_xlsx(file_path):
+    """抽出結果のExcelファイルから（議題, 内容）の行を読み込む関数"""
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    rows = []
+    for label, content in wb.active.iter_rows(min_row=6, max_col=2, values_only=True):
+        if label:
+            rows.append((str(label), str(content or '')))
+    wb.close()
+    return rows
+
+def backfill_search_index(directory=None):
+    """出力先フォルダにある過去の文字起こしと抽出結果をまとめて登録する関数"""
+    directory = directory or load_output_directory() or '.'
+    conn = open_search_index()
+    try:
+        known = dict(conn.execute("SELECT path, mtime_ns FROM indexed_files"))
+    finally:
+        conn.close()
+
+    count = 0
+    for file_path in sorted(Path(directory).glob("*.docx")) + sorted(Path(directory).glob("*.xlsx")):
+        name = file_path.name
+        try:
+            if known.get(str(file_path)) == file_path.stat().st_mtime_ns:
+                continue  # 前回から変わっていないファイルは読み直しません
+            if name.endswith("_文字起こし.docx"):
+                meeting = name[:-len("_文字起こし.docx")]
+                index_meeting(meeting, 'transcript', file_path, [(meeting, read_transcript_docx(file_path))])
+            elif name.endswith("_抽出結果.xlsx"):
+                meeting = name[:-len("_抽出結果.xlsx")]
+                index_meeting(meeting, 'topic', file_path, group_topic_summaries(read_topic_rows_from_xlsx(file_path)))
+            else:
+                continue
+            count += 1
+        except Exception as e:
+            logging.warning(f"{file_path}を全文検索インデックスに登録できませんでした: {str(e)}")
+    logging.info(f"全文検索インデックスに{count}件のファイルを登録しました。")
+    return count
+
+def search_meetings(query, limit=50):
+    """過去の会議を全文検索する関数"""
+    # 3文字以上の語はtrigramの索引、2文字の語は2文字ずつの索引で探します。
+    # 1文字の語だけはLIKEで探します（この場合は少し遅くなります）。
+    terms = query.split()
+    if not terms:
+        return []
+    long_terms = [term for term in terms if len(term) >= 3]
+    two_char_terms = [term for term in terms if len(term) == 2]
+    one_char_terms = [term for term in terms if len(term) == 1]
+
+    def quote(term):
+        return '"' + term.replace('"', '""') + '"'
+
+    conditions = []
+    params = []
+    if long_terms:
+        conditions.append("meeting_fts MATCH ?")
+        params.append(" AND ".join(quote(term) for term in long_terms))
+    if two_char_terms:
+        conditions.append("rowid IN (SELECT rowid FROM meeting_bigram WHERE meeting_bigram MATCH ?)")
+        params.append(" AND ".join(quote(term) for term in two_char_terms))
+    for term in one_char_terms:
+        conditions.append("(title LIKE ? OR body LIKE ?)")
+        params += [f"%{term}%", f"%{term}%"]
+
+    if long_terms:
+        # 該当箇所の切り出しと並べ替えはFTS5に任せます
+        columns = "meeting, kind, source_path, title, snippet(meeting_fts, 4, '【', '】', '…', 24)"
+        order = "ORDER BY bm25(meeting_fts)"
+    else:
+        columns = "meeting, kind, source_path, title, body"
+        order = ""
+    sql = f"SELECT {columns} FROM meeting_fts WHERE {' AND '.join(conditions)} {order} LIMIT ?"
+
+    conn = open_search_index()
+    try:
+        rows = conn.execute(sql, params + [limit]).fetchall()
+    finally:
+        conn.close()
+    if not long_terms:
+        rows = [row[:4] + (make_snippet(row[4], terms[0]),) for row in rows]
+    return [
+        {'meeting': meeting, 'kind': kind, 'source_path': source_path, 'title': title, 'snippet': snippet}
+        for meeting, kind, source_path, title, snippet in rows
+    ]
+
+def make_snippet(text, term, width=24):
+    """本文の中の検索語の前後を切り出す関数（LIKE検索用）"""
+    position = text.find(term)
+    if position < 0:
+        return text[:width * 2]
+    start = max(0, position - width)
+    end = min(len(text), position + len(term) + width)
+    return ("…" if start > 0 else "") + text[start:position] + f"【{term}】" + text[position + len(term):end] + ("…" if end < len(text) else "")
+
 # グローバル変数
-selected_file = None
+selected_audio_files = []  # 選択した音声ファイル（複数選べます）
+selected_xlsx_file = None  # 選択したExcelファイル（音声ファイルとは別に持ちます）
 file_label = None
 excel_file_label = None
-uploading_label = None
-elapsed_time_label = None
+uploading_label = None  # ジョブの件数を表示するラベル
 estimated_time_label = None
+job_tree = None  # ジョブ一覧の表
+chunk_canvas = None  # 選んだジョブのチャンクごとの進捗バー
+job_detail_label = None
+progress_ticks = 0  # drain_progress_eventsが呼ばれた回数
 root = None
-processing_done = False  # 処理が完了したかどうかを示すフラグ
-start_time = None  # 処理開始時刻を保持
-selected_file_name = ""  # 選択したファイル名を保持
 estimated_time_text = ""  # 想定処理時間を保持
 
 def show_main_menu():
-    global root, file_label, excel_file_label, uploading_label, elapsed_time_label, estimated_time_label, selected_file, transcription_prompt, processing_done, start_time, selected_file_name, estimated_time_text
-    selected_file = None
+    global root, file_label, excel_file_label, uploading_label, estimated_time_label, job_tree, transcription_prompt, estimated_time_text
 
     # settings.jsonからプロンプトを再読み込み
     transcription_prompt = load_prompt_from_settings()
@@ -654,6 +4118,7 @@ def show_main_menu():
 
     for widget in root.winfo_children():
         widget.destroy()
+    job_tree = None
  
     root.title("ファイル処理ツール")
     root.geometry("900x500")
@@ -671,6 +4136,18 @@ def show_main_menu():
     usage_button = tk.Button(root, text="使い方", command=show_usage, width=5, height=1)
     usage_button.place(x=800, y=60)  # 設定ボタンの下に配置
 
+    # ジョブ一覧ボタンを使い方ボタンの下に配置
+    jobs_button = tk.Button(root, text="ジョブ", command=show_jobs, width=5, height=1)
+    jobs_button.place(x=800, y=100)
+
+    # 検索ボタンをジョブボタンの下に配置
+    search_button = tk.Button(root, text="検索", command=show_search, width=5, height=1)
+    search_button.place(x=800, y=140)
+
+    # 診断ボタンを検索ボタンの下に配置
+    diagnostics_button = tk.Button(root, text="診断", command=show_diagnostics, width=5, height=1)
+    diagnostics_button.place(x=800, y=180)
+
     # 音声ファイル処理フレーム
     audio_frame = tk.Frame(root, bd=2, relief="groove", width=350, height=400)
     audio_frame.pack_propagate(False)  # フレームのサイズを固定
@@ -683,7 +4160,7 @@ def show_main_menu():
     audio_button.pack(pady=10)
 
     # 選択したファイルを表示するラベル
-    file_label = tk.Label(audio_frame, text=f"選択したファイル\n{selected_file_name}", wraplength=300, justify="center")
+    file_label = tk.Label(audio_frame, text=f"選択したファイル\n{describe_selected_audio_files()}", wraplength=300, justify="center")
     file_label.pack(pady=10)
 
     # 音声ファイルを処理するボタン
@@ -694,23 +4171,10 @@ def show_main_menu():
     estimated_time_label = tk.Label(audio_frame, text=estimated_time_text, font=("Arial", 12))
     estimated_time_label.pack(pady=10)
 
-    # 経過時間を表示するラベル
+    # ジョブの件数を表示するラベル（drain_progress_eventsが更新します）
     uploading_label = tk.Label(audio_frame, text="", font=("Arial", 12))
     uploading_label.pack(pady=10)
-
-    # 処理が進行中の場合、経過時間を更新
-    if start_time and not processing_done:
-        def update_elapsed_time():
-            if not processing_done:
-                elapsed_time = int(time.time() - start_time)
-                minutes, seconds = divmod(elapsed_time, 60)
-                if minutes > 0:
-                    uploading_label.config(text=f"経過時間: {minutes}分{seconds}秒")
-                else:
-                    uploading_label.config(text=f"経過時間: {seconds}秒")
-                root.after(1000, update_elapsed_time)  # 1秒ごとに更新
-
-        update_elapsed_time()
+    render_job_views(set())
 
     # Excelファイル処理フレーム
     excel_frame = tk.Frame(root, bd=2, relief="groove", width=350, height=400)
@@ -723,12 +4187,347 @@ def show_main_menu():
     excel_button = tk.Button(excel_frame, text="Excelファイルを選択する", command=upload_xlsx_file)
     excel_button.pack(pady=10)
  
-    excel_file_label = tk.Label(excel_frame, text="選択したファイル", wraplength=300, justify="center")
+    excel_file_label = tk.Label(excel_frame, text=f"選択したファイル\n{os.path.basename(selected_xlsx_file) if selected_xlsx_file else ''}", wraplength=300, justify="center")
     excel_file_label.pack(pady=10)
  
     process_excel_button = tk.Button(excel_frame, text="Excelファイルを処理する", command=complete_xlsx_upload)
     process_excel_button.pack(pady=(20, 0))
 
+    # 修正した文字起こしから抽出結果と議事録を作り直すボタン
+    reextract_button = tk.Button(excel_frame, text="修正した文字起こしから作り直す", command=reextract_transcript_file)
+    reextract_button.pack(pady=(20, 0))
+
+def show_jobs():
+    """ジョブ一覧の画面を表示する関数"""
+    global job_tree, chunk_canvas, job_detail_label
+    for widget in root.winfo_children():
+        widget.destroy()
+
+    root.title("ジョブ一覧")
+
+    jobs_label = tk.Label(root, text="ジョブ一覧", font=("Arial", 16, "bold"))
+    jobs_label.pack(pady=(20, 10))
+
+    # ジョブごとに1行ずつ表示する表
+    columns = ('id', 'name', 'status', 'progress', 'throughput', 'elapsed')
+    job_tree = ttk.Treeview(root, columns=columns, show='headings', height=10)
+    for column, heading, width in [
+        ('id', '#', 40),
+        ('name', 'ファイル名', 300),
+        ('status', '状態', 150),
+        ('progress', '進捗', 110),
+        ('throughput', '送信速度', 110),
+        ('elapsed', '経過時間', 90),
+    ]:
+        job_tree.heading(column, text=heading)
+        job_tree.column(column, width=width, anchor='w' if column == 'name' else 'center')
+    job_tree.pack(padx=20, pady=10)
+    job_tree.bind('<<TreeviewSelect>>', lambda e: render_job_views(set(), render_all=True))
+
+    # 選んだジョブのチャンクごとの進捗バー
+    job_detail_label = tk.Label(root, text="ジョブを選ぶとチャンクごとの進捗が表示されます", font=("Arial", 12))
+    job_detail_label.pack()
+    chunk_canvas = tk.Canvas(root, width=860, height=60, highlightthickness=0)
+    chunk_canvas.pack(pady=5)
+
+    # 選んだジョブをキャンセルするボタン
+    def cancel_selected_jobs():
+        for iid in job_tree.selection():
+            get_job_queue().cancel(int(iid))
+
+    cancel_button = tk.Button(root, text="選んだジョブをキャンセル", command=cancel_selected_jobs)
+    cancel_button.pack(pady=5)
+
+    render_job_views(set(), render_all=True)
+
+    # 戻るボタンを右上に配置
+    back_button = tk.Button(root, text="戻る", command=show_main_menu, width=5, height=1)
+    back_button.place(x=800, y=20)
+
+def show_search():
+    """過去の会議を全文検索する画面を表示する関数"""
+    for widget in root.winfo_children():
+        widget.destroy()
+
+    root.title("会議の検索")
+
+    search_label = tk.Label(root, text="過去の会議を検索する", font=("Arial", 16, "bold"))
+    search_label.pack(pady=(20, 10))
+
+    query_frame = tk.Frame(root)
+    query_frame.pack(pady=5)
+    query_entry = tk.Entry(query_frame, width=50)
+    query_entry.pack(side="left", padx=5)
+    result_label = tk.Label(root, text="", font=("Arial", 12))
+
+    columns = ('meeting', 'kind', 'snippet')
+    result_tree = ttk.Treeview(root, columns=columns, show='headings', height=14)
+    for column, heading, width in [('meeting', '会議', 220), ('kind', '種類', 80), ('snippet', '該当箇所', 540)]:
+        result_tree.heading(column, text=heading)
+        result_tree.column(column, width=width, anchor='w')
+    result_paths = {}
+
+    def run_search(event=None):
+        query = query_entry.get().strip()
+        result_tree.delete(*result_tree.get_children())
+        result_paths.clear()
+        if not query:
+            return
+        started = time.perf_counter()
+        try:
+            results = search_meetings(query)
+        except sqlite3.Error as e:
+            logging.error(f"全文検索中にエラーが発生しました: {str(e)}")
+            messagebox.showerror("エラー", "検索中にエラーが発生しました。")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for result in results:
+            kind = "文字起こし" if result['kind'] == 'transcript' else "議題"
+            snippet = result['snippet'] if result['kind'] == 'transcript' else f"{result['title']}: {result['snippet']}"
+            iid = result_tree.insert('', 'end', values=(result['meeting'], kind, snippet))
+            result_paths[iid] = result['source_path']
+        result_label.config(text=f"{len(results)}件（{elapsed_ms:.0f}ミリ秒）　ダブルクリックでファイルを開きます")
+
+    def open_result(event=None):
+        for iid in result_tree.selection():
+            webbrowser.open(Path(result_paths[iid]).resolve().as_uri())
+
+    def reindex():
+        # 過去のファイルの読み込みは時間がかかるので、別スレッドで行います
+        def run():
+            count = backfill_search_index()
+            post_to_ui(lambda: messagebox.showinfo("完了", f"{count}件のファイルを検索インデックスに登録しました。"))
+        threading.Thread(target=run, daemon=True).start()
+
+    search_button = tk.Button(query_frame, text="検索", command=run_search)
+    search_button.pack(side="left", padx=5)
+    reindex_button = tk.Button(query_frame, text="過去のファイルを登録", command=reindex)
+    reindex_button.pack(side="left", padx=5)
+    query_entry.bind("<Return>", run_search)
+    result_tree.bind("<Double-1>", open_result)
+    result_label.pack()
+    result_tree.pack(padx=20, pady=10)
+    query_entry.focus_set()
+
+    # 戻るボタンを右上に配置
+    back_button = tk.Button(root, text="戻る", command=show_main_menu, width=5, height=1)
+    back_button.place(x=800, y=20)
+
+def summarize_metrics(snapshot):
+    """指標のスナップショットから（キーごとの行, 全体の説明）を作る関数"""
+    keys = {}
+    def key_row(key):
+        return keys.setdefault(key, {'requests': 0, 'rate_limited': 0, 'errors': 0, 'bytes': 0, 'latency_sum': 0.0, 'latency_count': 0})
+
+    totals = {}
+    caches = {}  # キャッシュの名前 -> {'hit': 回数, 'miss': 回数}
+    for counter in snapshot['counters']:
+        name, labels, value = counter['name'], counter['labels'], counter['value']
+        if 'key' in labels:
+            field = {'minutes_api_requests_total': 'requests', 'minutes_api_rate_limited_total': 'rate_limited',
+                     'minutes_api_errors_total': 'errors', 'minutes_upload_bytes_total': 'bytes'}.get(name)
+            if field:
+                key_row(labels['key'])[field] += value
+        elif name == 'minutes_cache_lookups_total':
+            results = caches.setdefault(labels['cache'], {'hit': 0, 'miss': 0})
+            results[labels['result']] += value
+        else:
+            totals[name] = totals.get(name, 0) + value
+
+    stages = []
+    for histogram in snapshot['histograms']:
+        if histogram['name'] == 'minutes_api_latency_seconds':
+            row = key_row(histogram['labels']['key'])
+            row['latency_sum'] += histogram['sum']
+            row['latency_count'] += histogram['count']
+        elif histogram['name'] == 'minutes_stage_duration_seconds' and histogram['count']:
+            stages.append(f"{histogram['labels']['stage']} {histogram['sum'] / histogram['count']:.1f}秒×{histogram['count']}")
+
+    rows = []
+    for key, row in sorted(keys.items()):
+        average = f"{row['latency_sum'] / row['latency_count']:.1f}秒" if row['latency_count'] else "-"
+        rows.append((key, row['requests'], row['rate_limited'], row['errors'], average, f"{row['bytes'] / (1024 * 1024):.1f}MB"))
+
+    gauges = {}
+    for gauge in snapshot['gauges']:
+        gauges.setdefault(gauge['name'], {})[gauge['labels'].get('status', '')] = gauge['value']
+    jobs = gauges.get('minutes_jobs', {})
+    hit_rates = [f"{name} {results['hit']}/{results['hit'] + results['miss']}" for name, results in sorted(caches.items())]
+    lines = [
+        f"キー待ちのチャンク: {gauges.get('minutes_chunks_waiting', {}).get('', 0)}　"
+        f"待機中のジョブ: {jobs.get('queued', 0)}　処理中のジョブ: {jobs.get('running', 0)}　"
+        f"リトライ: {totals.get('minutes_retries_total', 0)}回",
+        f"キャッシュのヒット: {'、'.join(hit_rates) or '-'}",
+        f"段階ごとの平均時間: {'、'.join(stages) or '-'}",
+    ]
+    return rows, "\n".join(lines)
+
+def show_diagnostics():
+    """APIキーと処理の状態（指標）を表示する画面を表示する関数"""
+    for widget in root.winfo_children():
+        widget.destroy()
+
+    root.title("診断")
+
+    diagnostics_label = tk.Label(root, text="診断", font=("Arial", 16, "bold"))
+    diagnostics_label.pack(pady=(20, 10))
+
+    # APIキーごとに1行ずつ表示する表（キーは指紋だけを表示します）
+    columns = ('key', 'requests', 'rate_limited', 'errors', 'latency', 'uploaded')
+    key_tree = ttk.Treeview(root, columns=columns, show='headings', height=10)
+    for column, heading, width in [
+        ('key', 'APIキー', 160),
+        ('requests', 'リクエスト', 110),
+        ('rate_limited', '429', 90),
+        ('errors', 'エラー', 90),
+        ('latency', '平均応答時間', 130),
+        ('uploaded', '送信量', 110),
+    ]:
+        key_tree.heading(column, text=heading)
+        key_tree.column(column, width=width, anchor='center')
+    key_tree.pack(padx=20, pady=10)
+
+    summary_label = tk.Label(root, text="", justify="left", font=("Arial", 12))
+    summary_label.pack(pady=5)
+
+    def refresh():
+        # 別の画面に移ったら更新をやめます
+        if not key_tree.winfo_exists():
+            return
+        rows, summary = summarize_metrics(metrics.snapshot())
+        key_tree.delete(*key_tree.get_children())
+        for row in rows:
+            key_tree.insert('', 'end', values=row)
+        summary_label.config(text=summary)
+        root.after(1000, refresh)
+
+    refresh()
+
+    # 戻るボタンを右上に配置
+    back_button = tk.Button(root, text="戻る", command=show_main_menu, width=5, height=1)
+    back_button.place(x=800, y=20)
+
+def format_elapsed(seconds):
+    """秒数を「○分○秒」の形にする関数"""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}分{seconds}秒" if minutes > 0 else f"{seconds}秒"
+
+def format_throughput(snapshot):
+    """ジョブの送信速度を表示用の文字列にする関数"""
+    if not snapshot['elapsed'] or not snapshot['bytes_uploaded']:
+        return "-"
+    rate = snapshot['bytes_uploaded'] / snapshot['elapsed']
+    if rate >= 1024 * 1024:
+        return f"{rate / (1024 * 1024):.1f}MB/秒"
+    return f"{rate / 1024:.0f}KB/秒"
+
+def describe_job_status(snapshot):
+    """ジョブ一覧に表示する状態の文字列を作る関数"""
+    label = JOB_STATUS_LABELS[snapshot['status']]
+    if snapshot['status'] == 'running' and snapshot['stage']:
+        label = f"{label}（{snapshot['stage']}）"
+    if snapshot['retries']:
+        label += f" リトライ{snapshot['retries']}回"
+    return label
+
+def draw_chunk_bars(snapshot):
+    """選んだジョブのチャンクごとの状態を色付きのバーで描く関数"""
+    chunk_canvas.delete('all')
+    states = snapshot['chunk_states']
+    job_detail_label.config(text=f"#{snapshot['id']} {snapshot['name']}: チャンク {snapshot['completed_chunks']}/{snapshot['total_chunks']}")
+    if not states:
+        return
+    width = 860 / len(states)
+    for i, state in enumerate(states):
+        label, color = CHUNK_STATE_STYLES[state]
+        chunk_canvas.create_rectangle(i * width + 2, 5, (i + 1) * width - 2, 35, fill=color, outline='')
+        if width >= 60:
+            chunk_canvas.create_text((i + 0.5) * width, 48, text=label, font=("Arial", 9))
+
+def render_job_views(dirty_job_ids, render_all=False):
+    """変化のあったジョブだけ表示を更新する関数"""
+    # この関数はTkのメインスレッドでだけ呼びます。
+    # 画面が切り替わってウィジェットがなくなっている場合は何もしません。
+    jobs = get_job_queue()
+    if uploading_label is not None and uploading_label.winfo_exists():
+        counts = jobs.counts()
+        if counts['queued'] or counts['running']:
+            uploading_label.config(text=f"処理中: {counts['running']}件 / 待機中: {counts['queued']}件")
+        elif counts['done'] or counts['failed']:
+            uploading_label.config(text=f"完了: {counts['done']}件 / 失敗: {counts['failed']}件")
+        else:
+            uploading_label.config(text="")
+
+    if job_tree is None or not job_tree.winfo_exists():
+        return
+    with jobs.lock:
+        snapshot_jobs = list(jobs.jobs)
+    # 一覧から外れた古いジョブの行は消します
+    job_ids = {str(job.id) for job in snapshot_jobs}
+    for iid in job_tree.get_children():
+        if iid not in job_ids:
+            job_tree.delete(iid)
+    selection = job_tree.selection()
+    for job in snapshot_jobs:
+        iid = str(job.id)
+        if not render_all and job.id not in dirty_job_ids and job_tree.exists(iid):
+            continue
+        snapshot = job.snapshot()
+        progress = f"{int(snapshot['progress'] * 100)}%"
+        if snapshot['total_chunks']:
+            progress += f"（{snapshot['completed_chunks']}/{snapshot['total_chunks']}）"
+        values = (snapshot['id'], snapshot['name'], describe_job_status(snapshot), progress,
+                  format_throughput(snapshot), format_elapsed(snapshot['elapsed']))
+        if job_tree.exists(iid):
+            job_tree.item(iid, values=values)
+        else:
+            job_tree.insert('', 'end', iid=iid, values=values)
+        if iid in selection:
+            draw_chunk_bars(snapshot)
+
+def drain_progress_events():
+    """ワーカーから届いた進捗イベントをまとめて処理する関数（Tkのタイマーで呼ばれます）"""
+    global progress_ticks
+    dirty_job_ids = set()
+    # 一度に処理するイベント数に上限を設け、画面が固まらないようにします
+    for _ in range(1000):
+        try:
+            job_id, event = progress_events.get_nowait()
+        except queue.Empty:
+            break
+        if job_id is None:
+            event()  # post_to_uiで頼まれた処理です
+        else:
+            dirty_job_ids.add(job_id)
+
+    # 経過時間を進めるため、1秒ごとに処理中のジョブも更新します
+    progress_ticks += 1
+    if progress_ticks % 5 == 0:
+        jobs = get_job_queue()
+        with jobs.lock:
+            dirty_job_ids.update(job.id for job in jobs.jobs if job.status == 'running')
+
+    if dirty_job_ids or progress_ticks % 5 == 0:
+        render_job_views(dirty_job_ids)
+    root.after(200, drain_progress_events)
+
+def describe_selected_audio_files():
+    """選択した音声ファイルの表示用の文字列を作る関数"""
+    if not selected_audio_files:
+        return ""
+    names = [os.path.basename(path) for path in selected_audio_files]
+    if len(names) > 3:
+        return "\n".join(names[:3]) + f"\nほか{len(names) - 3}件"
+    return "\n".join(names)
+
+def estimate_processing_minutes(file_size_mb):
+    """ファイルサイズから想定処理時間（分）の幅を返す関数"""
+    if file_size_mb <= 10:
+        return 1, 2
+    elif file_size_mb <= 20:
+        return 2, 3
+    return 3, 5
+
 def show_usage():
     for widget in root.winfo_children():
         widget.destroy()
@@ -913,93 +4712,85 @@ def show_settings():
     back_button.place(x=800, y=20)
 
 def upload_audio_file():
-    global selected_file, selected_file_name, estimated_time_text
-    selected_file = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3 *.m4a")])
-    if selected_file:
-        selected_file_name = os.path.basename(selected_file)
-        file_label.config(text=f"選択したファイル\n{selected_file_name}")
-        
-        # ファイルサイズを取得
-        file_size_mb = os.path.getsize(selected_file) / (1024 * 1024)  # MBに変換
-        
-        # 想定処理時間を計算
-        if file_size_mb <= 10:
-            estimated_time = "1〜2分"
-        elif file_size_mb <= 20:
-            estimated_time = "2〜3分"
-        else:
-            estimated_time = "3〜5分"
-        
+    global selected_audio_files, estimated_time_text
+    files = filedialog.askopenfilenames(filetypes=[("Audio Files", "*.wav *.mp3 *.m4a")])
+    if files:
+        selected_audio_files = list(files)
+        file_label.config(text=f"選択したファイル\n{describe_selected_audio_files()}")
+
+        # ファイルごとの想定処理時間を足し合わせ、同時に処理できる数で割ります
+        low = high = 0
+        for path in selected_audio_files:
+            file_low, file_high = estimate_processing_minutes(os.path.getsize(path) / (1024 * 1024))  # MBに変換
+            low += file_low
+            high += file_high
+        concurrency = min(load_max_concurrent_jobs(), len(selected_audio_files))
+        low, high = -(-low // concurrency), -(-high // concurrency)  # 切り上げます
+
         # 想定処理時間を表示
-        estimated_time_text = f"想定処理時間：約{estimated_time}"
+        estimated_time_text = f"想定処理時間：約{low}〜{high}分"
         estimated_time_label.config(text=estimated_time_text)
 
 def complete_audio_upload():
-    global start_time, processing_done
-    if selected_file:
-        start_time = time.time()  # 処理開始時刻を記録
-        processing_done = False
-        root.update_idletasks()
-        processed_files = load_processed_files()
-        threading.Thread(target=process_audio_file_async, args=(selected_file, processed_files, start_time)).start()
-    else:
+    global selected_audio_files, estimated_time_text
+    if not selected_audio_files:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
+        return
+
+    # プロンプトが空でないか確認（ジョブサーバーに送るときはサーバー側のプロンプトを使います）
+    if not transcription_prompt and not isinstance(get_job_queue(), RemoteJobQueue):
+        logging.error("プロンプトが空です。音声ファイルの処理を中止します。")
+        messagebox.showerror("エラー", "プロンプトが空です。処理を中止します。")
+        return
+
+    # 選択したファイルをすべてジョブキューに入れます（同時に動く数はキューが制限します）
+    # 短いファイルをまとめるために音声の長さを調べるので、別スレッドで受け付けます
+    audio_files = list(selected_audio_files)
+
+    def submit():
+        try:
+            get_job_queue().submit_batch(audio_files)
+        except Exception as e:
+            message = f"音声ファイルの受け付け中にエラーが発生しました:\n{str(e)}"
+            logging.exception(message)
+            post_to_ui(lambda: messagebox.showerror("エラー", message))
+
+    threading.Thread(target=submit, daemon=True).start()
+
+    # 選択したファイル情報と想定処理時間をリセット
+    selected_audio_files = []
+    estimated_time_text = ""
+    file_label.config(text="選択したファイル\n")
+    estimated_time_label.config(text="")
 
 def upload_xlsx_file():
-    global selected_file
-    selected_file = filedialog.askopenfilename(filetypes=[("Excel Files", "*.xlsx")])
-    if selected_file:
-        excel_file_label.config(text=f"選択したファイル\n{os.path.basename(selected_file)}")
+    global selected_xlsx_file
+    file_path = filedialog.askopenfilename(filetypes=[("Excel Files", "*.xlsx")])
+    if file_path:
+        selected_xlsx_file = file_path
+        excel_file_label.config(text=f"選択したファイル\n{os.path.basename(selected_xlsx_file)}")
 
 def complete_xlsx_upload():
-    if selected_file:
+    if selected_xlsx_file:
         root.update_idletasks()
-        threading.Thread(target=process_xlsx_file_async, args=(selected_file,)).start()
+        threading.Thread(target=process_xlsx_file_async, args=(selected_xlsx_file,)).start()
     else:
         messagebox.showwarning("警告", "ファイルが選択されていません。")
 
-def process_audio_file_async(audio_file, processed_files, start_time):
-    global processing_done, selected_file, selected_file_name, estimated_time_text
-
-    def update_elapsed_time():
-        if not processing_done:
-            elapsed_time = int(time.time() - start_time)
-            minutes, seconds = divmod(elapsed_time, 60)
-            if minutes > 0:
-                uploading_label.config(text=f"経過時間: {minutes}分{seconds}秒")
-            else:
-                uploading_label.config(text=f"経過時間: {seconds}秒")
-            root.after(1000, update_elapsed_time)  # 1秒ごとに更新
-
-    threading.Thread(target=update_elapsed_time, daemon=True).start()
-
-    # プロンプトが空でないか確認
-    if not transcription_prompt:  # ここでグローバル変数を参照
-        logging.error("プロンプトが空です。音声ファイルの処理を中止します。")
-        processing_done = True  # 経過時間の更新を停止
-        root.after(0, lambda: messagebox.showerror("エラー", "プロンプトが空です。処理を中止します。"))
-        return  # 処理を中止
+def reextract_transcript_file():
+    """修正した文字起こしのWordファイルを選んで、抽出結果と議事録を作り直す関数"""
+    transcript_file = filedialog.askopenfilename(filetypes=[("Word files", "*_文字起こし.docx *.docx")])
+    if not transcript_file:
+        return
 
-    try:
-        logging.info(f"{audio_file}の処理を開始します。")
-        success = process_audio_file(audio_file, processed_files)
-        processing_done = True
-        total_elapsed_time = int(time.time() - start_time)
-        minutes, seconds = divmod(total_elapsed_time, 60)
-        if minutes > 0:
-            root.after(0, lambda: uploading_label.config(text=f"処理にかかった時間: {minutes}分{seconds}秒で処理が完了しました"))
+    def run():
+        xlsx_path = reextract_transcript(transcript_file)
+        if xlsx_path:
+            post_to_ui(lambda: messagebox.showinfo("完了", f"抽出結果と議事録を作り直しました。\n{os.path.basename(xlsx_path)}"))
         else:
-            root.after(0, lambda: uploading_label.config(text=f"処理にかかった時間: {seconds}秒で処理が完了しました"))
+            post_to_ui(lambda: messagebox.showerror("エラー", "抽出結果の作り直しに失敗しました。"))
 
-        if success:
-            # 処理が成功した場合、選択したファイル情報と想定処理時間をリセット
-            root.after(0, lambda: reset_file_info())
-            root.after(0, lambda: (messagebox.showinfo("完了", "ファイルのアップロードが完了しました。"), show_main_menu()))
-        else:
-            root.after(0, lambda: messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。"))
-    except Exception as e:
-        logging.exception(f"音声ファイルの処理中にエラーが発生しました: {str(e)}")
-        root.after(0, lambda: messagebox.showerror("エラー", "音声ファイルの処理中にエラーが発生しました。"))
+    threading.Thread(target=run, daemon=True).start()
 
 def process_xlsx_file_async(xlsx_file):
     template_path = os.path.join(get_current_dir(), 'テンプレート.docx')  # dist直下から取得
@@ -1007,10 +4798,11 @@ def process_xlsx_file_async(xlsx_file):
     output_path = os.path.join(output_directory, f"{os.path.splitext(os.path.basename(xlsx_file))[0]}_議事録.docx")
     
     success = create_minutes(xlsx_file, template_path, output_path)
+    # メッセージの表示はTkのメインスレッドに頼みます
     if success:
-        root.after(0, lambda: (messagebox.showinfo("完了", "議事録の作成が完了しました。"), show_main_menu()))
+        post_to_ui(lambda: (messagebox.showinfo("完了", "議事録の作成が完了しました。"), show_main_menu()))
     else:
-        messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。")
+        post_to_ui(lambda: messagebox.showerror("エラー", "ファイルの処理中にエラーが発生しました。"))
 
 def load_api_keys():
     """settings.jsonからAPIキーを読み込む関数"""
@@ -1044,18 +4836,115 @@ def save_api_keys_to_settings(api_keys_text):
         logging.error(f"APIキーの保存中にエラーが発生しました: {str(e)}")
         messagebox.showerror("エラー", "APIキーの保存中にエラーが発生しました。")
 
-def main():
-    global root, transcription_prompt  # グローバル変数を宣言
+def parse_args(argv=None):
+    """コマンドライン引数を解析する関数"""
+    arg_parser = argparse.ArgumentParser(description="⚡️爆速議事録")
+    arg_parser.add_argument('--watch', nargs='?', const='', default=None, metavar='DIR',
+                            help="フォルダを監視して音声ファイルを自動で処理します（省略時はsettings.jsonのwatch_directory）")
+    arg_parser.add_argument('--search', metavar='QUERY',
+                            help="過去の会議の文字起こしと議題を全文検索します")
+    arg_parser.add_argument('--serve', nargs='?', const='', default=None, metavar='HOST:PORT',
+                            help="チームで共有するジョブサーバーを起動します（省略時はsettings.jsonのserver_hostとserver_port）")
+    arg_parser.add_argument('--dry-run', nargs='+', metavar='FILE',
+                            help="音声ファイルを処理せずに、必要なリクエスト数・トークン数・時間と今日の上限に収まるかを表示します")
+    arg_parser.add_argument('--enqueue', nargs='+', metavar='FILE',
+                            help="音声ファイルを共有キュー（settings.jsonのshared_queue_path）に登録します")
+    arg_parser.add_argument('--worker', action='store_true',
+                            help="共有キューのジョブとチャンクを処理するワーカーとして動きます")
+    arg_parser.add_argument('--queue-status', action='store_true',
+                            help="共有キューのジョブごとの進み具合を表示します")
+    arg_parser.add_argument('--reextract', nargs='+', metavar='DOCX',
+                            help="修正した文字起こし（_文字起こし.docx）から、変わった議題だけを抽出し直してExcelと議事録を作り直します")
+    arg_parser.add_argument('--reindex', nargs='?', const='', default=None, metavar='DIR',
+                            help="出力先フォルダの文字起こしと抽出結果を全文検索インデックスに登録します")
+    return arg_parser.parse_args(argv)
+
+def print_search_results(query):
+    """全文検索の結果をコンソールに表示する関数"""
+    started = time.perf_counter()
+    results = search_meetings(query)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"「{query}」の検索結果: {len(results)}件（{elapsed_ms:.0f}ミリ秒）")
+    for result in results:
+        kind = "文字起こし" if result['kind'] == 'transcript' else "議題"
+        print(f"- {result['meeting']} [{kind}] {result['title'] if result['kind'] == 'topic' else ''}")
+        print(f"    {result['snippet']}")
+        print(f"    {result['source_path']}")
+
+def main(argv=None):
+    global root, transcription_prompt, ui_events_enabled, job_queue  # グローバル変数を宣言
+    args = parse_args(argv)
     try:
         logging.info("プロンプトをロード中...")  # 追加: ロード開始ログ
         transcription_prompt = load_prompt_from_settings()  # プロンプトをロード
         logging.info(f"取得したプロンプト: {transcription_prompt}")  # プロンプトの内容をログに出力
         logging.info("プロンプトのロードが完了しました。")  # 追加: ロード完了ログ
+
+        if args.reindex is not None:
+            backfill_search_index(args.reindex or None)
+            if args.search is None:
+                return
+        if args.search is not None:
+            print_search_results(args.search)
+            return
+
+        start_metrics_snapshots()
+
+        if args.watch is not None:
+            # 監視モードではGUIを起動しません
+            if not transcription_prompt:
+                logging.error("プロンプトが空です。監視モードを開始できません。")
+                return
+            watch_folder(args.watch or None)
+            return
+
+        if args.dry_run:
+            print_batch_plan(args.dry_run)
+            return
+        if args.reextract:
+            for path in args.reextract:
+                reextract_transcript(path)
+            return
+        if args.enqueue:
+            shared_queue = open_shared_queue()
+            if shared_queue is not None:
+                output_directory = load_output_directory()
+                for path in args.enqueue:
+                    job_id = shared_queue.enqueue(path, output_directory)
+                    logging.info(f"{os.path.basename(path)}を共有ジョブ#{job_id}として登録しました。")
+            return
+        if args.queue_status:
+            print_shared_queue_status()
+            return
+        if args.worker:
+            if not transcription_prompt:
+                logging.error("プロンプトが空です。ワーカーを開始できません。")
+                return
+            run_shared_worker()
+            return
+
+        if args.serve is not None:
+            # サーバーモードでもGUIは起動しません
+            if not transcription_prompt:
+                logging.error("プロンプトが空です。ジョブサーバーを開始できません。")
+                return
+            serve_jobs(args.serve or None)
+            return
+
         root = tk.Tk()
         root.title("ファイル処理ツール")
         root.geometry("500x300")
 
+        # ここから先、ワーカーの進捗はキューを通してGUIに届きます
+        ui_events_enabled = True
+
+        # ジョブサーバーが設定されていれば、GUIはサーバーにジョブを送る窓口になります
+        server_url = load_settings().get('server_url', '')
+        if server_url:
+            logging.info(f"ジョブサーバー {server_url} にジョブを送ります。")
+            job_queue = RemoteJobQueue(server_url, load_settings().get('server_token', ''))
         show_main_menu()
+        drain_progress_events()  # 進捗イベントを200ミリ秒ごとに取り出します
 
         root.mainloop()
     except Exception as e:
@@ -1117,14 +5006,6 @@ def ensure_settings_exist():
 # 確認と作成を実行
 ensure_settings_exist()
 
-def reset_file_info():
-    global selected_file, selected_file_name, estimated_time_text
-    selected_file = None
-    selected_file_name = ""
-    estimated_time_text = ""
-    file_label.config(text="選択したファイル\n")
-    estimated_time_label.config(text="")
-
 if __name__ == "__main__":
     main()
 
@@ -16,7 +16,7 @@ a = Analysis(
     ],
     hiddenimports=[
         'tkinter', 
-        'google.generativeai', 
+        'google.ai.generativelanguage', 
         'openpyxl', 
         'dotenv', 
         'docx'
@@ -0,0 +1,17 @@
+"""テストの共通設定
+
+minutes_appは読み込むときにホームフォルダのDocumentsへログを書き、設定や索引を
+ホームフォルダの.my_appに置きます。利用者のファイルにさわらないよう、
+テストの間はホームフォルダを一時フォルダに差し替えます。
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_home = tempfile.mkdtemp(prefix="minutes_app_tests_")
+os.environ['HOME'] = _home
+os.environ['USERPROFILE'] = _home  # Windowsのホームフォルダ
+(Path(_home) / "Documents").mkdir()
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,80 @@
+"""短い音声のまとめ送り（見出しでの分け直しと組の作り方）と、大きさによる分割数のテスト"""
+import pytest
+
+import minutes_app
+
+def test_split_coalesced_text():
+    text = "【音声1】\nおはようございます。\n【音声2】本日の議題です。\n\n【音声3】 以上です。"
+    assert minutes_app.split_coalesced_text(text, 3) == ["おはようございます。", "本日の議題です。", "以上です。"]
+
+def test_split_coalesced_text_ignores_text_before_first_header():
+    text = "以下が文字起こしです。\n【音声1】一件目\n【音声2】二件目"
+    assert minutes_app.split_coalesced_text(text, 2) == ["一件目", "二件目"]
+
+def test_split_coalesced_text_accepts_headers_out_of_order():
+    assert minutes_app.split_coalesced_text("【音声2】二件目【音声1】一件目", 2) == ["一件目", "二件目"]
+
+@pytest.mark.parametrize("text", [
+    "【音声1】一件目",  # 見出しが足りない
+    "【音声1】一件目【音声2】二件目【音声3】三件目",  # 見出しが多い
+    "【音声1】一件目【音声1】もう一度【音声2】二件目",  # 見出しが重複している
+    "【音声1】\n【音声2】二件目",  # 本文が空
+    "【音声1】一件目【音声3】三件目",  # 番号が飛んでいる
+    "見出しのない文字起こし",
+])
+def test_split_coalesced_text_rejects_malformed_output(text):
+    assert minutes_app.split_coalesced_text(text, 2) is None
+
+@pytest.fixture
+def split_settings():
+    settings = minutes_app.load_split_settings()
+    settings.update(coalesce=True, coalesce_max_file_seconds=600, coalesce_max_seconds=900,
+                    coalesce_max_files=5, inline_max_bytes=1000)
+    return settings
+
+def make_audio_files(tmp_path, monkeypatch, sizes_and_durations):
+    """指定した大きさのファイルを作り、長さの取得を差し替える"""
+    durations = {}
+    paths = []
+    for i, (size, duration) in enumerate(sizes_and_durations):
+        path = tmp_path / f"audio{i}.mp3"
+        path.write_bytes(b"\x00" * size)
+        durations[str(path)] = duration
+        paths.append(str(path))
+    monkeypatch.setattr(minutes_app, 'get_audio_duration', lambda path: durations[path])
+    return paths
+
+def test_group_short_files_limits_total_bytes(tmp_path, monkeypatch, split_settings):
+    paths = make_audio_files(tmp_path, monkeypatch, [(400, 60), (400, 60), (400, 60), (400, 60)])
+    groups = minutes_app.group_short_files(paths, split_settings)
+    assert groups[paths[0]] == groups[paths[1]] == paths[:2]
+    assert groups[paths[2]] == groups[paths[3]] == paths[2:]
+
+def test_group_short_files_skips_large_and_long_files(tmp_path, monkeypatch, split_settings):
+    paths = make_audio_files(tmp_path, monkeypatch, [(100, 60), (1200, 60), (100, 700), (100, 60)])
+    groups = minutes_app.group_short_files(paths, split_settings)
+    assert set(groups) == {paths[0], paths[3]}
+    assert groups[paths[0]] == [paths[0], paths[3]]
+
+def test_group_short_files_skips_files_without_duration(tmp_path, monkeypatch, split_settings):
+    paths = make_audio_files(tmp_path, monkeypatch, [(100, 60), (100, 60), (100, 60)])
+
+    def get_audio_duration(path):
+        if path == paths[1]:
+            raise RuntimeError("ffprobeが見つかりません")
+        return 60
+
+    monkeypatch.setattr(minutes_app, 'get_audio_duration', get_audio_duration)
+    assert minutes_app.group_short_files(paths, split_settings)[paths[0]] == [paths[0], paths[2]]
+
+def test_num_parts_bounds_splits_large_short_audio(split_settings):
+    # 短い音声でも、1回のリクエストに載せられない大きさなら分けます
+    assert minutes_app.num_parts_bounds(300, split_settings) == (1, 1)
+    assert minutes_app.num_parts_bounds(300, split_settings, file_size=900) == (1, 1)
+    assert minutes_app.num_parts_bounds(300, split_settings, file_size=2500)[0] == 3
+    assert minutes_app.inline_parts_needed(2500, split_settings) == 3
+
+def test_choose_num_parts_never_goes_below_size_limit(split_settings):
+    assert minutes_app.choose_num_parts(3600, 1, split_settings) == 5
+    assert minutes_app.choose_num_parts(3600, 1, split_settings, file_size=8000) == 9
+    assert minutes_app.choose_num_parts(3600, 20, split_settings, file_size=8000) == 12
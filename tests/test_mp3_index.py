@@ -0,0 +1,83 @@
+"""MP3フレームヘッダーとXing/Infoフレームの解析のテスト"""
+import struct
+
+import minutes_app
+
+# MPEG1 レイヤー3・128kbps・44.1kHz・ステレオ・パディングなしのフレームヘッダー
+HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+FRAME_LENGTH = 144 * 128000 // 44100  # 417バイト
+
+def make_frame(payload=b""):
+    """ヘッダーの後ろをpayloadとゼロで埋めた1フレームを作る"""
+    return (HEADER + payload).ljust(FRAME_LENGTH, b"\x00")
+
+def make_info_frame(num_frames, delay, padding):
+    """フレーム数とLAMEタグ（遅延・パディング）を持つXingの情報フレームを作る"""
+    side_info = b"\x00" * 32  # MPEG1・ステレオのサイド情報
+    lame = b"LAME3.100" + b"\x00" * 12 + bytes([delay >> 4, ((delay & 0x0F) << 4) | (padding >> 8), padding & 0xFF])
+    return make_frame(side_info + b"Xing" + struct.pack(">I", 0x01) + struct.pack(">I", num_frames) + lame)
+
+def make_id3v2_tag(size):
+    """指定した大きさの本文を持つID3v2タグを作る（サイズは7ビットずつの形式です）"""
+    encoded = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x04\x00\x00" + encoded + b"\x00" * size
+
+def test_parse_mp3_frame_header():
+    frame = minutes_app.parse_mp3_frame_header(HEADER)
+    assert frame['layer'] == 3
+    assert frame['is_mpeg1']
+    assert frame['sample_rate'] == 44100
+    assert frame['samples'] == 1152
+    assert frame['length'] == FRAME_LENGTH
+    assert not frame['mono']
+
+def test_parse_mp3_frame_header_with_padding_and_mono():
+    frame = minutes_app.parse_mp3_frame_header(bytes([0xFF, 0xFB, 0x92, 0xC0]))
+    assert frame['length'] == FRAME_LENGTH + 1
+    assert frame['mono']
+
+def test_parse_mp3_frame_header_rejects_invalid_headers():
+    assert minutes_app.parse_mp3_frame_header(b"\x00\xFB\x90\x00") is None  # 同期ビットがない
+    assert minutes_app.parse_mp3_frame_header(bytes([0xFF, 0xFB, 0xF0, 0x00])) is None  # ビットレート15は予約値
+    assert minutes_app.parse_mp3_frame_header(bytes([0xFF, 0xFB, 0x0C, 0x00])) is None  # 自由フォーマット
+    assert minutes_app.parse_mp3_frame_header(bytes([0xFF, 0xEB, 0x90, 0x00])) is None  # バージョン1は予約値
+
+def test_read_info_frame():
+    data = make_info_frame(num_frames=20, delay=576, padding=1000)
+    frame = minutes_app.parse_mp3_frame_header(data[:4])
+    assert minutes_app._read_info_frame(data, 0, frame) == {'frames': 20, 'delay': 576, 'padding': 1000}
+    assert minutes_app._read_info_frame(make_frame(), 0, frame) is None
+
+def test_build_mp3_frame_index(tmp_path):
+    path = tmp_path / "synthetic.mp3"
+    path.write_bytes(make_id3v2_tag(100) + make_info_frame(20, 576, 1000) + make_frame() * 20)
+    index = minutes_app.build_mp3_frame_index(str(path))
+    assert index['num_frames'] == 20
+    assert index['sample_rate'] == 44100
+    # 情報フレームは数えず、エンコーダーの遅延とパディングを除いた長さになります
+    assert index['duration'] == (20 * 1152 - 576 - 1000) / 44100
+    first_audio = 10 + 100 + FRAME_LENGTH
+    assert list(index['offsets']) == [first_audio + i * FRAME_LENGTH for i in range(21)]
+
+def test_build_mp3_frame_index_skips_garbage_between_frames(tmp_path):
+    path = tmp_path / "garbage.mp3"
+    path.write_bytes(make_frame() * 3 + b"\x12\x34\xFF\x00" + make_frame() * 2)
+    index = minutes_app.build_mp3_frame_index(str(path))
+    assert index['num_frames'] == 5
+    assert index['duration'] == 5 * 1152 / 44100
+
+def test_build_mp3_frame_index_rejects_non_mp3(tmp_path):
+    path = tmp_path / "not_audio.mp3"
+    path.write_bytes(b"this is not an mp3 file" * 10)
+    assert minutes_app.build_mp3_frame_index(str(path)) is None
+
+def test_read_mp3_frames_cuts_on_frame_boundaries(tmp_path):
+    path = tmp_path / "cut.mp3"
+    path.write_bytes(make_frame() * 10)
+    index = minutes_app.build_mp3_frame_index(str(path))
+    # フレームの途中から途中までを指定すると、その両端のフレームを含めて切り出します
+    data = minutes_app.read_mp3_frames(str(path), index, 2.5 * index['frame_duration'], 2 * index['frame_duration'])
+    assert data == make_frame() * 3
+    # 範囲がファイルの外まで伸びても、最後のフレームで止まります
+    data = minutes_app.read_mp3_frames(str(path), index, 8.5 * index['frame_duration'], 10 * index['frame_duration'])
+    assert len(data) == 2 * FRAME_LENGTH
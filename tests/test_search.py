@@ -0,0 +1,48 @@
+"""過去の会議の全文検索（1文字・2文字・3文字以上の語）のテスト"""
+import pytest
+
+import minutes_app
+
+@pytest.fixture(autouse=True)
+def search_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(minutes_app, 'get_search_index_path', lambda: tmp_path / "search_index.sqlite3")
+    minutes_app.index_meeting("4月定例会", 'transcript', tmp_path / "4月定例会_文字起こし.docx",
+                              [("4月定例会", "来年度の予算案について審議しました。会場は市民ホールです。")])
+    minutes_app.index_meeting("5月定例会", 'topic', tmp_path / "5月定例会_抽出結果.xlsx",
+                              [("防災訓練の日程", "9月に避難訓練を行うことを決めました。"),
+                               ("広報誌", "次号の原稿の締め切りを確認しました。")])
+
+def meetings(query):
+    return sorted((hit['meeting'], hit['title']) for hit in minutes_app.search_meetings(query))
+
+def test_search_three_or_more_chars():
+    assert meetings("市民ホール") == [("4月定例会", "4月定例会")]
+    hits = minutes_app.search_meetings("避難訓練")
+    assert [(hit['meeting'], hit['kind'], hit['title']) for hit in hits] == [("5月定例会", 'topic', "防災訓練の日程")]
+    assert "【避難訓練】" in hits[0]['snippet']
+    assert meetings("体育館") == []
+
+def test_search_two_chars():
+    assert meetings("予算") == [("4月定例会", "4月定例会")]
+    assert meetings("訓練") == [("5月定例会", "防災訓練の日程")]
+    hits = minutes_app.search_meetings("原稿")
+    assert "【原稿】" in hits[0]['snippet']
+    assert meetings("議事") == []
+
+def test_search_one_char():
+    assert meetings("案") == [("4月定例会", "4月定例会")]
+    assert meetings("号") == [("5月定例会", "広報誌")]
+    assert meetings("決") == [("5月定例会", "防災訓練の日程")]
+    assert meetings("鳥") == []
+
+def test_search_mixed_term_lengths_must_all_match():
+    assert meetings("審議 予算 案") == [("4月定例会", "4月定例会")]
+    assert meetings("審議しました 訓練") == []
+    assert meetings("") == []
+
+def test_reindexing_replaces_old_entries(tmp_path):
+    minutes_app.index_meeting("4月定例会", 'transcript', tmp_path / "4月定例会_文字起こし.docx",
+                              [("4月定例会", "議題は体育館の改修です。")])
+    assert meetings("予算") == []
+    assert meetings("市民ホール") == []
+    assert meetings("改修") == [("4月定例会", "4月定例会")]
@@ -0,0 +1,90 @@
+"""共有キュー（SQLite）のリースの期限切れと引き継ぎのテスト"""
+import time
+
+import pytest
+
+import minutes_app
+
+LEASE_SECONDS = 0.2
+
+@pytest.fixture
+def queue(tmp_path):
+    return minutes_app.SharedJobQueue(tmp_path / "queue.sqlite3", lease_seconds=LEASE_SECONDS, max_attempts=2)
+
+def wait_for_expiry():
+    time.sleep(LEASE_SECONDS * 3)
+
+def planned_job(queue, tmp_path, ranges=((0, 600), (590, 400))):
+    """分割計画まで済んだジョブを1つ作る"""
+    job_id = queue.enqueue(str(tmp_path / "meeting.mp3"), str(tmp_path))
+    kind, row = queue.claim('planner')
+    assert (kind, row['id']) == ('plan', job_id)
+    assert queue.set_plan(job_id, 'planner', list(ranges))
+    return job_id
+
+def chunk_statuses(queue, job_id):
+    with queue.transaction() as conn:
+        rows = conn.execute("SELECT status, owner, attempts FROM shared_chunks WHERE job_id = ? ORDER BY idx",
+                            (job_id,)).fetchall()
+    return [tuple(row) for row in rows]
+
+def test_expired_chunk_is_reclaimed_by_another_worker(queue, tmp_path):
+    job_id = planned_job(queue, tmp_path)
+    kind, chunk = queue.claim('worker-a')
+    assert (kind, chunk['idx']) == ('chunk', 0)
+    wait_for_expiry()
+    # 止まったワーカーのチャンクは、やり直し回数を1つ使ってほかのワーカーに渡ります
+    kind, chunk = queue.claim('worker-b')
+    assert (kind, chunk['idx'], chunk['attempts']) == ('chunk', 0, 1)
+    # 期限が切れたあとに戻ってきた結果は捨てられます
+    assert not queue.complete_chunk(job_id, 0, 'worker-a', "古い結果")
+    assert queue.complete_chunk(job_id, 0, 'worker-b', "新しい結果")
+    assert chunk_statuses(queue, job_id)[0] == ('done', 'worker-b', 1)
+
+def test_heartbeat_keeps_the_lease(queue, tmp_path):
+    job_id = planned_job(queue, tmp_path, ranges=((0, 600),))
+    queue.claim('worker-a')
+    for _ in range(4):
+        time.sleep(LEASE_SECONDS / 2)
+        queue.heartbeat('worker-a')
+    assert queue.claim('worker-b') is None
+    assert queue.complete_chunk(job_id, 0, 'worker-a', "結果")
+
+def test_chunk_fails_after_max_attempts(queue, tmp_path):
+    job_id = planned_job(queue, tmp_path, ranges=((0, 600),))
+    queue.claim('worker-a')
+    wait_for_expiry()
+    queue.claim('worker-b')
+    wait_for_expiry()
+    # やり直せる回数を使い切ったチャンクは失敗になり、ジョブは情報抽出へ進みます
+    kind, job = queue.claim('worker-c')
+    assert (kind, job['id']) == ('finalize', job_id)
+    assert chunk_statuses(queue, job_id) == [('failed', None, 2)]
+    assert queue.chunk_texts(job_id) == [None]
+
+def test_expired_planning_lease_returns_job_to_pending(queue, tmp_path):
+    job_id = queue.enqueue(str(tmp_path / "meeting.mp3"), str(tmp_path))
+    queue.claim('worker-a')
+    wait_for_expiry()
+    kind, job = queue.claim('worker-b')
+    assert (kind, job['id'], job['attempts']) == ('plan', job_id, 1)
+    # リースを失ったワーカーの分割計画は登録されません
+    assert not queue.set_plan(job_id, 'worker-a', [(0, 600)])
+    assert queue.set_plan(job_id, 'worker-b', [(0, 600)])
+
+def test_expired_planning_lease_fails_job_after_max_attempts(queue, tmp_path):
+    job_id = queue.enqueue(str(tmp_path / "meeting.mp3"), str(tmp_path))
+    queue.claim('worker-a')
+    wait_for_expiry()
+    queue.claim('worker-b')
+    wait_for_expiry()
+    assert queue.claim('worker-c') is None
+    jobs, _ = queue.status()
+    assert (jobs[0]['id'], jobs[0]['status']) == (job_id, 'failed')
+    assert jobs[0]['error']
+
+def test_release_does_not_use_an_attempt(queue, tmp_path):
+    job_id = planned_job(queue, tmp_path, ranges=((0, 600),))
+    kind, chunk = queue.claim('worker-a')
+    queue.release(kind, chunk, 'worker-a')
+    assert chunk_statuses(queue, job_id) == [('pending', None, 0)]